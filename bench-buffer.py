@@ -0,0 +1,73 @@
+# Compare per-append cost of the columnar SampleBuffer against the old
+# one-row DataFrame + pd.concat approach.
+#
+# usage: python bench-buffer.py [max_samples] [concat_samples]
+
+import sys
+import time
+import random
+import pandas as pd
+from bufferz import SampleBuffer
+
+MAX_SAMPLES = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+CONCAT_SAMPLES = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+
+def fakeSample(i):
+    return {
+        "soil1_temp": 60.0 + random.random(),
+        "soil2_temp": 61.0 + random.random(),
+        "moist": random.randint(300, 900),
+        "uva": random.random() * 100,
+        "timestamp": 1700000000.0 + i*90,
+    }
+
+def checkpoints(limit):
+    n = 1000
+    while n <= limit:
+        yield n
+        n *= 10
+
+def benchBuffer(limit):
+    buffer = SampleBuffer()
+    results = []
+    last_n = 0
+    last_t = time.perf_counter()
+
+    for n in checkpoints(limit):
+        for i in range(last_n, n):
+            buffer.append(fakeSample(i))
+        now = time.perf_counter()
+        results.append((n, (now - last_t) / (n - last_n)))
+        last_n, last_t = n, now
+
+    start = time.perf_counter()
+    buffer.toDataFrame()
+    return results, time.perf_counter() - start
+
+def benchConcat(limit):
+    dataFrame = None
+    results = []
+    last_n = 0
+    last_t = time.perf_counter()
+
+    for n in checkpoints(limit):
+        for i in range(last_n, n):
+            df = pd.DataFrame([fakeSample(i)])
+            dataFrame = df if dataFrame is None else pd.concat([dataFrame, df], ignore_index=True)
+        now = time.perf_counter()
+        results.append((n, (now - last_t) / (n - last_n)))
+        last_n, last_t = n, now
+
+    return results
+
+if __name__ == "__main__":
+    buffer_results, materialize = benchBuffer(MAX_SAMPLES)
+    concat_results = dict(benchConcat(CONCAT_SAMPLES))
+
+    print(f"{'samples':>10} {'buffer us/append':>18} {'concat us/append':>18}")
+    for n, per_append in buffer_results:
+        concat = concat_results.get(n)
+        concat_text = f"{concat*1e6:18.2f}" if concat is not None else f"{'-':>18}"
+        print(f"{n:>10} {per_append*1e6:18.2f} {concat_text}")
+
+    print(f"DataFrame materialization of {MAX_SAMPLES} samples: {materialize:.3f} s")
@@ -0,0 +1,110 @@
+# Size and speed of the record formats in codecz, and what they save on the way
+# to RangerLab: the same records are uploaded as plain JSON, compressed, and
+# compressed in bundles over a LocalSftpServer behind a Wi-Fi sized SlowLink,
+# then read back through ArchiveRecord to check nothing was lost.
+#
+# usage: python bench-codec.py [records] [samples per record] [link kbps] [link latency ms]
+
+import sys
+import io
+import os
+import time
+import shutil
+import tempfile
+import contextlib
+import pandas as pd
+from fakez import LocalSftpServer, SlowLink, fakeReading
+from recordz import ArchiveRecord, toDateStr
+from remotez import SftpPool, UploadWorker, ArchiveFetcher
+from cachez import ArchiveCache
+import codecz
+
+RECORDS = int(sys.argv[1]) if len(sys.argv) > 1 else 36
+SAMPLES = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+LINK_KBPS = float(sys.argv[3]) if len(sys.argv) > 3 else 2000 # what the garden Pi gets at the edge of the Wi-Fi
+LINK_LATENCY = float(sys.argv[4]) / 1000 if len(sys.argv) > 4 else 0.03 # [s]
+BUNDLE = 12 # [records] per bundle, two hours' worth
+START = time.mktime((2024, 6, 1, 0, 0, 0, 0, 0, -1))
+
+FORMATS = [("rows", False, None), ("rows gzip", False, "gzip"), ("columns gzip", True, "gzip")]
+if codecz.zstandard is not None:
+    FORMATS += [("rows zstd", False, "zstd"), ("columns zstd", True, "zstd")]
+
+def makeRecords():
+    records = []
+    units = fakeReading()["sensor_units"]
+    for i in range(RECORDS):
+        first = START + i * 600
+        rows = [dict(fakeReading()["sensor_data"], timestamp=first + j * 600 / SAMPLES) for j in range(SAMPLES)]
+        records.append((toDateStr(first), pd.DataFrame(rows), units))
+    return records
+
+def writeRecords(records, directory, columnar, compression):
+    os.makedirs(directory)
+    start = time.perf_counter()
+    size = 0
+    for dateStr, frame, units in records:
+        data = codecz.encodeRecord(frame, units, columnar, compression)
+        with open(os.path.join(directory, codecz.recordFileName(dateStr, compression)), "wb") as f:
+            f.write(data)
+        size += len(data)
+    encode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in os.listdir(directory):
+        codecz.readRecords(os.path.join(directory, name))
+    decode = time.perf_counter() - start
+    return size, encode, decode
+
+def upload(server, directory, remoteDir, bundleMax):
+    pool = SftpPool(host="127.0.0.1", size=1, **server.connectKwargs())
+    worker = UploadWorker(pool, remoteDir=remoteDir, concurrency=1, deleteAfterUpload=False,
+                          bundleMax=bundleMax)
+    # Queued before the worker starts, like a backlog waiting out a dropped link
+    worker.submitDir(directory)
+    start = time.perf_counter()
+    worker.start()
+    worker.join()
+    elapsed = time.perf_counter() - start
+    worker.stop()
+    return worker.files, elapsed
+
+def readBack(server, remoteDir, work):
+    pool = SftpPool(host="127.0.0.1", size=4, **server.connectKwargs())
+    fetcher = ArchiveFetcher(pool, remoteDir=remoteDir)
+    cache = ArchiveCache(os.path.join(work, "cache" + remoteDir.replace("/", "-")))
+    with contextlib.redirect_stdout(io.StringIO()):
+        record = ArchiveRecord(toDateStr(START), toDateStr(START + RECORDS * 600 - 1), fetcher=fetcher, cache=cache)
+    pool.close()
+    return 0 if record.dataFrame is None else len(record.dataFrame)
+
+if __name__ == "__main__":
+    work = tempfile.mkdtemp()
+    server = LocalSftpServer(os.path.join(work, "remote"), link=SlowLink(LINK_KBPS, LINK_LATENCY))
+    try:
+        records = makeRecords()
+        print(f"{RECORDS} records of {SAMPLES} samples")
+        print(f"{'format':>14} {'KB/record':>10} {'ratio':>6} {'encode ms':>10} {'decode ms':>10}")
+        sizes = {}
+        for label, columnar, compression in FORMATS:
+            directory = os.path.join(work, label.replace(" ", "-"))
+            size, encode, decode = writeRecords(records, directory, columnar, compression)
+            sizes[label] = size
+            print(f"{label:>14} {size / RECORDS / 1024:>10.1f} {sizes['rows'] / size:>6.1f} "
+                  f"{encode / RECORDS * 1e3:>10.2f} {decode / RECORDS * 1e3:>10.2f}")
+
+        print(f"\nupload over {LINK_KBPS:.0f} kbit/s, {LINK_LATENCY * 1e3:.0f} ms round trips")
+        print(f"{'format':>24} {'objects':>8} {'seconds':>8} {'speedup':>8} {'rows back':>10}")
+        baseline = None
+        for label, bundleMax in [("rows", 1), ("columns gzip", 1), ("columns gzip", BUNDLE)]:
+            remote_dir = f"/{label.replace(' ', '-')}-{bundleMax}"
+            os.makedirs(os.path.join(server.root, remote_dir.lstrip("/")))
+            with contextlib.redirect_stdout(io.StringIO()):
+                objects, seconds = upload(server, os.path.join(work, label.replace(" ", "-")), remote_dir, bundleMax)
+            baseline = baseline or seconds
+            name = label if bundleMax == 1 else f"{label}, bundles of {bundleMax}"
+            print(f"{name:>24} {objects:>8} {seconds:>8.2f} {baseline / seconds:>7.1f}x "
+                  f"{readBack(server, remote_dir, work):>10}")
+    finally:
+        server.close()
+        shutil.rmtree(work)
@@ -0,0 +1,209 @@
+# End to end benchmark, no Pi, panel or RangerLab needed: a fleet of
+# FakeSensorServices pushes readings over SensorSubscriptions into LiveRecords,
+# the display renders onto a FakePanel, finished records are uploaded to a
+# LocalSftpServer, and ArchiveRecords of several sizes are loaded back from it.
+# Results go to stdout (or a file) as JSON so runs can be compared.
+#
+# usage: python bench-e2e.py [devices] [seconds] [period] [sensors] [out.json]
+
+import sys
+import io
+import os
+import json
+import time
+import shutil
+import tempfile
+import platform
+import threading
+import contextlib
+import numpy as np
+from centralz import SensorSubscription
+from displayz import Displayz
+from fakez import FakeSensorService, FakePanel, LocalSftpServer, fakeReading, fakeUnits
+from recordz import LiveRecord, ArchiveRecord, REMOTE_DIR, recordFlusher, sourceDirName, toDateStr
+from remotez import SftpPool, UploadWorker, ArchiveFetcher
+from cachez import ArchiveCache
+
+DEVICES = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+PERIOD = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05 # [s] between readings per device
+SENSORS = int(sys.argv[4]) if len(sys.argv) > 4 else 4 # [sensors] per reading, sets the payload size
+OUT = sys.argv[5] if len(sys.argv) > 5 else None
+LIFESPAN = 2.0 # [s] per record, short so rotations and uploads happen during the run
+PANEL_LATENCY = 0.5 # [s] per fake panel refresh
+ARCHIVE_RECORDS = [144, 1008, 4320] # a day, a week and a month of 10 minute records
+ARCHIVE_CADENCE = 90 # [s] between samples in the archived records
+ARCHIVE_DIR = "/archive"
+
+def percentiles(values, scale=1.0):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(np.asarray(values) * scale, [50, 95, 99])
+    return {"p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3),
+            "max": round(max(values) * scale, 3), "count": len(values)}
+
+class BenchRecord(LiveRecord):
+    # LiveRecord that writes under the bench's work directory and times its flushes
+
+    flushes = []
+
+    def __init__(self, lifespan, source, uploader, outDir):
+        super().__init__(lifespan, source=source, uploader=uploader)
+        self.outRecordsDir = os.path.join(outDir, sourceDirName(source))
+
+    def saveJsonToFile(self):
+        start = time.perf_counter()
+        file_path = super().saveJsonToFile()
+        if file_path is not None:
+            self.flushes.append((time.perf_counter() - start, os.path.getsize(file_path)))
+        return file_path
+
+def consume(address, subscription, uploader, display, outDir, stop, stats):
+    record = None
+    while not stop.is_set():
+        message = subscription.get(timeout=0.2)
+        if message is None:
+            continue
+        received = time.perf_counter()
+
+        if record is None or not record.isLive:
+            record = BenchRecord(LIFESPAN, address, uploader, outDir)
+
+        start = time.perf_counter()
+        record.processMessage(message)
+        stats["append"].append(time.perf_counter() - start)
+        stats["delivery"].append(received - message["sent_at"])
+
+        display.dispRawText(record.latestDataFrameToText())
+
+    if record is not None:
+        # What simple-central does on disconnect: save and upload what's there
+        record.finish()
+
+def benchIngest(server, work):
+    # RangerLab already has the records directory, each peripheral gets a folder in it
+    os.makedirs(os.path.join(server.root, REMOTE_DIR.lstrip("/")))
+    pool = SftpPool(host="127.0.0.1", **server.connectKwargs())
+    uploader = UploadWorker(pool).start()
+    display = Displayz(display=FakePanel(refreshLatency=PANEL_LATENCY), minInterval=1)
+
+    units = fakeUnits(SENSORS)
+    services = [FakeSensorService(period=PERIOD, units=units) for _ in range(DEVICES)]
+    subscriptions = [SensorSubscription.open(service) for service in services]
+    stats = {"append": [], "delivery": []}
+    stop = threading.Event()
+    threads = [threading.Thread(target=consume, daemon=True,
+                                args=("FA:KE:00:00:00:%02X" % i, subscription, uploader, display,
+                                      os.path.join(work, "out"), stop, stats))
+               for i, subscription in enumerate(subscriptions)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(SECONDS)
+    for service in services:
+        service.disconnect()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    drain_start = time.perf_counter()
+    recordFlusher().join()
+    uploader.stop(timeout=60)
+    drain = time.perf_counter() - drain_start
+    display.flush(10)
+    display.stop()
+
+    files_per_s, mb_per_s = uploader.throughput()
+    flushes = BenchRecord.flushes
+    samples = len(stats["append"])
+    return {
+        "ingest": {
+            "devices": DEVICES,
+            "period_s": PERIOD,
+            "sensors": SENSORS,
+            "payload_bytes": len(json.dumps(fakeReading(units))),
+            "seconds": round(elapsed, 3),
+            "published": sum(service.published for service in services),
+            "samples": samples,
+            "samples_per_s": round(samples / elapsed, 1),
+            "dropped": sum(subscription.dropped for subscription in subscriptions),
+            "append_latency_us": percentiles(stats["append"], 1e6),
+            "delivery_latency_ms": percentiles(stats["delivery"], 1e3),
+        },
+        "flush": {
+            "records": len(flushes),
+            "latency_ms": percentiles([seconds for seconds, _ in flushes], 1e3),
+            "mean_bytes": round(float(np.mean([size for _, size in flushes])), 1) if flushes else None,
+        },
+        "upload": {
+            "files": uploader.files,
+            "failed": uploader.failed,
+            "left_pending": uploader.pending(),
+            "files_per_s": round(files_per_s, 1),
+            "mb_per_s": round(mb_per_s, 3),
+            "drain_s": round(drain, 3),
+        },
+        "display": {
+            "submitted": display.submitted,
+            "superseded": display.superseded,
+            "unchanged": display.unchanged,
+            "refreshes": display.refreshes + display.partials,
+            "last_error": display.lastError,
+        },
+    }
+
+def makeArchive(root, count, start):
+    directory = os.path.join(root, ARCHIVE_DIR.lstrip("/"))
+    os.makedirs(directory, exist_ok=True)
+    per_record = 600 // ARCHIVE_CADENCE
+    for i in range(count):
+        first = start + i * 600
+        data = {
+            "sensor_data": [dict(fakeReading()["sensor_data"], timestamp=first + j * ARCHIVE_CADENCE)
+                            for j in range(per_record)],
+            "sensor_units": fakeReading()["sensor_units"],
+        }
+        with open(os.path.join(directory, f"record.{toDateStr(first)}.json"), "w") as f:
+            json.dump(data, f, indent=4)
+
+def benchArchive(server, work):
+    pool = SftpPool(host="127.0.0.1", size=4, **server.connectKwargs())
+    fetcher = ArchiveFetcher(pool, remoteDir=ARCHIVE_DIR)
+    start = time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1))
+    makeArchive(server.root, max(ARCHIVE_RECORDS), start)
+
+    results = []
+    for count in ARCHIVE_RECORDS:
+        cache = ArchiveCache(os.path.join(work, f"in-{count}"))
+        end = toDateStr(start + count * 600 - 1)
+        timings = {}
+        for run in ("cold", "warm"):
+            began = time.perf_counter()
+            record = ArchiveRecord(toDateStr(start), end, fetcher=fetcher, cache=cache)
+            timings[run] = round(time.perf_counter() - began, 3)
+        rows = 0 if record.dataFrame is None else len(record.dataFrame)
+        results.append({"records": count, "rows": rows, "cold_s": timings["cold"],
+                        "warm_s": timings["warm"]})
+    pool.close()
+    return results
+
+if __name__ == "__main__":
+    work = tempfile.mkdtemp()
+    server = LocalSftpServer(os.path.join(work, "remote"))
+    try:
+        # Records and fetches narrate every file, keep stdout for the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = benchIngest(server, work)
+            results["archive"] = benchArchive(server, work)
+    finally:
+        server.close()
+        shutil.rmtree(work)
+
+    results["run"] = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                      "machine": platform.machine()}
+    if OUT:
+        with open(OUT, "w") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
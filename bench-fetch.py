@@ -0,0 +1,74 @@
+# Archive fetch throughput against a local SFTP stand-in holding many small
+# record files: a login per file (what scp per record cost), the pooled SFTP
+# fetcher at several parallelism levels, and the single tar stream mode.
+#
+# usage: python bench-fetch.py [files] [parallel,...]
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import paramiko
+from fakez import LocalSftpServer
+from remotez import SftpPool, ArchiveFetcher
+
+FILES = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+PARALLEL = [int(p) for p in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1, 4, 8]
+FILE_BYTES = 2_000
+LOGIN_SAMPLE = 100 # files fetched with a login each, then extrapolated
+REMOTE_DIR = "/records"
+
+def makeArchive(root, count):
+    directory = os.path.join(root, REMOTE_DIR.lstrip("/"))
+    os.makedirs(directory)
+    stamp = time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1))
+    for i in range(count):
+        name = time.strftime("record.%Y%m%d%H%M%S.json", time.localtime(stamp + i * 600))
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(os.urandom(FILE_BYTES))
+
+def report(label, files, seconds):
+    print(f"{label:>16} {files:>7} files {seconds:8.2f} s {files/seconds:9.1f} files/s "
+          f"{files*FILE_BYTES/1e6/seconds:6.2f} MB/s")
+
+if __name__ == "__main__":
+    work = tempfile.mkdtemp()
+    server = LocalSftpServer(os.path.join(work, "remote"))
+    makeArchive(server.root, FILES)
+    try:
+        pool = SftpPool(host="127.0.0.1", size=max(PARALLEL), **server.connectKwargs())
+        fetcher = ArchiveFetcher(pool, remoteDir=REMOTE_DIR)
+        start = time.perf_counter()
+        names = fetcher.listRecords("19700101000000", "29991231235959")
+        print(f"listed {len(names)} records in {time.perf_counter() - start:.2f} s")
+
+        local = os.path.join(work, "in")
+        os.makedirs(local)
+        start = time.perf_counter()
+        for name in names[:LOGIN_SAMPLE]:
+            ssh = paramiko.SSHClient()
+            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            ssh.connect("127.0.0.1", username="ranger", **server.connectKwargs())
+            ssh.open_sftp().get(f"{REMOTE_DIR}/{name}", os.path.join(local, name))
+            ssh.close()
+        per_file = (time.perf_counter() - start) / LOGIN_SAMPLE
+        report("login per file*", len(names), per_file * len(names))
+
+        for parallel in PARALLEL:
+            shutil.rmtree(local)
+            fetcher.parallel = parallel
+            fetcher.resetStats()
+            fetcher.fetch(names, local)
+            stats = fetcher.stats()
+            report(f"sftp x{parallel}", stats["files"], stats["seconds"])
+
+        shutil.rmtree(local)
+        fetcher.resetStats()
+        fetcher.fetch(names, local, singleStream=True)
+        stats = fetcher.stats()
+        report("tar stream", stats["files"], stats["seconds"])
+        print(f"* extrapolated from {LOGIN_SAMPLE} files")
+    finally:
+        server.close()
+        shutil.rmtree(work)
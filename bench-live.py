@@ -0,0 +1,168 @@
+# Load test for the live readings server: a LiveRecord publishing through a
+# LiveServer to hundreds of local WebSocket clients in other processes, some
+# of which stop reading right after their snapshot. Times every
+# processMessage() on the ingestion thread, with no server and then with the
+# clients attached, to show fan-out never holds it up. Reports how many
+# messages the reading clients got, how late, and how many were dropped for
+# the stalled ones.
+#
+# usage: python bench-live.py [clients] [stalled clients] [samples per second] [seconds]
+
+import sys
+import os
+import json
+import time
+import types
+import base64
+import socket
+import struct
+import asyncio
+import tempfile
+import statistics
+import multiprocessing
+import livez
+from livez import LiveServer
+from recordz import LiveRecord
+from fakez import fakeReading
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+STALLED = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+RATE = float(sys.argv[3]) if len(sys.argv) > 3 else 100 # [samples/s] far beyond a real peripheral
+SECONDS = float(sys.argv[4]) if len(sys.argv) > 4 else 30 # long enough for stalled clients to fill their buffers
+PROCESSES = 4 # client processes, so decoding on their side is not the server's GIL
+STALLED_RCVBUF = 4096 # [bytes] socket buffer of a stalled client, so the server sees it back up quickly
+SETTLE = 2 # [s] after the last sample before the server is stopped
+
+async def readFrame(reader):
+    head = await reader.readexactly(2)
+    length = head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    return head[0] & 0x0F, await reader.readexactly(length)
+
+async def client(port, stalled, results):
+    sock = None
+    if stalled:
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, STALLED_RCVBUF)
+        sock.connect(("127.0.0.1", port))
+    reader, writer = await asyncio.open_connection(*(() if stalled else ("127.0.0.1", port)), sock=sock)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((f"GET {livez.LIVE_PATH} HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\n"
+                  f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    if livez.acceptKey(key).encode() not in head:
+        raise RuntimeError(f"Bad handshake: {head!r}")
+
+    opcode, snapshot = await readFrame(reader)
+    snapshot = json.loads(snapshot)["snapshot"]
+    received = 0
+    latencies = []
+    try:
+        if stalled:
+            # Never reads again, the server has to drop for it
+            await asyncio.Event().wait()
+        while True:
+            opcode, payload = await readFrame(reader)
+            if opcode != 0x1:
+                break
+            now = time.time()
+            received += 1
+            latencies.append(now - json.loads(payload)["sensor_data"]["sent"])
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+        results.append((stalled, len(snapshot), received, latencies))
+
+def clientProcess(port, fast, stalled, ready, done, out):
+    async def run():
+        results = []
+        tasks = [asyncio.create_task(client(port, False, results)) for _ in range(fast)]
+        tasks += [asyncio.create_task(client(port, True, results)) for _ in range(stalled)]
+        ready.put(fast + stalled)
+        await asyncio.get_running_loop().run_in_executor(None, done.wait)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        out.put(results)
+    asyncio.run(run())
+
+def ingest(record, count, rate):
+    # The central's side: one processMessage() per sample, timed
+    durations = []
+    start = time.perf_counter()
+    for i in range(count):
+        reading = fakeReading()
+        reading["sensor_data"]["sent"] = time.time()
+        began = time.perf_counter()
+        record.processMessage(reading)
+        durations.append(time.perf_counter() - began)
+        delay = start + (i + 1) / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    return durations
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else float("nan")
+
+def describe(label, durations):
+    print(f"{label:>22} {statistics.median(durations) * 1e6:>8.1f} {percentile(durations, 0.99) * 1e6:>8.1f} "
+          f"{max(durations) * 1e6:>9.1f}")
+
+def liveRecord(broadcaster):
+    record = LiveRecord(None, linkMonitor=types.SimpleNamespace(reachable=False), broadcaster=broadcaster)
+    record.outRecordsDir = tempfile.mkdtemp()
+    return record
+
+if __name__ == "__main__":
+    count = int(RATE * SECONDS)
+    print(f"{CLIENTS} clients, {STALLED} stalled, {count} samples at {RATE:.0f}/s")
+    print(f"{'processMessage us':>22} {'p50':>8} {'p99':>8} {'max':>9}")
+    describe("no live server", ingest(liveRecord(None), count, RATE))
+
+    server = LiveServer(port=0).start()
+    record = liveRecord(server)
+    # A snapshot's worth of history for the clients to start from
+    for _ in range(livez.SNAPSHOT_SIZE):
+        record.processMessage(dict(fakeReading(), sensor_data=dict(fakeReading()["sensor_data"], sent=time.time())))
+    describe("server, no clients", ingest(record, count, RATE))
+
+    ctx = multiprocessing.get_context("fork")
+    ready, out, done = ctx.Queue(), ctx.Queue(), ctx.Event()
+    processes = []
+    for i in range(PROCESSES):
+        fast = CLIENTS // PROCESSES + (i < CLIENTS % PROCESSES)
+        stalled = STALLED // PROCESSES + (i < STALLED % PROCESSES)
+        process = ctx.Process(target=clientProcess, args=(server.port, fast, stalled, ready, done, out))
+        process.start()
+        processes.append(process)
+    for _ in processes:
+        ready.get()
+    began = time.perf_counter()
+    while len(server.clients) < CLIENTS + STALLED and time.perf_counter() - began < 30:
+        time.sleep(0.05)
+    connected = len(server.clients)
+    print(f"{connected} clients connected in {time.perf_counter() - began:.2f} s")
+
+    durations = ingest(record, count, RATE)
+    describe(f"{connected} clients", durations)
+    time.sleep(SETTLE)
+    dropped = sum(client.dropped for client in server.clients)
+    done.set()
+    results = [result for _ in processes for result in out.get()]
+    for process in processes:
+        process.join()
+    server.stop()
+
+    readers = [result for result in results if not result[0]]
+    latencies = [latency for result in readers for latency in result[3]]
+    complete = sum(1 for result in readers if result[2] == count)
+    print(f"\nreading clients: {complete}/{len(readers)} got all {count} samples, "
+          f"snapshots of {min(result[1] for result in readers)}-{max(result[1] for result in readers)}")
+    print(f"delivery latency ms: p50 {statistics.median(latencies) * 1e3:.1f}, "
+          f"p99 {percentile(latencies, 0.99) * 1e3:.1f}, max {max(latencies) * 1e3:.1f}")
+    print(f"stalled clients: {dropped} messages dropped, at most {livez.CLIENT_QUEUE} queued each")
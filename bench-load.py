@@ -0,0 +1,72 @@
+# Parsing a month of archived records into a DataFrame: in this process, the
+# way ArchiveRecord always did, against the load workers at 1 to N processes.
+# Records are fetched once from a LocalSftpServer into a cache, so only the
+# parse is timed. Checks every run comes out the same as the serial one.
+#
+# usage: python bench-load.py [records] [samples per record] [max workers]
+
+import sys
+import io
+import os
+import time
+import shutil
+import tempfile
+import contextlib
+import pandas as pd
+from fakez import LocalSftpServer, fakeReading
+from recordz import ArchiveRecord, loadPool, toDateStr
+from remotez import SftpPool, ArchiveFetcher
+from cachez import ArchiveCache
+from codecz import encodeRecord, recordFileName
+
+RECORDS = int(sys.argv[1]) if len(sys.argv) > 1 else 4320 # a month of 10 minute records
+SAMPLES = int(sys.argv[2]) if len(sys.argv) > 2 else 7 # [samples] per record at the 90 s cadence
+MAX_WORKERS = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+REPEATS = 3
+START = time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1))
+REMOTE = "/archive"
+
+def makeArchive(root):
+    directory = os.path.join(root, REMOTE.lstrip("/"))
+    os.makedirs(directory)
+    units = fakeReading()["sensor_units"]
+    for i in range(RECORDS):
+        first = START + i * 600
+        rows = [dict(fakeReading()["sensor_data"], timestamp=first + j * 600 / SAMPLES) for j in range(SAMPLES)]
+        with open(os.path.join(directory, recordFileName(toDateStr(first))), "wb") as f:
+            f.write(encodeRecord(pd.DataFrame(rows), units))
+
+def timeLoad(record, workers):
+    record.workers = workers
+    record.archiveFilesToDataFrame()    # starts the pool for this many workers
+    seconds = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        record.archiveFilesToDataFrame()
+        seconds.append(time.perf_counter() - started)
+    return sorted(seconds)[REPEATS // 2], record.dataFrame
+
+if __name__ == "__main__":
+    work = tempfile.mkdtemp()
+    server = LocalSftpServer(os.path.join(work, "remote"))
+    try:
+        makeArchive(server.root)
+        pool = SftpPool(host="127.0.0.1", size=4, **server.connectKwargs())
+        with contextlib.redirect_stdout(io.StringIO()):
+            record = ArchiveRecord(toDateStr(START), toDateStr(START + RECORDS * 600 - 1), load=False,
+                                   fetcher=ArchiveFetcher(pool, remoteDir=REMOTE),
+                                   cache=ArchiveCache(os.path.join(work, "cache")))
+        pool.close()
+
+        print(f"{RECORDS} records of {SAMPLES} samples, {os.cpu_count()} cores, median of {REPEATS}")
+        print(f"{'workers':>8} {'seconds':>8} {'speedup':>8} {'rows':>7} {'same':>5}")
+        baseline, expected = timeLoad(record, 1)
+        print(f"{'serial':>8} {baseline:>8.3f} {1:>7.1f}x {len(expected):>7} {'-':>5}")
+        for workers in range(2, MAX_WORKERS + 1):
+            seconds, frame = timeLoad(record, workers)
+            same = frame.equals(expected[frame.columns]) if frame is not None else False
+            print(f"{workers:>8} {seconds:>8.3f} {baseline / seconds:>7.1f}x {len(frame):>7} {str(same):>5}")
+        loadPool(1).shutdown()
+    finally:
+        server.close()
+        shutil.rmtree(work)
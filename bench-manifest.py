@@ -0,0 +1,61 @@
+# Range lookups against record directories holding a month, a year and three
+# years of 10 minute records on a LocalSftpServer behind a LAN sized SlowLink:
+# listing the whole directory, like ArchiveFetcher always did, against a
+# binary search of the directory's manifest.
+#
+# usage: python bench-manifest.py [link latency ms] [lookups per size]
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+from fakez import LocalSftpServer, SlowLink
+from manifestz import LocalFs, Manifest
+from recordz import toDateStr
+from remotez import SftpPool, ArchiveFetcher
+
+LINK_LATENCY = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.005 # [s]
+LOOKUPS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+RECORDS = [4464, 52560, 157680] # a month, a year and three years of 10 minute records
+START = time.mktime((2022, 1, 1, 0, 0, 0, 0, 0, -1))
+DAY = 24 * 60 * 60 # [s]
+
+def makeDirectory(root, count):
+    # Only names and sizes matter to a lookup, the records are left empty
+    directory = os.path.join(root, f"records-{count}")
+    os.makedirs(directory)
+    for i in range(count):
+        with open(os.path.join(directory, f"record.{toDateStr(START + i * 600)}.json"), "w") as f:
+            f.write("{}")
+    started = time.perf_counter()
+    Manifest(directory).rebuild(LocalFs(), checksums=False)
+    return f"/records-{count}", time.perf_counter() - started
+
+def timeLookups(fetcher, count):
+    # A day in the middle of the directory, a different one each time
+    seconds = []
+    for i in range(LOOKUPS):
+        first = START + (count * 600) // 2 + i * DAY
+        started = time.perf_counter()
+        found = fetcher.listRecordAttrs(toDateStr(first), toDateStr(first + DAY - 1))
+        seconds.append(time.perf_counter() - started)
+    return sorted(seconds)[len(seconds) // 2], len(found)
+
+if __name__ == "__main__":
+    work = tempfile.mkdtemp()
+    server = LocalSftpServer(work, link=SlowLink(1e6, LINK_LATENCY))
+    pool = SftpPool(host="127.0.0.1", size=1, **server.connectKwargs())
+    try:
+        print(f"{LINK_LATENCY * 1e3:.0f} ms round trips, median of {LOOKUPS} one day lookups")
+        print(f"{'records':>8} {'build s':>8} {'method':>9} {'ms':>9} {'found':>6}")
+        for count in RECORDS:
+            remote_dir, build = makeDirectory(work, count)
+            for method, useManifest in [("listing", False), ("manifest", True)]:
+                fetcher = ArchiveFetcher(pool, remoteDir=remote_dir, useManifest=useManifest)
+                seconds, found = timeLookups(fetcher, count)
+                print(f"{count:>8} {build:>8.2f} {method:>9} {seconds * 1e3:>9.1f} {found:>6}")
+    finally:
+        pool.close()
+        server.close()
+        shutil.rmtree(work)
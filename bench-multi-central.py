@@ -0,0 +1,43 @@
+# Run MultiCentral against a fleet of fake peripherals, some slow and some
+# flapping, and check that every healthy node keeps its read cadence.
+#
+# usage: python bench-multi-central.py [devices] [seconds]
+
+import sys
+import asyncio
+import time
+from centralz import MultiCentral
+from fakez import FakeRadio
+
+DEVICES = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+CADENCE = 0.1 # [s]
+
+async def main():
+    radio = FakeRadio.fleet(DEVICES, slow=DEVICES // 10, flapping=DEVICES // 10, latency=2.0)
+    central = MultiCentral(radio, cadence=CADENCE, lifespan=3600, scanInterval=0.5,
+                           readTimeout=1.0, saveOnDisconnect=False)
+
+    runner = asyncio.create_task(central.run())
+    start = time.perf_counter()
+    await asyncio.sleep(SECONDS)
+    await central.stop()
+    runner.cancel()
+    elapsed = time.perf_counter() - start
+
+    expected = SECONDS / CADENCE
+    print(f"{'address':>20} {'kind':>9} {'samples':>8} {'of ideal':>9} {'reconnects':>11}")
+    for i, peripheral in enumerate(radio.peripherals):
+        kind = "slow" if peripheral.latency else "flapping" if peripheral.dropRate else "healthy"
+        record = central.records.get(peripheral.address)
+        samples = len(record.buffer) if record is not None and record.buffer is not None else 0
+        print(f"{peripheral.address:>20} {kind:>9} {samples:>8} {samples/expected:>8.0%} "
+              f"{central.reconnects.get(peripheral.address, 0):>11}")
+
+    healthy = [p for p in radio.peripherals if not p.latency and not p.dropRate]
+    total = sum(p.reads for p in radio.peripherals)
+    print(f"{DEVICES} devices, {total} reads in {elapsed:.1f} s ({total/elapsed:.0f} reads/s), "
+          f"healthy nodes averaged {sum(p.reads for p in healthy)/len(healthy)/expected:.0%} of ideal cadence")
+
+if __name__ == "__main__":
+    asyncio.run(main())
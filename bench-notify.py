@@ -0,0 +1,55 @@
+# Compare CPU use and read latency of notify-driven delivery against polling
+# service.sensors, using a fake peripheral that publishes at a fixed rate.
+#
+# usage: python bench-notify.py [seconds_per_mode] [publish_period]
+
+import sys
+import time
+from centralz import SensorSubscription, pollSensors
+from fakez import FakeSensorService, GATT_READ_LATENCY
+
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+PERIOD = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1 # [s]
+
+def runMode(mode):
+    # "spin" models the old `while service.sensors is None: pass` loop, which
+    # never yields, so give it reads that cost nothing
+    service = FakeSensorService(period=PERIOD, readLatency=0 if mode == "spin" else GATT_READ_LATENCY)
+    subscription = SensorSubscription(service) if mode == "notify" else None
+    latencies = []
+    last_seen = None
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    while time.perf_counter() - wall_start < SECONDS:
+        if mode == "notify":
+            message = subscription.get(timeout=1)
+        elif mode == "spin":
+            # What super-simple-central.py did: read as fast as possible
+            message = service.sensors
+        else:
+            message = pollSensors(service, service)
+            time.sleep(float(mode.split("-")[1]))
+
+        if message is None or message.get("sent_at") == last_seen:
+            continue
+        last_seen = message["sent_at"]
+        latencies.append(time.perf_counter() - last_seen)
+
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    service.disconnect()
+    if subscription is not None:
+        subscription.close()
+
+    latencies.sort()
+    seen = len(latencies)
+    median = latencies[seen // 2] if seen else float("nan")
+    p99 = latencies[int(seen * 0.99)] if seen else float("nan")
+    return cpu / wall, seen, service.published, median, p99
+
+if __name__ == "__main__":
+    print(f"{'mode':>10} {'cpu':>6} {'seen':>6} {'published':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in ("spin", "poll-0.5", "notify"):
+        cpu, seen, published, median, p99 = runMode(mode)
+        print(f"{mode:>10} {cpu:>6.0%} {seen:>6} {published:>10} {median*1e3:>8.2f} {p99*1e3:>8.2f}")
@@ -0,0 +1,54 @@
+# Compare bytes over the air and samples per read of the JSON sensors
+# characteristic against the packed binary sensorsPacked characteristic, and
+# how fast packed payloads decode into a LiveRecord.
+#
+# usage: python bench-packed.py [reads]
+
+import sys
+import json
+import time
+from ble_json_service import packSamples, packedCapacity, PACKED_MAX_LENGTH
+from centralz import PackedSensorReader
+from fakez import fakeReading, SENSOR_UNITS
+from recordz import LiveRecord
+
+READS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+SCHEMA = {
+    "version": 1,
+    "fields": [["soil1_temp", "f"], ["soil2_temp", "f"], ["moist", "f"], ["uva", "f"]],
+    "units": SENSOR_UNITS,
+}
+
+class _PackedService:
+    sensorsSchema = SCHEMA
+    sensorsPacked = None
+
+if __name__ == "__main__":
+    json_bytes = len(json.dumps(fakeReading()).encode("utf-8"))
+    capacity = packedCapacity(SCHEMA)
+
+    service = _PackedService()
+    reader = PackedSensorReader(service)
+    record = LiveRecord(3600)
+
+    payloads = []
+    sequence = 0
+    now = time.time()
+    for _ in range(READS):
+        samples = [(now - (capacity - i) * 90, fakeReading()["sensor_data"]) for i in range(capacity)]
+        payloads.append(packSamples(SCHEMA, samples, sequence, now))
+        sequence += capacity
+
+    start = time.perf_counter()
+    for payload in payloads:
+        record.processSamples(reader.decode(payload, now), reader.units)
+    elapsed = time.perf_counter() - start
+
+    packed_bytes = len(payloads[0])
+    print(f"JSON:   {json_bytes} bytes per read, 1 sample per read, {json_bytes} bytes/sample")
+    print(f"packed: {packed_bytes} bytes per read, {capacity} samples per read, "
+          f"{packed_bytes/capacity:.1f} bytes/sample (max {PACKED_MAX_LENGTH} per read)")
+    print(f"{capacity}x samples per read, {json_bytes/(packed_bytes/capacity):.1f}x fewer bytes per sample")
+    print(f"decoded {len(record.buffer)} samples into a LiveRecord in {elapsed:.2f} s "
+          f"({len(record.buffer)/elapsed:.0f} samples/s)")
@@ -0,0 +1,46 @@
+# Time plotTemps against the number of rows, with and without downsampling to
+# the plot width. Plot time should follow the width, not the row count.
+#
+# usage: python bench-plot.py [width]
+
+import sys
+import io
+import time
+import contextlib
+import numpy as np
+import pandas as pd
+from recordz import Record
+
+WIDTH = int(sys.argv[1]) if len(sys.argv) > 1 else 250
+ROWS = [1_000, 10_000, 100_000, 1_000_000]
+
+def fakeFrame(rows):
+    t = 1704067200 + np.arange(rows) * 90.0
+    day = np.sin(t / 86400 * 2 * np.pi)
+    return pd.DataFrame({
+        "soil1_temp": 60 + 20 * day + np.random.randn(rows),
+        "soil2_temp": 55 + 15 * day + np.random.randn(rows),
+        "timestamp": t,
+    })
+
+def timePlot(record):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        record.plotTemps(width=WIDTH, height=40)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    import plotz
+    print(f"{'rows':>9} {'downsampled s':>14} {'full s':>8}")
+    for rows in ROWS:
+        record = Record()
+        record.dataFrame = fakeFrame(rows)
+        downsampled = timePlot(record)
+
+        full = float("nan")
+        if rows <= 100_000:  # full plots of a million rows take minutes
+            original = plotz.downsample
+            plotz.downsample = lambda dataFrame, *args, **kwargs: dataFrame
+            full = timePlot(record)
+            plotz.downsample = original
+        print(f"{rows:>9} {downsampled:>14.2f} {full:>8.2f}")
@@ -0,0 +1,55 @@
+# How long simple-central takes to get its peripheral back after RF dropouts
+# of different lengths, on FakeBleRadio's simulated clock: scanning every
+# time, like it used to, against ConnectionManager's directed reconnect with
+# a scan fallback. Also how much of the outage the radio spent scanning.
+#
+# usage: python bench-reconnect.py [trials per dropout] [advertising interval s] [scan start s]
+
+import sys
+import io
+import random
+import contextlib
+import numpy as np
+from centralz import ConnectionManager
+from fakez import FakeBleRadio
+
+TRIALS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+ADV_INTERVAL = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0 # [s] the peripheral's advertising interval
+SCAN_START = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0 # [s] for BlueZ to start discovery
+DROPOUTS = [0.2, 1, 5, 30, 600] # [s] out of range
+SEED = 7
+
+def scanOnly(ble):
+    # The old loop: scan with no timeout until the service shows up
+    return ConnectionManager(ble, scanTimeout=None, directAttempts=0, sleep=ble.sleep, clock=ble.clock)
+
+def directFirst(ble):
+    return ConnectionManager(ble, sleep=ble.sleep, clock=ble.clock)
+
+def run(makeManager, dropout):
+    times = []
+    scanning = []
+    for _ in range(TRIALS):
+        ble = FakeBleRadio(advInterval=ADV_INTERVAL, scanStart=SCAN_START)
+        manager = makeManager(ble)
+        manager.connect()
+        ble.scanning = 0.0
+        dropped = ble.now
+        ble.dropOut(dropout)
+        manager.connect()
+        times.append(ble.now - dropped)
+        scanning.append(ble.scanning / (ble.now - dropped))
+    return times, scanning
+
+if __name__ == "__main__":
+    random.seed(SEED)
+    print(f"advertising every {ADV_INTERVAL:.1f} s, {SCAN_START:.1f} s to start a scan, {TRIALS} dropouts each")
+    print(f"{'dropout s':>10} {'method':>13} {'p50 s':>8} {'p95 s':>8} {'after s':>8} {'scanning':>9}")
+    for dropout in DROPOUTS:
+        for method, makeManager in [("scan only", scanOnly), ("direct first", directFirst)]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                times, scanning = run(makeManager, dropout)
+            p50, p95 = np.percentile(times, [50, 95])
+            # "after" is what the reconnect cost beyond the dropout itself
+            print(f"{dropout:>10.1f} {method:>13} {p50:>8.2f} {p95:>8.2f} {p50 - dropout:>8.2f} "
+                  f"{np.mean(scanning):>8.0%}")
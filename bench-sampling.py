@@ -0,0 +1,83 @@
+# Fixed cadence against the AdaptiveSampler over simulated garden days, one
+# quiet and one with watering. Counts reads (radio time), kept samples and
+# their record bytes (storage and upload), and how far the kept samples,
+# linearly interpolated, stray from the true signal. The worst error on a busy
+# day is at the start of a watering, which is noticed up to maxInterval late,
+# so the sampler also runs capped at the fixed cadence.
+#
+# usage: python bench-sampling.py [fixed cadence s] [waterings on the busy day]
+
+import sys
+import numpy as np
+import pandas as pd
+from samplez import AdaptiveSampler
+from codecz import encodeRecord
+from fakez import SENSOR_UNITS
+
+CADENCE = float(sys.argv[1]) if len(sys.argv) > 1 else 90 # [s] the fixed cadence simple-central used
+WATERINGS = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+DAY = 24 * 60 * 60 # [s]
+WATERING_MINUTES = 10
+SEED = 7
+
+def gardenDay(waterings):
+    """
+    One sample per second: soil temperatures and UV follow the sun, moisture
+    jumps while watering and dries out over hours. Small sensor noise on top.
+    """
+    rng = np.random.default_rng(SEED)
+    t = np.arange(DAY, dtype=float)
+    sun = np.clip(np.sin((t / DAY - 0.25) * 2 * np.pi), 0, None)
+    day = {
+        "timestamp": t,
+        "soil1_temp": 60 + 8 * np.sin((t / DAY - 0.35) * 2 * np.pi) + rng.normal(0, 0.05, t.size),
+        "soil2_temp": 62 + 6 * np.sin((t / DAY - 0.4) * 2 * np.pi) + rng.normal(0, 0.05, t.size),
+        "uva": 80 * sun + rng.normal(0, 0.1, t.size),
+    }
+    moist = np.full(t.size, 35.0)
+    for start in np.linspace(6, 20, waterings) * 3600 if waterings else []:
+        rising = (t >= start) & (t < start + WATERING_MINUTES * 60)
+        after = t >= start + WATERING_MINUTES * 60
+        moist[rising] += 25 * (t[rising] - start) / (WATERING_MINUTES * 60)
+        moist[after] += 25 * np.exp(-(t[after] - start - WATERING_MINUTES * 60) / 7200)
+    day["moist"] = np.clip(moist + rng.normal(0, 0.1, t.size), 0, 100)
+    return pd.DataFrame(day)
+
+def fixed(truth):
+    return truth.iloc[::int(CADENCE)], len(truth.iloc[::int(CADENCE)])
+
+def adaptive(truth, maxInterval=None):
+    sampler = AdaptiveSampler()
+    if maxInterval is not None:
+        sampler.configure({"max": maxInterval})
+    sampler.interval = CADENCE
+    rows = truth.to_dict(orient="records")
+    kept = []
+    reads = 0
+    now = 0.0
+    while now < len(rows):
+        reads += 1
+        sample = rows[int(now)]
+        kept.extend(sampler.offer(dict(sample), SENSOR_UNITS))
+        now += sampler.interval
+    return pd.DataFrame(kept), reads
+
+def errors(truth, kept):
+    worst = {}
+    for sensor in SENSOR_UNITS:
+        rebuilt = np.interp(truth["timestamp"], kept["timestamp"], kept[sensor])
+        worst[sensor] = float(np.max(np.abs(rebuilt - truth[sensor])))
+    return worst
+
+if __name__ == "__main__":
+    methods = [("fixed", fixed), ("adaptive", adaptive),
+               (f"max {CADENCE:.0f}s", lambda truth: adaptive(truth, CADENCE))]
+    print(f"{'day':>6} {'method':>9} {'reads':>6} {'kept':>6} {'KB':>7} "
+          + " ".join(f"{sensor + ' err':>15}" for sensor in SENSOR_UNITS))
+    for label, waterings in [("quiet", 0), ("busy", WATERINGS)]:
+        truth = gardenDay(waterings)
+        for method, run in methods:
+            kept, reads = run(truth)
+            size = len(encodeRecord(kept, SENSOR_UNITS))
+            print(f"{label:>6} {method:>9} {reads:>6} {len(kept):>6} {size / 1024:>7.1f} "
+                  + " ".join(f"{error:>15.2f}" for error in errors(truth, kept).values()))
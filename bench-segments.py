@@ -0,0 +1,94 @@
+# Load time and resident memory of a year of records read from JSON files versus
+# memory-mapped day segments. Each load runs in its own process so RSS is
+# measured cleanly.
+#
+# usage: python bench-segments.py [days]
+
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import subprocess
+import tempfile
+
+DAYS = int(sys.argv[1]) if len(sys.argv) > 1 and not sys.argv[1].startswith("--") else 365
+CADENCE = 90 # [s]
+RECORD_SPAN = 600 # [s]
+
+def makeJsonArchive(directory, days):
+    from recordz import toDateStr
+    os.makedirs(directory)
+    start = 1704067200 # 2024-01-01 UTC
+    units = {"soil1_temp": "F", "soil2_temp": "F", "moist": "%", "uva": "%"}
+    for record_start in range(start, start + days * 86400, RECORD_SPAN):
+        rows = [{
+            "soil1_temp": random.uniform(40, 90),
+            "soil2_temp": random.uniform(40, 90),
+            "moist": random.uniform(0, 100),
+            "uva": random.uniform(0, 100),
+            "timestamp": float(ts),
+        } for ts in range(record_start, record_start + RECORD_SPAN, CADENCE)]
+        with open(os.path.join(directory, f"record.{toDateStr(record_start)}.json"), "w") as f:
+            f.write(json.dumps({"sensor_data": rows, "sensor_units": units}, indent=4))
+
+def loadJson(directory):
+    # Same work as ArchiveRecord.archiveFilesToDataFrame
+    import pandas as pd
+    all_data = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), "r") as f:
+            all_data.extend(json.load(f)["sensor_data"])
+    return pd.DataFrame(all_data)
+
+def loadSegments(directory):
+    from segmentz import SegmentStore
+    dataFrame, _ = SegmentStore(directory).load()
+    return dataFrame
+
+def residentMB():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+def measure(mode, directory):
+    import pandas as pd, numpy as np, segmentz # imports count toward the baseline, not the load
+    baseline = residentMB()
+    start = time.perf_counter()
+    dataFrame = loadJson(directory) if mode == "json" else loadSegments(directory)
+    total = float(dataFrame["soil1_temp"].sum()) # touch the data so mapped pages are read
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"rows": len(dataFrame), "seconds": elapsed, "rss_mb": residentMB() - baseline,
+                      "check": total}))
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--measure":
+        measure(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    work = tempfile.mkdtemp()
+    try:
+        json_dir = os.path.join(work, "json")
+        segment_dir = os.path.join(work, "segments")
+        start = time.perf_counter()
+        makeJsonArchive(json_dir, DAYS)
+        print(f"wrote {len(os.listdir(json_dir))} JSON records in {time.perf_counter() - start:.1f} s")
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "convert-archive.py", json_dir, segment_dir],
+                       check=True, stdout=subprocess.DEVNULL)
+        print(f"converted to segments in {time.perf_counter() - start:.1f} s")
+
+        json_mb = sum(os.path.getsize(os.path.join(json_dir, f)) for f in os.listdir(json_dir)) / 1e6
+        seg_mb = sum(os.path.getsize(os.path.join(segment_dir, f)) for f in os.listdir(segment_dir)) / 1e6
+        sizes = {"json": json_mb, "segments": seg_mb}
+
+        print(f"{'format':>10} {'rows':>9} {'load s':>8} {'RSS MB':>8} {'disk MB':>8}")
+        for mode, directory in (("json", json_dir), ("segments", segment_dir)):
+            out = subprocess.run([sys.executable, __file__, "--measure", mode, directory],
+                                 check=True, stdout=subprocess.PIPE, text=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            print(f"{mode:>10} {result['rows']:>9} {result['seconds']:>8.2f} {result['rss_mb']:>8.1f} "
+                  f"{sizes[mode]:>8.1f}")
+    finally:
+        shutil.rmtree(work)
@@ -0,0 +1,78 @@
+# Startup time and memory of the central's ingestion path against the
+# archive analysis path, each in a fresh interpreter: wall time to import and
+# do a first bit of work, peak RSS, which heavy libraries got loaded, and what
+# each of those cost to import as `python -X importtime` reports it. Displayz
+# is left out, it needs the e-paper panel's libraries either way.
+#
+# usage: python bench-startup.py [runs per entry point]
+
+import sys
+import os
+import json
+import time
+import subprocess
+import tempfile
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+HEAVY = ["numpy", "pandas", "matplotlib", "mpl_ascii", "paramiko"]
+
+# Imports what simple-central does, then takes a sample and saves a record
+CENTRAL = """
+import types
+import ble_json_service, centralz, recordz, remotez, walz, samplez, metricz, livez
+record = recordz.LiveRecord(None, linkMonitor=types.SimpleNamespace(reachable=False))
+record.outRecordsDir = OUT_DIR
+record.processMessage({"sensor_data": {"soil1_temp": 61.2, "moist": 35.0}, "sensor_units": {"soil1_temp": "F", "moist": "%"}})
+record.latestDataFrameToText()
+record.finish()
+"""
+
+# What a look at the archive needs before it fetches anything
+ANALYSIS = """
+import recordz, plotz
+recordz.Record().setupPlots()
+import matplotlib.pyplot
+"""
+
+REPORT = """
+import resource, json
+print(json.dumps({"rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  "loaded": [name for name in HEAVY if name in sys.modules]}))
+"""
+
+def script(body, outDir):
+    return (f"import sys\nOUT_DIR = {outDir!r}\nHEAVY = {HEAVY!r}\n"
+            + "import contextlib, io\nwith contextlib.redirect_stdout(io.StringIO()):\n"
+            + "".join(f"    {line}\n" for line in body.strip().splitlines()) + REPORT)
+
+def run(body, outDir, *flags):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, *flags, "-c", script(body, outDir)], capture_output=True,
+                            text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return elapsed, json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+def heavyImports(stderr):
+    # "import time: self [us] | cumulative | name", wherever in the tree they were first imported
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.strip() in HEAVY:
+            imports[name.strip()] = int(cumulative)
+    return imports
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as out_dir:
+        print(f"median of {RUNS} runs, python {sys.version.split()[0]}")
+        for label, body in [("central", CENTRAL), ("analysis", ANALYSIS)]:
+            runs = sorted(run(body, out_dir) for _ in range(RUNS))
+            elapsed, report, _ = runs[len(runs) // 2]
+            _, _, stderr = run(body, out_dir, "-X", "importtime")
+            print(f"\n{label}: {elapsed * 1e3:.0f} ms, {report['rss_kb'] / 1024:.1f} MB peak RSS, "
+                  f"loaded {', '.join(report['loaded']) or 'none of ' + ', '.join(HEAVY)}")
+            for name, cumulative in heavyImports(stderr).items():
+                print(f"  {cumulative / 1e3:>8.1f} ms  import {name}")
@@ -0,0 +1,67 @@
+# Upload throughput of the pooled SFTP UploadWorker against a fresh SSH login
+# per flush (what the per-record scp subprocess costs), using a local SFTP
+# stand-in for RangerLab.
+#
+# usage: python bench-upload.py [files] [file_kb] [concurrency]
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import paramiko
+from fakez import LocalSftpServer
+from remotez import SftpPool, UploadWorker
+
+FILES = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+FILE_KB = int(sys.argv[2]) if len(sys.argv) > 2 else 40 # a 10 minute record is roughly this
+CONCURRENCY = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+def makeRecords(directory, count, size):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(directory, f"record.{20240101000000 + i}.json"), "wb") as f:
+            f.write(os.urandom(size))
+
+def benchPerFlushLogin(server, localDir, remoteDir):
+    # A new SSH handshake for every file, like one scp subprocess per flush
+    files = sorted(os.listdir(localDir))
+    start = time.perf_counter()
+    for name in files:
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect("127.0.0.1", username="ranger", **server.connectKwargs())
+        sftp = ssh.open_sftp()
+        sftp.put(os.path.join(localDir, name), f"{remoteDir}/{name}")
+        ssh.close()
+    return len(files), time.perf_counter() - start
+
+def benchWorker(server, localDir, remoteDir, concurrency):
+    pool = SftpPool(host="127.0.0.1", size=concurrency, **server.connectKwargs())
+    worker = UploadWorker(pool, remoteDir=remoteDir, concurrency=concurrency).start()
+    start = time.perf_counter()
+    worker.submitDir(localDir)
+    worker.join()
+    elapsed = time.perf_counter() - start
+    worker.stop()
+    return worker, elapsed, pool.connects
+
+if __name__ == "__main__":
+    work = tempfile.mkdtemp()
+    server = LocalSftpServer(os.path.join(work, "remote"))
+    os.makedirs(os.path.join(work, "remote", "records"))
+    size = FILE_KB * 1024
+    try:
+        makeRecords(os.path.join(work, "out"), FILES, size)
+        count, elapsed = benchPerFlushLogin(server, os.path.join(work, "out"), "/records")
+        print(f"login per file:   {count/elapsed:7.1f} files/s {count*size/1e6/elapsed:6.2f} MB/s ({count} logins)")
+
+        for concurrency in sorted({1, CONCURRENCY}):
+            makeRecords(os.path.join(work, "out"), FILES, size)
+            worker, elapsed, connects = benchWorker(server, os.path.join(work, "out"), "/records", concurrency)
+            files_per_s, mb_per_s = worker.throughput()
+            print(f"worker x{concurrency}:        {files_per_s:7.1f} files/s {mb_per_s:6.2f} MB/s "
+                  f"({connects} login, {worker.failed} retries, {len(os.listdir(os.path.join(work, 'out')))} left)")
+    finally:
+        server.close()
+        shutil.rmtree(work)
@@ -0,0 +1,82 @@
+# Per-sample cost of the write-ahead log at several fsync batch sizes, then a
+# crash test: a child process logs samples until it's SIGKILLed, and recovery
+# has to bring back everything it acknowledged as synced.
+#
+# usage: python bench-wal.py [samples] [directory]
+
+import sys
+import os
+import time
+import shutil
+import signal
+import tempfile
+import subprocess
+from recordz import LiveRecord
+from fakez import fakeReading
+from walz import WriteAheadLog, readSegment
+
+CHILD = len(sys.argv) > 2 and sys.argv[1] == "--child"
+SAMPLES = int(sys.argv[1]) if len(sys.argv) > 1 and not CHILD else 5_000
+# fsync cost depends entirely on the disk, point this at the SD card on the Pi
+DIRECTORY = sys.argv[2] if len(sys.argv) > 2 and not CHILD else None
+SYNC_EVERY = [None, 1, 8, 32, 256, 0]  # None: no log at all, 0: only the 1 s timer syncs
+
+def perSample(syncEvery, directory):
+    wal = None
+    if syncEvery is not None:
+        wal = WriteAheadLog(os.path.join(directory, f"wal-{syncEvery}"), syncEvery=syncEvery).start()
+    record = LiveRecord(None, wal=wal)
+    readings = [fakeReading() for _ in range(SAMPLES)]
+
+    start = time.perf_counter()
+    for reading in readings:
+        record.processMessage(reading)
+    seconds = time.perf_counter() - start
+    if wal is not None:
+        wal.stop()
+    return seconds / SAMPLES, (wal.syncs if wal is not None else 0)
+
+def child(directory):
+    # Logs samples forever, printing how many are known to be on disk after each sync
+    wal = WriteAheadLog(directory, syncEvery=32, syncInterval=None)
+    record = LiveRecord(None, wal=wal)
+    while True:
+        record.processMessage(fakeReading())
+        if wal.appended % 32 == 0:
+            print(wal.appended, flush=True)
+
+def crashTest(directory):
+    wal_dir = os.path.join(directory, "crash-wal")
+    proc = subprocess.Popen([sys.executable, __file__, "--child", wal_dir], stdout=subprocess.PIPE, text=True)
+    synced = 0
+    deadline = time.time() + 2
+    for line in proc.stdout:
+        synced = int(line)
+        if time.time() > deadline:
+            break
+    proc.send_signal(signal.SIGKILL)
+    proc.wait()
+
+    logged = sum(len(readSegment(path)["samples"]) for path in WriteAheadLog(wal_dir).segmentPaths())
+    return synced, logged
+
+if __name__ == "__main__":
+    if CHILD:
+        child(sys.argv[2])
+
+    work = tempfile.mkdtemp(dir=DIRECTORY)
+    try:
+        print(f"{'fsync every':>12} {'us/sample':>10} {'fsyncs':>7}")
+        baseline = None
+        for syncEvery in SYNC_EVERY:
+            seconds, syncs = perSample(syncEvery, work)
+            label = "no log" if syncEvery is None else "1 s timer" if syncEvery == 0 else str(syncEvery)
+            extra = "" if baseline is None else f" (+{(seconds - baseline) * 1e6:.1f})"
+            baseline = seconds if baseline is None else baseline
+            print(f"{label:>12} {seconds * 1e6:>10.1f} {syncs:>7}{extra}")
+
+        synced, logged = crashTest(work)
+        print(f"killed after {synced} samples were synced, {logged} recovered from the log "
+              f"({'ok' if logged >= synced else 'LOST SAMPLES'})")
+    finally:
+        shutil.rmtree(work)
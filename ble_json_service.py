@@ -4,16 +4,208 @@
 
 # Read sensor readings from peripheral BLE device using a JSON characteristic.
 
+import json
+import struct
 from adafruit_ble.uuid import VendorUUID
 from adafruit_ble.services import Service
 from adafruit_ble.characteristics import Characteristic
 from adafruit_ble.characteristics.json import JSONCharacteristic
 
 
+# Compact binary mode.  The peripheral publishes the field layout and units once on
+# "sensorsSchema", e.g. {"version": 1, "fields": [["soil1_temp", "f"], ["moist", "H"]],
+# "units": {"soil1_temp": "F", "moist": "%"}}, where each field type is a struct format
+# character.  Each "sensorsPacked" value then holds a header followed by several samples:
+#   header: version (B), sample count (B), sequence number of the first sample (H),
+#           peripheral clock when packed (I), the same clock as sensorsHistory's
+#   sample: age in tenths of a second when packed (H), then one value per schema field
+# The central reads the value some time after it was packed, the clock lets it tell how long.
+# Version 1 values have no clock and are still read.
+PACKED_VERSION = 2
+PACKED_HEADER = "<BBHI"
+_PACKED_HEADERS = {1: "<BBH", 2: PACKED_HEADER}
+PACKED_MAX_LENGTH = 512
+# One notification carries at most the link's ATT MTU less 3 bytes, anything longer is cut
+# short.  The peripheral can't tell what MTU a central negotiated, so this assumes the
+# default of 23.  Raise it only if every central negotiates a larger one.
+NOTIFY_MAX_LENGTH = 20
+
+def packedSampleFormat(schema):
+    return "<H" + "".join(field_type for _, field_type in schema["fields"])
+
+def packedCapacity(schema):
+    # How many samples fit in one sensorsPacked value
+    return (PACKED_MAX_LENGTH - struct.calcsize(PACKED_HEADER)) // struct.calcsize(packedSampleFormat(schema))
+
+def packSamples(schema, samples, sequence, now):
+    """
+    samples is a list of (timestamp, {field: value}) taken with the same clock as now,
+    oldest first.  Returns the bytes for sensorsPacked.
+    """
+    sample_fmt = packedSampleFormat(schema)
+    header_size = struct.calcsize(PACKED_HEADER)
+    sample_size = struct.calcsize(sample_fmt)
+    payload = bytearray(header_size + sample_size * len(samples))
+    struct.pack_into(PACKED_HEADER, payload, 0, PACKED_VERSION, len(samples), sequence & 0xFFFF, _clock(now))
+
+    offset = header_size
+    for timestamp, values in samples:
+        age = min(int((now - timestamp) * 10), 0xFFFF)
+        struct.pack_into(sample_fmt, payload, offset, age,
+                         *[values[name] for name, _ in schema["fields"]])
+        offset += sample_size
+
+    return bytes(payload)
+
+def unpackSamples(schema, payload):
+    """
+    Returns (sequence, [(age_seconds, {field: value}), ...], peripheral clock in seconds
+    when packed) from a sensorsPacked value.  The clock is None for version 1 values.
+    """
+    version = payload[0]
+    if version not in _PACKED_HEADERS:
+        raise ValueError("Unsupported packed sensor version " + str(version))
+    header = _PACKED_HEADERS[version]
+    version, count, sequence, *clock = struct.unpack_from(header, payload, 0)
+    packed_at = clock[0] / 10 if clock else None
+
+    sample_fmt = packedSampleFormat(schema)
+    sample_size = struct.calcsize(sample_fmt)
+    names = [name for name, _ in schema["fields"]]
+
+    samples = []
+    offset = struct.calcsize(header)
+    for _ in range(count):
+        fields = struct.unpack_from(sample_fmt, payload, offset)
+        samples.append((fields[0] / 10, dict(zip(names, fields[1:]))))
+        offset += sample_size
+
+    return sequence, samples, packed_at
+
+
+# History backfill.  The peripheral keeps its latest samples in a SampleHistory, numbered with
+# the same 16 bit sequence as sensorsPacked, so a central that was away can ask for what it
+# missed.  The central writes the sequence number it wants next to "sensorsHistory" (HISTORY_REQUEST),
+# the peripheral replaces it with a page of samples from there on:
+#   header: version (B), sample count (B), requested sequence (H), sequence of the first sample (H),
+#           peripheral clock when paged (I)
+#   sample: peripheral clock when taken (I), then one value per schema field
+# The clock is time.monotonic() in tenths of a second, so samples keep the peripheral's own
+# timing however long the central was gone.  The first sample is later than requested when the
+# ones in between have already been dropped, and a short page means there is nothing more.
+# The schema's "boot" value changes whenever the peripheral restarts and its sequence starts over.
+HISTORY_VERSION = 1
+HISTORY_HEADER = "<BBHHI"
+HISTORY_REQUEST = "<H"
+HISTORY_CAPACITY = 720 # [samples] kept on the peripheral, 18 h at the central's 90 s cadence
+
+def historySampleFormat(schema):
+    return "<I" + "".join(field_type for _, field_type in schema["fields"])
+
+def historyCapacity(schema):
+    # How many samples fit in one sensorsHistory page
+    return (PACKED_MAX_LENGTH - struct.calcsize(HISTORY_HEADER)) // struct.calcsize(historySampleFormat(schema))
+
+def _clock(seconds):
+    return int(seconds * 10) & 0xFFFFFFFF
+
+def packHistory(schema, samples, request, now):
+    """
+    samples is a list of (sequence, timestamp, {field: value}) from SampleHistory.since(),
+    taken with the same clock as now.  Returns the bytes of one sensorsHistory page.
+    """
+    sample_fmt = historySampleFormat(schema)
+    header_size = struct.calcsize(HISTORY_HEADER)
+    sample_size = struct.calcsize(sample_fmt)
+    first = samples[0][0] if samples else request
+    payload = bytearray(header_size + sample_size * len(samples))
+    struct.pack_into(HISTORY_HEADER, payload, 0, HISTORY_VERSION, len(samples), request & 0xFFFF,
+                     first & 0xFFFF, _clock(now))
+
+    offset = header_size
+    for _, timestamp, values in samples:
+        struct.pack_into(sample_fmt, payload, offset, _clock(timestamp),
+                         *[values[name] for name, _ in schema["fields"]])
+        offset += sample_size
+
+    return bytes(payload)
+
+def unpackHistory(schema, payload):
+    """
+    Returns (request, first sequence, [(age_seconds, {field: value}), ...]) from a
+    sensorsHistory page, or None while it still holds the request.
+    """
+    if len(payload) < struct.calcsize(HISTORY_HEADER):
+        return None
+    version, count, request, first, now = struct.unpack_from(HISTORY_HEADER, payload, 0)
+    if version != HISTORY_VERSION:
+        raise ValueError("Unsupported sensor history version " + str(version))
+
+    sample_fmt = historySampleFormat(schema)
+    sample_size = struct.calcsize(sample_fmt)
+    names = [name for name, _ in schema["fields"]]
+
+    samples = []
+    offset = struct.calcsize(HISTORY_HEADER)
+    for _ in range(count):
+        fields = struct.unpack_from(sample_fmt, payload, offset)
+        samples.append((((now - fields[0]) & 0xFFFFFFFF) / 10, dict(zip(names, fields[1:]))))
+        offset += sample_size
+
+    return request, first, samples
+
+def _atOrAfter(sequence, start):
+    return ((sequence - start) & 0xFFFF) < 0x8000
+
+class SampleHistory:
+    """
+    The peripheral's latest `capacity` samples, oldest first, each with its
+    sequence number.  Plain lists so it runs on CircuitPython.
+    """
+
+    def __init__(self, capacity=HISTORY_CAPACITY, sequence=0):
+        self.capacity = capacity
+        self.nextSequence = sequence & 0xFFFF
+        self._samples = []
+        self._start = 0
+
+    def append(self, timestamp, values):
+        """
+        Keeps a sample, dropping the oldest once full.  Returns its sequence number.
+        """
+        sequence = self.nextSequence
+        entry = (sequence, timestamp, values)
+        if len(self._samples) < self.capacity:
+            self._samples.append(entry)
+        else:
+            self._samples[self._start] = entry
+            self._start = (self._start + 1) % self.capacity
+        self.nextSequence = (sequence + 1) & 0xFFFF
+        return sequence
+
+    def since(self, sequence, limit):
+        """
+        Up to limit samples from sequence on, or from the oldest kept if that's
+        already gone.
+        """
+        ordered = self._samples[self._start:] + self._samples[:self._start]
+        for i, entry in enumerate(ordered):
+            if _atOrAfter(entry[0], sequence):
+                return ordered[i:i + limit]
+        return []
+
+
 # A custom service with two JSON characteristics for this device.  The "sensors" characteristic
 # provides updated sensor values for any connected device to read.  The "settings" characteristic
 # can be changed by any connected device to update the peripheral's settings.  The UUID of your
 # service can be any valid random uuid (some BLE UUID's are reserved).
+# The "sensorsNotify" characteristic tells any subscribed central about each new reading, so
+# centrals don't have to poll "sensors".  A reading that fits in one notification is pushed
+# whole, a longer one as a short {"sequence": n} marker for the central to read "sensors"
+# after.  Use publish() to update both.
+# "sensorsSchema" and "sensorsPacked" are the compact binary mode described above, JSON stays
+# available for centrals that don't read the schema.  "sensorsHistory" serves the backfill
+# described above, call serveHistory() from the peripheral's main loop.
 # NOTE: JSON data is limited by characteristic max_length of 512 byes.
 class SensorService(Service):
     # pylint: disable=too-few-public-methods
@@ -31,6 +223,58 @@ class SensorService(Service):
         properties=Characteristic.READ,
     )
 
+    sensorsNotify = JSONCharacteristic(
+        uuid=VendorUUID("0f8c2a51-6d2b-4c3e-9a57-3b1f8e6d7c20"),
+        properties=Characteristic.READ | Characteristic.NOTIFY,
+    )
+
+    sensorsSchema = JSONCharacteristic(
+        uuid=VendorUUID("7d3e9b06-2f4a-4d8b-b1c5-5e0a6c9f4b13"),
+        properties=Characteristic.READ,
+    )
+
+    sensorsPacked = Characteristic(
+        uuid=VendorUUID("c4a61f27-8e35-4b9d-a0f2-1d7b3e5c8a94"),
+        properties=Characteristic.READ | Characteristic.NOTIFY,
+        max_length=PACKED_MAX_LENGTH,
+        fixed_length=False,
+    )
+
+    sensorsHistory = Characteristic(
+        uuid=VendorUUID("9b2e4c71-3a8f-4e06-b5d2-7c1a0f6e3d58"),
+        properties=Characteristic.READ | Characteristic.WRITE,
+        max_length=PACKED_MAX_LENGTH,
+        fixed_length=False,
+    )
+
     def __init__(self, service=None):
         super().__init__(service=service)
         self.connectable = True
+
+    def publish(self, reading, sequence=None):
+        # Keep the polled characteristic in step for centrals that don't subscribe.
+        # With a sequence number, centrals can tell repeats and gaps apart.
+        if sequence is not None:
+            reading["sequence"] = sequence & 0xFFFF
+        self.sensors = reading
+        if len(json.dumps(reading).encode("utf-8")) <= NOTIFY_MAX_LENGTH:
+            self.sensorsNotify = reading
+        else:
+            self.sensorsNotify = {"sequence": reading.get("sequence")}
+
+    def publishPacked(self, samples, sequence, now):
+        # samples must already fit, see packedCapacity()
+        self.sensorsPacked = packSamples(self.sensorsSchema, samples, sequence, now)
+
+    def serveHistory(self, history, now):
+        """
+        Answers a pending history request from history, a SampleHistory.  Returns
+        True if there was one.
+        """
+        request = self.sensorsHistory
+        if request is None or len(request) != struct.calcsize(HISTORY_REQUEST):
+            return False
+        sequence = struct.unpack(HISTORY_REQUEST, request)[0]
+        schema = self.sensorsSchema
+        self.sensorsHistory = packHistory(schema, history.since(sequence, historyCapacity(schema)), sequence, now)
+        return True
@@ -0,0 +1,147 @@
+import numpy as np
+
+
+CHUNK_SIZE = 4096 # [samples] per preallocated column chunk
+
+def _dtypeFor(value):
+    if isinstance(value, bool):
+        return np.dtype(object)
+    if isinstance(value, (int, np.integer)):
+        return np.dtype(np.int64)
+    if isinstance(value, (float, np.floating)):
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+def _missingFor(dtype):
+    return None if dtype == object else np.nan
+
+class SampleBuffer:
+    """
+    Growable columnar store for sensor samples. Each sensor key gets its own typed
+    array, allocated in fixed size chunks so appending never copies earlier samples.
+    A DataFrame is only built when asked for, and cached until the next append.
+    """
+
+    def __init__(self, chunkSize=CHUNK_SIZE):
+        self.chunkSize = chunkSize
+        self.columns = {}   # key -> list of numpy chunks
+        self.dtypes = {}    # key -> numpy dtype of the column
+        self.length = 0
+        self.numChunks = 0
+        self._latest = None
+        self._frame = None
+
+    def __len__(self):
+        return self.length
+
+    @classmethod
+    def fromDataFrame(cls, dataFrame, chunkSize=CHUNK_SIZE):
+        buffer = cls(chunkSize)
+        if dataFrame is None or dataFrame.empty:
+            return buffer
+
+        for sample in dataFrame.to_dict(orient="records"):
+            buffer.append(sample)
+
+        return buffer
+
+    def _newChunk(self, dtype):
+        if dtype == object:
+            return np.full(self.chunkSize, None, dtype=object)
+        return np.empty(self.chunkSize, dtype=dtype)
+
+    def _addColumn(self, key, dtype):
+        if dtype == np.int64 and self.length > 0:
+            # Earlier samples are missing this key, and integers can't hold NaN
+            dtype = np.dtype(np.float64)
+
+        # Back fill the new column so it lines up with the samples already stored
+        chunks = []
+        for _ in range(self.numChunks):
+            chunk = self._newChunk(dtype)
+            chunk[:] = _missingFor(dtype)
+            chunks.append(chunk)
+
+        self.dtypes[key] = dtype
+        self.columns[key] = chunks
+
+    def _castColumn(self, key, dtype):
+        self.dtypes[key] = dtype
+        self.columns[key] = [chunk.astype(dtype) for chunk in self.columns[key]]
+
+    def _store(self, key, index, value):
+        dtype = self.dtypes[key]
+        valueType = _dtypeFor(value)
+
+        if dtype != valueType and dtype != object:
+            if dtype == np.int64 and valueType == np.float64:
+                self._castColumn(key, np.dtype(np.float64))
+            elif not (dtype == np.float64 and valueType == np.int64):
+                self._castColumn(key, np.dtype(object))
+
+        chunk, offset = divmod(index, self.chunkSize)
+        self.columns[key][chunk][offset] = value
+
+    def _storeMissing(self, key, index):
+        if self.dtypes[key] == np.int64:
+            self._castColumn(key, np.dtype(np.float64))
+
+        chunk, offset = divmod(index, self.chunkSize)
+        self.columns[key][chunk][offset] = _missingFor(self.dtypes[key])
+
+    def append(self, sample: dict):
+        index = self.length
+
+        for key, value in sample.items():
+            if key not in self.columns:
+                self._addColumn(key, _dtypeFor(value))
+
+        if index % self.chunkSize == 0:
+            for key, chunks in self.columns.items():
+                chunks.append(self._newChunk(self.dtypes[key]))
+            self.numChunks += 1
+
+        for key in self.columns:
+            if key in sample:
+                self._store(key, index, sample[key])
+            else:
+                self._storeMissing(key, index)
+
+        self.length += 1
+        self._latest = sample
+        self._frame = None
+
+    def latest(self):
+        """
+        Returns the newest sample as a dict, without touching the column arrays.
+        """
+        return self._latest
+
+    def first(self, key, default=None):
+        if self.length == 0 or key not in self.columns:
+            return default
+        return self.columns[key][0][0]
+
+    def column(self, key):
+        if key not in self.columns:
+            return None
+        if not self.columns[key]:
+            return np.empty(0, dtype=self.dtypes[key])
+        return np.concatenate(self.columns[key])[:self.length]
+
+    def toColumns(self):
+        """
+        {key: [value, ...]} of plain Python values, what a saved record holds,
+        without going through pandas.
+        """
+        return {key: self.column(key).tolist() for key in self.columns}
+
+    def toDataFrame(self):
+        if self.length == 0:
+            return None
+
+        if self._frame is None:
+            import pandas as pd
+            self._frame = pd.DataFrame({key: self.column(key) for key in self.columns})
+
+        return self._frame
@@ -0,0 +1,22 @@
+# Index every record and bundle file in a record directory in its manifest,
+# from scratch. Meant to run on RangerLab against the record directory, once
+# for a directory that predates manifests and again whenever one looks wrong.
+# Run it while nothing uploads to the directory, or an upload that lands
+# mid-scan can be missed until the next run. With --source, the records one
+# peripheral of a multi-central uploaded, in its subdirectory of record_dir.
+#
+# usage: python build-manifest.py [record_dir] [--no-checksums] [--source=<address>]
+
+import sys
+import time
+from recordz import REMOTE_DIR, sourceRemoteDir
+from manifestz import LocalFs, Manifest
+
+args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+sources = [arg.split("=", 1)[1] for arg in sys.argv[1:] if arg.startswith("--source=")]
+record_dir = sourceRemoteDir(sources[0] if sources else None, args[0] if args else REMOTE_DIR)
+checksums = "--no-checksums" not in sys.argv
+
+start = time.perf_counter()
+count = Manifest(record_dir).rebuild(LocalFs(), checksums=checksums)
+print(f"Indexed {count} records in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,25 @@
+# Fold new record files into the hourly and daily rollups that sit next to
+# them. Meant to run on RangerLab against the record directory, e.g. from cron
+# every few minutes; only records it hasn't seen before are read. With
+# --source, the records one peripheral of a multi-central uploaded, in its
+# subdirectory of record_dir.
+#
+# usage: python build-rollups.py [record_dir] [--source=<address>]
+
+import sys
+import time
+from recordz import REMOTE_DIR, sourceRemoteDir
+from rollupz import RollupStore, TIERS
+
+args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+sources = [arg.split("=", 1)[1] for arg in sys.argv[1:] if arg.startswith("--source=")]
+record_dir = sourceRemoteDir(sources[0] if sources else None, args[0] if args else REMOTE_DIR)
+
+start = time.perf_counter()
+store = RollupStore(record_dir)
+added = store.updateRecordFiles()
+print(f"Rolled up {added} new records in {time.perf_counter() - start:.1f} s")
+
+for tier in TIERS:
+    frame, _ = store.readTier(tier)
+    print(f"  {tier}: {0 if frame is None else len(frame)} buckets")
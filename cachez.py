@@ -0,0 +1,113 @@
+import os
+import json
+import time
+from codecz import recordSpan
+
+
+CACHE_MAX_BYTES = 512 * 1024 * 1024 # [bytes] kept before the least recently used records go
+INDEX_NAME = ".cache-index.json"
+
+class ArchiveCache:
+    """
+    Local copy of archived records that survives between ArchiveRecords.
+    Records never change once uploaded (they're named by their first
+    timestamp), so a cached file is good as long as its size and mtime still
+    match the remote listing. The least recently used records are dropped once
+    the cache grows past maxBytes.
+    """
+
+    def __init__(self, directory, maxBytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.indexPath = os.path.join(directory, INDEX_NAME)
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.lastUsed = self._loadIndex()   # name -> time.time() of last use
+
+    def _loadIndex(self):
+        try:
+            with open(self.indexPath, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        partial_path = self.indexPath + ".part"
+        with open(partial_path, "w") as f:
+            json.dump(self.lastUsed, f)
+        os.replace(partial_path, self.indexPath)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def isValid(self, name, size, mtime):
+        try:
+            st = os.stat(self.path(name))
+        except OSError:
+            return False
+        return st.st_size == size and int(st.st_mtime) == int(mtime)
+
+    def missing(self, entries):
+        """
+        entries is a list of (name, size, mtime) from the remote listing. Returns
+        the names that have to be downloaded.
+        """
+        names = []
+        for name, size, mtime in entries:
+            if self.isValid(name, size, mtime):
+                self.hits += 1
+            else:
+                self.misses += 1
+                names.append(name)
+        return names
+
+    def landed(self, entries):
+        """
+        Stamps freshly downloaded files with their remote mtime, so the next
+        lookup can validate them without asking RangerLab for more than a listing.
+        """
+        for name, size, mtime in entries:
+            file_path = self.path(name)
+            if os.path.isfile(file_path):
+                os.utime(file_path, (mtime, mtime))
+
+    def touch(self, names):
+        now = time.time()
+        for name in names:
+            self.lastUsed[name] = now
+
+    def namesInRange(self, start, end):
+        """
+        Cached records within [start, end], for when RangerLab can't be listed.
+        """
+        start, end = int(start), int(end)
+        names = []
+        for name in os.listdir(self.directory):
+            span = recordSpan(name)
+            if span and span[0] <= end and span[1] >= start:
+                names.append(name)
+        return sorted(names)
+
+    def evict(self, keep=()):
+        keep = set(keep)
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if recordSpan(name) is None:
+                continue
+            size = os.path.getsize(self.path(name))
+            total += size
+            files.append((self.lastUsed.get(name, 0), name, size))
+
+        for _, name, size in sorted(files):
+            if total <= self.maxBytes:
+                break
+            if name in keep:
+                continue
+            os.remove(self.path(name))
+            self.lastUsed.pop(name, None)
+            total -= size
+
+        return total
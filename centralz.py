@@ -0,0 +1,725 @@
+import asyncio
+import json
+import os
+import queue
+import random
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metricz
+from metricz import timed, timer
+from recordz import Record, LiveRecord, sourceDirName, sourceRemoteDir
+from samplez import AdaptiveSampler
+from ble_json_service import HISTORY_REQUEST, historyCapacity, unpackHistory, unpackSamples
+from walz import WriteAheadLog
+
+
+LOG_CADENCE = 60*1.5 # [s]
+RECORD_LIFESPAN = 60*10 # [s]
+SCAN_INTERVAL = 10 # [s] between scans for new peripherals
+SCAN_TIMEOUT = 5 # [s]
+READ_TIMEOUT = 10 # [s]
+RECONNECT_DELAY = 1 # [s] first retry, doubles up to MAX_RECONNECT_DELAY
+MAX_RECONNECT_DELAY = 60 # [s]
+MAX_RECONNECT_ATTEMPTS = 5 # then forget the peripheral until it is scanned again
+POLL_INTERVAL = 0.5 # [s] between reads of service.sensors when notify isn't available
+NOTIFY_QUEUE_SIZE = 64 # [readings] kept for a slow consumer, oldest dropped first
+HISTORY_TIMEOUT = 5 # [s] for the peripheral to answer one history page request
+HISTORY_POLL = 0.05 # [s] between reads while waiting on a history page
+DIRECT_TIMEOUT = 2 # [s] for a directed reconnect to the last peripheral to see it advertise
+DIRECT_ATTEMPTS = 2 # directed reconnects before falling back to a scan
+SCAN_BACKOFF = 1 # [s] first wait after a scan that found nothing, doubles up to MAX_SCAN_BACKOFF
+MAX_SCAN_BACKOFF = 30 # [s]
+CLOCK_SLEW = 1e-4 # [s/s] how fast a peripheral's clock may fall behind the central's, 100 ppm
+
+
+class SensorSubscription:
+    """
+    Subscribes to SensorService.sensorsNotify so the peripheral pushes each new
+    reading instead of the central polling service.sensors. Readings pushed
+    whole are handed to `callback` (on the BLE thread), all are queued for
+    `get`. A reading too long for one notification arrives as a marker, or
+    cut short by older firmware, and `get` reads service.sensors for it
+    instead. Readings carrying a sequence number that was already seen are
+    dropped. address labels the queue depth gauge when several peripherals
+    are subscribed to at once.
+
+    Every push is a reading, LOG_CADENCE plays no part: the peripheral's own
+    publish rate sets how often readings arrive, leave it to the caller's
+    sampler to thin them out.
+    """
+
+    def __init__(self, service, callback=None, maxQueue=NOTIFY_QUEUE_SIZE, lastSequence=None, address=None):
+        self.service = service
+        self.callback = callback
+        self.queue = queue.Queue(maxQueue)
+        self.received = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.lastSequence = lastSequence
+        self._delivered = lastSequence   # sequence of the last reading get() returned
+
+        # Reading the attribute binds the remote characteristic, and raises
+        # AttributeError if the peripheral's firmware predates sensorsNotify
+        service.sensorsNotify
+        self.characteristic = service.bleio_characteristics["sensorsNotify"]
+
+        # Same hook _bleio.PacketBuffer uses to see incoming notifications
+        self.characteristic._add_notify_callback(self._onNotify)
+        self.characteristic.set_cccd(notify=True)
+
+        self._labels = {} if address is None else {"address": address}
+        metricz.watch("notify_queue_depth", self.queue.qsize, "Pushed readings waiting to be processed",
+                      **self._labels)
+
+    @classmethod
+    def open(cls, service, callback=None, lastSequence=None, address=None):
+        """
+        Returns a subscription, or None when the peripheral can't notify and the
+        caller should fall back to polling.
+        """
+        try:
+            return cls(service, callback, lastSequence=lastSequence, address=address)
+        except Exception as e:
+            print(f"Sensor notifications unavailable, polling instead: {e}")
+            return None
+
+    def _onNotify(self, data):
+        try:
+            message = json.loads(str(data, "utf-8"))
+        except ValueError:
+            # Cut short at the link's MTU by firmware that pushes every reading
+            # whole, get() reads the reading instead
+            message = {}
+
+        sequence = message.get("sequence")
+        if sequence is not None:
+            if not _isNewer(sequence, self.lastSequence):
+                self.duplicates += 1
+                metricz.inc("notify_duplicates_total", help="Pushed readings already seen")
+                return
+            self.lastSequence = sequence
+
+        self.received += 1
+        metricz.inc("notifications_total", help="Readings pushed by peripherals")
+        if self.callback is not None and "sensor_data" in message:
+            self.callback(message)
+
+        if self.queue.full():
+            # Latest readings matter most, make room by dropping the oldest
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+                metricz.inc("dropped_reads_total", help="Readings lost before processing", reason="queue_full")
+            except queue.Empty:
+                pass
+        self.queue.put_nowait(message)
+
+    def get(self, timeout=None):
+        """
+        Blocks until the next reading arrives, returns None on timeout. For a
+        marker this reads service.sensors, and returns None too if that holds a
+        reading already returned.
+        """
+        try:
+            message = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if "sensor_data" not in message:
+            message = self.service.sensors
+            if not message or "sensor_data" not in message:
+                return None
+        sequence = message.get("sequence")
+        if sequence is not None:
+            # The read can be ahead of its marker, the next marker then finds
+            # the same reading again
+            if not _isNewer(sequence, self._delivered):
+                self.duplicates += 1
+                metricz.inc("notify_duplicates_total", help="Pushed readings already seen")
+                return None
+            self._delivered = sequence
+            if _isNewer(sequence, self.lastSequence):
+                self.lastSequence = sequence
+        return message
+
+    def close(self):
+        try:
+            self.characteristic.set_cccd(notify=False)
+        except Exception:
+            pass
+        self.characteristic._remove_notify_callback(self._onNotify)
+        metricz.unwatch("notify_queue_depth", **self._labels)
+
+def _isNewer(sequence, last):
+    # 16 bit sequence numbers wrap, anything up to half the range ahead is newer
+    return last is None or 0 < ((sequence - last) & 0xFFFF) < 0x8000
+
+class PackedSensorReader:
+    """
+    Reads the compact binary sensorsPacked characteristic. The schema and units
+    are read once per connection, each read then returns only the samples that
+    weren't seen before, timestamped with the central's clock. lastSequence
+    picks up where an earlier connection (or a HistoryReader) left off.
+
+    A value is read some time after the peripheral packed it, so ages are taken
+    from when it was packed, on the peripheral's clock. Every read bounds the
+    offset between the two clocks from above (it can't arrive before it was
+    packed), and the lowest bound so far is the estimate, allowed to creep up
+    by CLOCK_SLEW for a peripheral clock that runs slow.
+    """
+
+    def __init__(self, service, lastSequence=None):
+        self.service = service
+        self.schema = service.sensorsSchema
+        if not self.schema or not self.schema.get("fields"):
+            raise ValueError("Peripheral has not published a sensor schema")
+        self.units = self.schema.get("units", {})
+        self.lastSequence = lastSequence
+        self.duplicates = 0
+        self.clockOffset = None     # central time minus peripheral clock
+        self._syncedAt = None
+
+    @classmethod
+    def open(cls, service, lastSequence=None):
+        """
+        Returns a reader, or None when the peripheral only speaks JSON.
+        """
+        try:
+            return cls(service, lastSequence)
+        except Exception as e:
+            print(f"Packed sensor mode unavailable, using JSON: {e}")
+            return None
+
+    def decode(self, payload, receivedAt=None):
+        if receivedAt is None:
+            receivedAt = time.time()
+
+        sequence, samples, packedAt = unpackSamples(self.schema, payload)
+        if packedAt is not None:
+            bound = receivedAt - packedAt
+            if self.clockOffset is not None:
+                bound = min(bound, self.clockOffset + CLOCK_SLEW * (receivedAt - self._syncedAt))
+            self.clockOffset = bound
+            self._syncedAt = receivedAt
+        # When the value was packed, on the central's clock. Version 1 values
+        # can only be taken as packed when read.
+        packedHere = receivedAt if packedAt is None else packedAt + self.clockOffset
+
+        newSamples = []
+        for i, (age, values) in enumerate(samples):
+            sampleSequence = (sequence + i) & 0xFFFF
+            if not _isNewer(sampleSequence, self.lastSequence):
+                self.duplicates += 1
+                metricz.inc("packed_duplicates_total", help="Packed samples already seen")
+                continue
+            values["timestamp"] = packedHere - age
+            newSamples.append(values)
+            self.lastSequence = sampleSequence
+
+        return newSamples
+
+    @timed("ble_read")
+    def read(self):
+        payload = self.service.sensorsPacked
+        if not payload:
+            return []
+        return self.decode(bytes(payload))
+
+class HistoryReader:
+    """
+    Pulls what a peripheral sampled while the central was away from its
+    sensorsHistory characteristic, a page at a time, see ble_json_service.
+    Samples keep the peripheral's timing, moved onto the central's clock.
+    """
+
+    def __init__(self, service, schema=None):
+        self.service = service
+        self.schema = schema if schema is not None else service.sensorsSchema
+        if not self.schema or not self.schema.get("fields"):
+            raise ValueError("Peripheral has not published a sensor schema")
+        # Reading the attribute binds the remote characteristic, and raises
+        # AttributeError if the peripheral's firmware predates sensorsHistory
+        service.sensorsHistory
+        self.units = self.schema.get("units", {})
+        # Sequence numbers start over whenever this changes
+        self.boot = self.schema.get("boot")
+        self.capacity = historyCapacity(self.schema)
+        self.lastSequence = None
+        self.lost = 0
+
+    @classmethod
+    def open(cls, service, schema=None):
+        """
+        Returns a reader, or None when the peripheral keeps no history.
+        """
+        try:
+            return cls(service, schema)
+        except Exception as e:
+            print(f"Sensor history unavailable, no backfill: {e}")
+            return None
+
+    def readPage(self, sequence, timeout=HISTORY_TIMEOUT):
+        """
+        Asks for the samples from sequence on. Returns (first sequence, samples)
+        with each sample timestamped, or raises TimeoutError.
+        """
+        self.service.sensorsHistory = struct.pack(HISTORY_REQUEST, sequence)
+        deadline = time.monotonic() + timeout
+        while True:
+            payload = self.service.sensorsHistory
+            page = unpackHistory(self.schema, bytes(payload)) if payload else None
+            if page is not None and page[0] == sequence:
+                receivedAt = time.time()
+                _, first, samples = page
+                for age, values in samples:
+                    values["timestamp"] = receivedAt - age
+                return first, [values for _, values in samples]
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No history page for sequence {sequence}")
+            time.sleep(HISTORY_POLL)
+
+    @timed("history_pull")
+    def pull(self, since=None):
+        """
+        Every sample after sequence `since`, the last one the central took in,
+        oldest first. None pulls everything since the peripheral booted.
+        Afterwards lastSequence is the newest one pulled.
+        """
+        sequence = 0 if since is None else (since + 1) & 0xFFFF
+        self.lastSequence = since
+        samples = []
+        while True:
+            first, page = self.readPage(sequence)
+            if not page:
+                break
+            if first != sequence:
+                # The peripheral already dropped these to make room
+                missed = (first - sequence) & 0xFFFF
+                self.lost += missed
+                metricz.inc("history_lost_total", missed, help="Samples dropped by a peripheral before backfill")
+            samples.extend(page)
+            self.lastSequence = (first + len(page) - 1) & 0xFFFF
+            sequence = (self.lastSequence + 1) & 0xFFFF
+            if len(page) < self.capacity:
+                break
+
+        metricz.inc("backfilled_samples_total", len(samples), help="Samples pulled from peripheral history")
+        return samples
+
+@timed("ble_read")
+def pollSensors(connection, service, interval=POLL_INTERVAL):
+    """
+    Fallback for peripherals without sensorsNotify. Waits for service.sensors
+    to hold a reading, sleeping between reads. Returns None if the link drops.
+    """
+    while connection.connected:
+        message = service.sensors
+        if message is not None:
+            return message
+        time.sleep(interval)
+    return None
+
+
+class ConnectionManager:
+    """
+    Connects simple-central to a SensorService peripheral, and back to it after
+    the link drops. The last peripheral's address is kept so a reconnect goes
+    straight to it first, which after a brief RF dropout costs about one
+    advertising interval. Only if that fails is there a scan, filtered to
+    SensorService advertisers and stopped at the first one, for at most
+    scanTimeout, with exponential backoff and jitter between scans that find
+    nothing. onScan is called before every scan, e.g. to show the link is down.
+
+    ble is an adafruit_ble.BLERadio, sleep and clock are only there so
+    bench-reconnect.py can run it on simulated time.
+    """
+
+    def __init__(self, ble, scanTimeout=SCAN_TIMEOUT, directTimeout=DIRECT_TIMEOUT,
+                 directAttempts=DIRECT_ATTEMPTS, backoff=SCAN_BACKOFF, maxBackoff=MAX_SCAN_BACKOFF,
+                 onScan=None, sleep=time.sleep, clock=time.monotonic):
+        self.ble = ble
+        self.scanTimeout = scanTimeout
+        self.directTimeout = directTimeout
+        self.directAttempts = directAttempts
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.onScan = onScan
+        self.sleep = sleep
+        self.clock = clock
+
+        self.address = None     # of the last peripheral connected to
+        self.connection = None
+        self.direct = 0         # reconnects that didn't need a scan
+        self.scans = 0
+        self.lastReconnect = None   # [s] from noticing the drop to connected again
+
+    def connect(self):
+        """
+        Returns a live connection, blocking until there is one.
+        """
+        if self.connection is not None and self.connection.connected:
+            return self.connection
+
+        start = self.clock()
+        reconnecting = self.address is not None
+        path = "direct"
+        connection = self._direct() if reconnecting else None
+        delay = self.backoff
+        while connection is None:
+            path = "scan"
+            connection = self._scan()
+            if connection is None:
+                wait = delay * random.uniform(0.5, 1.5)
+                print(f"No sensor service found, scanning again in {wait:.1f} s")
+                self.sleep(wait)
+                delay = min(delay * 2, self.maxBackoff)
+
+        self.connection = connection
+        print("Connected")
+        if reconnecting:
+            self.lastReconnect = self.clock() - start
+            if path == "direct":
+                self.direct += 1
+            metricz.inc("reconnect_paths_total", help="Reconnects, by whether they needed a scan", path=path)
+            metricz.observe(f"reconnect_{path}", self.lastReconnect)
+        return connection
+
+    def _direct(self):
+        for _ in range(self.directAttempts):
+            try:
+                connection = self.ble.connect(self.address, timeout=self.directTimeout)
+            except Exception as e:
+                print(f"Direct reconnect failed: {e}")
+                continue
+            if connection.connected:
+                return connection
+        return None
+
+    def _scan(self):
+        from adafruit_ble.advertising.standard import ProvideServicesAdvertisement
+        from ble_json_service import SensorService
+
+        if self.onScan is not None:
+            self.onScan()
+        print("Scanning for BLE device advertising our sensor service...")
+        self.scans += 1
+        metricz.inc("scans_total", help="Scans for a SensorService peripheral")
+        connection = None
+        try:
+            for adv in self.ble.start_scan(ProvideServicesAdvertisement, timeout=self.scanTimeout):
+                if SensorService in adv.services:
+                    connection = self.ble.connect(adv)
+                    self.address = adv.address
+                    break
+        except Exception as e:
+            print(f"Connect after scan failed: {e}")
+        finally:
+            self.ble.stop_scan()
+        return connection
+
+
+class Radio:
+    """
+    What the central needs from a BLE radio. AdafruitRadio drives real hardware,
+    fakez.FakeRadio serves an in-process fleet of fake peripherals.
+    """
+
+    async def scan(self, timeout=SCAN_TIMEOUT):
+        """
+        Returns a list of peripherals advertising SensorService. Each one has an
+        `address` attribute that stays the same across reconnects.
+        """
+        raise NotImplementedError
+
+    async def connect(self, peripheral):
+        """
+        Returns a Link to the peripheral.
+        """
+        raise NotImplementedError
+
+class Link:
+    """
+    An open connection to one peripheral. Links with `pushes` set deliver each
+    new reading from readSensors as the peripheral sends it, instead of the
+    current value, so the central doesn't wait out its cadence between reads.
+    """
+    address = None
+    pushes = False
+
+    @property
+    def connected(self):
+        raise NotImplementedError
+
+    async def readSensors(self):
+        """
+        Returns the peripheral's sensors message, same shape as SensorService.sensors.
+        """
+        raise NotImplementedError
+
+    async def disconnect(self):
+        raise NotImplementedError
+
+
+class AdafruitRadio(Radio):
+    """
+    Radio backed by adafruit_ble. The library blocks, so every call runs on a
+    worker thread and a slow peripheral only ties up its own thread.
+    """
+
+    def __init__(self, ble=None, maxWorkers=64):
+        from adafruit_ble import BLERadio
+        self.ble = ble if ble is not None else BLERadio()
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _scan(self, timeout):
+        from adafruit_ble.advertising.standard import ProvideServicesAdvertisement
+        from ble_json_service import SensorService
+
+        found = {}
+        for adv in self.ble.start_scan(ProvideServicesAdvertisement, timeout=timeout):
+            if SensorService in adv.services:
+                found[str(adv.address)] = _AdafruitPeripheral(adv)
+        self.ble.stop_scan()
+        return list(found.values())
+
+    async def scan(self, timeout=SCAN_TIMEOUT):
+        return await self._run(self._scan, timeout)
+
+    def _connect(self, peripheral):
+        from ble_json_service import SensorService
+
+        connection = self.ble.connect(peripheral.advertisement)
+        return _AdafruitLink(self, peripheral.address, connection, connection[SensorService])
+
+    async def connect(self, peripheral):
+        return await self._run(self._connect, peripheral)
+
+class _AdafruitPeripheral:
+    def __init__(self, advertisement):
+        self.advertisement = advertisement
+        self.address = str(advertisement.address)
+
+class _AdafruitLink(Link):
+    def __init__(self, radio, address, connection, service):
+        self.radio = radio
+        self.address = address
+        self.connection = connection
+        self.service = service
+        self.subscription = SensorSubscription.open(service, address=address)
+        self.pushes = self.subscription is not None
+
+    @property
+    def connected(self):
+        return self.connection.connected
+
+    async def readSensors(self):
+        if self.subscription is not None:
+            return await self.radio._run(self.subscription.get, POLL_INTERVAL)
+        return await self.radio._run(lambda: self.service.sensors)
+
+    async def disconnect(self):
+        if self.subscription is not None:
+            self.subscription.close()
+        await self.radio._run(self.connection.disconnect)
+
+
+class MultiCentral:
+    """
+    Keeps a connection open to every SensorService peripheral in range. Each
+    peripheral gets its own task and its own LiveRecord, keyed by address, so
+    one slow or flapping node never holds up the others. With adaptive set,
+    each peripheral also gets an AdaptiveSampler that sets its read interval
+    and drops readings within their deadband, `sampling` being its settings.
+    Every record's samples go to `broadcaster`, a livez.LiveServer, if given.
+    Finished records go to `uploader`, a remotez.UploadWorker shared by every
+    peripheral, and with walDir each peripheral logs its samples to a
+    walz.WriteAheadLog of its own in a subdirectory named after it.
+    """
+
+    def __init__(self, radio: Radio, cadence=LOG_CADENCE, lifespan=RECORD_LIFESPAN,
+                 scanInterval=SCAN_INTERVAL, readTimeout=READ_TIMEOUT, maxDevices=None,
+                 saveOnDisconnect=True, onSample=None, adaptive=False, sampling=None, broadcaster=None,
+                 uploader=None, linkMonitor=None, walDir=None):
+        self.radio = radio
+        self.cadence = cadence
+        self.lifespan = lifespan
+        self.scanInterval = scanInterval
+        self.readTimeout = readTimeout
+        self.maxDevices = maxDevices
+        self.saveOnDisconnect = saveOnDisconnect
+        self.onSample = onSample
+        self.adaptive = adaptive
+        self.sampling = sampling
+        self.broadcaster = broadcaster
+        self.uploader = uploader
+        self.linkMonitor = linkMonitor
+        self.walDir = walDir
+
+        self.records = {}   # address -> LiveRecord
+        self.wals = {}      # sourceDirName(address) -> WriteAheadLog
+        self.samplers = {}  # address -> AdaptiveSampler, kept across reconnects
+        self.tasks = {}     # address -> asyncio.Task
+        self.links = {}     # address -> Link while connected
+        self.reconnects = {}    # address -> number of reconnects
+        self._running = False
+
+        metricz.watch("connected_peripherals", lambda: len(self.links), "Peripherals with an open link")
+
+    def liveRecord(self, address):
+        record = self.records.get(address)
+        if record is None or not record.isLive:
+            record = LiveRecord(self.lifespan, source=address, uploader=self.uploader,
+                                linkMonitor=self.linkMonitor, wal=self.wal(address),
+                                broadcaster=self.broadcaster)
+            self.records[address] = record
+        return record
+
+    def wal(self, address):
+        if self.walDir is None:
+            return None
+        name = sourceDirName(address)
+        wal = self.wals.get(name)
+        if wal is None:
+            wal = self.wals[name] = WriteAheadLog(os.path.join(self.walDir, name)).start()
+        return wal
+
+    def recover(self):
+        """
+        Turns what an earlier run left in every peripheral's write-ahead log
+        back into records, then queues the record files an earlier run failed
+        to upload. Call before run(). Returns the paths handed to the uploader.
+        """
+        handed_off = []
+        if self.walDir is not None and os.path.isdir(self.walDir):
+            for name in sorted(os.listdir(self.walDir)):
+                if os.path.isdir(os.path.join(self.walDir, name)):
+                    handed_off += LiveRecord.recover(self.wal(name), uploader=self.uploader,
+                                                     linkMonitor=self.linkMonitor)
+
+        outRecordsDir = Record().outRecordsDir
+        if self.uploader is not None and os.path.isdir(outRecordsDir):
+            for name in sorted(os.listdir(outRecordsDir)):
+                local_dir = os.path.join(outRecordsDir, name)
+                if os.path.isdir(local_dir):
+                    # Named by sourceDirName, which sourceRemoteDir leaves as it is
+                    self.uploader.submitDir(local_dir, sourceRemoteDir(name), skip=handed_off)
+        return handed_off
+
+    def sampler(self, address):
+        sampler = self.samplers.get(address)
+        if sampler is None:
+            sampler = AdaptiveSampler(address=address)
+            sampler.interval = self.cadence
+            sampler.configure(self.sampling)
+            self.samplers[address] = sampler
+        return sampler
+
+    async def run(self):
+        self._running = True
+        while self._running:
+            try:
+                peripherals = await self.radio.scan()
+            except Exception as e:
+                print(f"Scan failed: {e}")
+                peripherals = []
+
+            for peripheral in peripherals:
+                if peripheral.address in self.tasks:
+                    continue
+                if self.maxDevices is not None and len(self.tasks) >= self.maxDevices:
+                    break
+                self.tasks[peripheral.address] = asyncio.create_task(self._serve(peripheral))
+
+            await asyncio.sleep(self.scanInterval)
+
+    async def stop(self):
+        self._running = False
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _serve(self, peripheral):
+        address = peripheral.address
+        delay = RECONNECT_DELAY
+        attempts = 0
+
+        try:
+            while self._running and attempts < MAX_RECONNECT_ATTEMPTS:
+                try:
+                    link = await asyncio.wait_for(self.radio.connect(peripheral), self.readTimeout)
+                except Exception as e:
+                    attempts += 1
+                    metricz.inc("connect_failures_total", help="Failed connection attempts")
+                    print(f"{address}: connect failed ({e}), retrying in {delay:.1f} s")
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                    delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                    continue
+
+                print(f"{address}: connected")
+                self.links[address] = link
+                attempts = 0
+                delay = RECONNECT_DELAY
+
+                await self._readLoop(address, link)
+
+                self.links.pop(address, None)
+                self.reconnects[address] = self.reconnects.get(address, 0) + 1
+                metricz.inc("reconnects_total", help="Links that dropped and were reopened")
+                await self._closeRecord(address)
+                print(f"{address}: disconnected")
+        finally:
+            self.links.pop(address, None)
+            self.tasks.pop(address, None)
+
+    async def _readLoop(self, address, link):
+        sampler = self.sampler(address) if self.adaptive else None
+        while self._running and link.connected:
+            try:
+                with timer("ble_read"):
+                    message = await asyncio.wait_for(link.readSensors(), self.readTimeout)
+            except asyncio.TimeoutError:
+                metricz.inc("dropped_reads_total", help="Readings lost before processing", reason="timeout")
+                print(f"{address}: read timed out")
+                break
+            except Exception as e:
+                metricz.inc("dropped_reads_total", help="Readings lost before processing", reason="failed")
+                print(f"{address}: read failed ({e})")
+                break
+
+            if message is not None and sampler is not None:
+                # Stamped on arrival like processMessage does, None when coalesced
+                units = message["sensor_units"]
+                samples = sampler.offer(dict(message["sensor_data"], timestamp=time.time()), units)
+                message = (samples, units) if samples else None
+                if message is not None:
+                    self.liveRecord(address).processSamples(samples, units)
+            elif message is not None:
+                self.liveRecord(address).processMessage(message)
+
+            if message is not None:
+                record = self.liveRecord(address)
+                if self.onSample is not None:
+                    self.onSample(address, record)
+
+            if not link.pushes:
+                await asyncio.sleep(self.cadence if sampler is None else sampler.interval)
+
+        try:
+            await link.disconnect()
+        except Exception:
+            pass
+
+    async def _closeRecord(self, address):
+        record = self.records.get(address)
+        if record is None or not record.isLive:
+            return
+        if self.saveOnDisconnect:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, record.finish)
+        else:
+            record.isLive = False
@@ -0,0 +1,177 @@
+import os
+import re
+import gzip
+import json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Record files are named by their first timestamp, record.YYYYmmddHHMMSS.json,
+# and hold either the original indent=4 rows, {"sensor_data": [row, ...]}, or
+# columns, {"sensor_columns": {name: [value, ...]}}, which don't repeat every
+# key on every row. Either may be compressed, .json.gz or .json.zst. A bundle,
+# bundle.<first>.<last>.json.gz, carries several records in one upload as
+# {"records": [record, ...]}. Readers take any of them, whatever the name says.
+# numpy and pandas are only imported by the readers that hand back arrays or
+# DataFrames, writing a record needs neither.
+RECORD_PATTERN = re.compile(r"^record\.([0-9]{14})\.json(\.gz|\.zst)?$")
+BUNDLE_PATTERN = re.compile(r"^bundle\.([0-9]{14})\.([0-9]{14})\.json(\.gz|\.zst)?$")
+SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+GZIP_LEVEL = 6 # zlib's default, 9 is barely smaller and several times slower on the Pi
+ZSTD_LEVEL = 3
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+def recordSpan(name):
+    """
+    (first, last) YYYYmmddHHMMSS as ints a record or bundle file name covers,
+    None for anything else. A record's last is its first, it holds up to
+    RECORD_LOOKBACK after that.
+    """
+    match = RECORD_PATTERN.match(name)
+    if match:
+        return int(match.group(1)), int(match.group(1))
+    match = BUNDLE_PATTERN.match(name)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    return None
+
+def isRecordFile(name):
+    return recordSpan(name) is not None
+
+def recordFileName(dateStr, compression=None):
+    return f"record.{dateStr}.json{SUFFIXES[compression]}"
+
+def compress(data: bytes, compression=None):
+    if compression is None:
+        return data
+    if compression == "gzip":
+        # mtime=0 so the same record always compresses to the same bytes
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the zstandard package")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"Unknown compression {compression!r}")
+
+def decompress(data: bytes):
+    # Told apart by their magic numbers, plain JSON starts with "{"
+    if data[:2] == _GZIP_MAGIC:
+        return gzip.decompress(data)
+    if data[:4] == _ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError("Reading zstd records needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+def encodeColumns(columns, units, columnar=False, compression=None):
+    """
+    The bytes of a record file holding columns, {name: [value, ...]}.
+    Uncompressed rows come out exactly as they always have, anything else is
+    compact JSON.
+    """
+    if columnar:
+        payload = {"sensor_columns": columns, "sensor_units": units}
+    else:
+        rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+        payload = {"sensor_data": rows, "sensor_units": units}
+
+    if compression is None and not columnar:
+        text = json.dumps(payload, indent=4)
+    else:
+        text = json.dumps(payload, separators=(",", ":"))
+    return compress(text.encode("utf-8"), compression)
+
+def encodeRecord(dataFrame, units, columnar=False, compression=None):
+    """
+    encodeColumns() for a DataFrame.
+    """
+    columns = {column: dataFrame[column].tolist() for column in dataFrame.columns}
+    return encodeColumns(columns, units, columnar, compression)
+
+def payloadRows(payload):
+    if "sensor_columns" in payload:
+        columns = payload["sensor_columns"]
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+    return payload["sensor_data"]
+
+def payloadToDataFrame(payload):
+    import pandas as pd
+    if "sensor_columns" in payload:
+        return pd.DataFrame(payload["sensor_columns"])
+    return pd.DataFrame(payload["sensor_data"])
+
+def parsePayloads(data: bytes):
+    """
+    The record payloads in the bytes of a record or bundle file, as parsed JSON.
+    """
+    data = json.loads(decompress(data))
+    if "records" in data:
+        return data["records"]
+    return [data]
+
+def readPayloads(path):
+    with open(path, "rb") as f:
+        return parsePayloads(f.read())
+
+def readRows(path):
+    """
+    [(rows, units), ...] for every record in a record or bundle file, rows as
+    dicts the way the archive has always read them. Cheaper than a DataFrame
+    per file when there are thousands of small ones.
+    """
+    return [(payloadRows(payload), payload.get("sensor_units", {})) for payload in readPayloads(path)]
+
+def rowsInRange(rows, start, end):
+    # Rows without a timestamp are kept, file names only say when a record starts
+    return [row for row in rows if start <= row.get("timestamp", start) <= end]
+
+def payloadsToFrame(payloads, start, end):
+    """
+    (DataFrame, units) of record payloads put together, rows outside
+    start..end by timestamp left out, units from the first payload. What
+    ArchiveRecord's load workers return. Built from rows the way the serial
+    load builds its chunks, so column dtypes come out the same either way.
+    DataFrame is None when no row is in range.
+    """
+    rows = []
+    units = None
+    for payload in payloads:
+        if units is None:
+            units = payload.get("sensor_units", {})
+        rows.extend(rowsInRange(payloadRows(payload), start, end))
+    if not rows:
+        return None, units or {}
+    import pandas as pd
+    return pd.DataFrame(rows), units or {}
+
+def readRecords(path):
+    """
+    [(DataFrame, units), ...] for every record in a record or bundle file.
+    """
+    return [(payloadToDataFrame(payload), payload.get("sensor_units", {})) for payload in readPayloads(path)]
+
+def bundleFileName(names, compression="gzip"):
+    spans = [recordSpan(name) for name in names]
+    first = min(span[0] for span in spans)
+    last = max(span[1] for span in spans)
+    return f"bundle.{first}.{last}.json{SUFFIXES[compression]}"
+
+def writeBundle(paths, bundlePath, compression="gzip"):
+    """
+    Packs record files into one bundle at bundlePath, compressed as a whole so
+    the units and keys they share are only paid for once. Returns the bundle's
+    name for the remote side.
+    """
+    records = []
+    for path in paths:
+        for payload in readPayloads(path):
+            payload["name"] = os.path.basename(path)
+            records.append(payload)
+    data = json.dumps({"records": records}, separators=(",", ":")).encode("utf-8")
+    with open(bundlePath, "wb") as f:
+        f.write(compress(data, compression))
+    return bundleFileName([os.path.basename(path) for path in paths], compression)
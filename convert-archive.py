@@ -0,0 +1,33 @@
+# Convert a directory of record (or bundle) files into per-day columnar segments.
+#
+# usage: python convert-archive.py <record_dir> <segment_dir>
+
+import sys
+import os
+import time
+from segmentz import SegmentStore
+from codecz import isRecordFile
+
+BATCH = 1000 # [records] read before the touched days are rewritten
+
+if len(sys.argv) != 3:
+    print("usage: python convert-archive.py <record_dir> <segment_dir>")
+    sys.exit(1)
+
+record_dir, segment_dir = sys.argv[1], sys.argv[2]
+store = SegmentStore(segment_dir)
+
+names = sorted(f for f in os.listdir(record_dir)
+               if isRecordFile(f) and f not in store.ingested)
+
+start = time.perf_counter()
+converted = 0
+for i in range(0, len(names), BATCH):
+    batch = [os.path.join(record_dir, name) for name in names[i:i + BATCH]]
+    done = store.appendRecordFiles(batch)
+    store.markIngested(done)
+    converted += len(done)
+    print(f"{min(i + BATCH, len(names))}/{len(names)} records")
+
+print(f"Converted {converted} records into {len(store.days())} day segments "
+      f"in {time.perf_counter() - start:.1f} s")
@@ -1,15 +1,105 @@
-import digitalio
-import busio
-import board
+import threading
+import time
 from adafruit_epd.epd import Adafruit_EPD
 from adafruit_epd.ssd1680 import Adafruit_SSD1680
 from PIL import Image, ImageDraw, ImageFont
+import metricz
+from metricz import timed
 
 WHITE = (0xFF, 0xFF, 0xFF)
 BLACK = (0x00, 0x00, 0x00)
 
+MIN_REFRESH_INTERVAL = 30 # [s] between panel refreshes, e-paper wears with every one
+FULL_REFRESH_EVERY = 10 # [refreshes] partial ones in a row before a full one clears the ghosting
+
+# SSD1680 commands and the partial update sequence, not exposed by adafruit_epd
+_SSD1680_MASTER_ACTIVATE = 0x20
+_SSD1680_DISP_CTRL2 = 0x22
+_SSD1680_UPDATE_PARTIAL = 0xFC
+
+class PartialSSD1680(Adafruit_SSD1680):
+    """
+    SSD1680 that can also refresh with the panel's partial waveform, which only
+    drives the pixels that differ from the previous frame: a fraction of a
+    second and no black/white flashing, instead of a multi second full refresh.
+    The whole frame is still sent over SPI every time, there is no partial
+    window, but that takes milliseconds next to the waveform.
+    The previous frame goes into the second RAM, so this is for black and
+    white panels only (it's the red plane on tri-color ones).
+    """
+
+    partial = False
+
+    def displayPartial(self, previous):
+        self._buffer2[:] = previous
+        self.partial = True
+        try:
+            self.display()
+        finally:
+            self.partial = False
+
+    def update(self):
+        if not self.partial:
+            return super().update()
+        self.command(_SSD1680_DISP_CTRL2, bytearray([_SSD1680_UPDATE_PARTIAL]))
+        self.command(_SSD1680_MASTER_ACTIVATE)
+        self.busy_wait()
+
 class Displayz:
-    def __init__(self):
+    """
+    Text on the e-paper panel, drawn by a background thread so callers never
+    wait on a refresh. Only the latest text is kept: anything that arrives while
+    the panel is busy or resting replaces what was waiting. Text that renders to
+    the same bitmap as what's already shown doesn't touch the panel at all, and
+    the panel is refreshed at most once every minInterval seconds.
+    """
+
+    def __init__(self, display=None, partialRefresh=False, minInterval=MIN_REFRESH_INTERVAL,
+                 fullRefreshEvery=FULL_REFRESH_EVERY):
+
+        if display is None:
+            display = self._openPanel(partialRefresh)
+        self.display = display
+        self.display.fill(Adafruit_EPD.WHITE)
+
+        self.display.rotation = 1
+
+        self.fontsize = 14
+        self.font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", self.fontsize)
+
+        # Partial refresh needs a panel that supports it, see PartialSSD1680
+        self.partialRefresh = partialRefresh and hasattr(display, "displayPartial")
+        self.minInterval = minInterval
+        self.fullRefreshEvery = fullRefreshEvery
+
+        # One 1-bit canvas reused for every frame, plus the frame on the panel
+        self.image = Image.new("1", (self.display.width, self.display.height), 1)
+        self.draw = ImageDraw.Draw(self.image)
+        self.shown = None
+        self.shownBuffer = None
+        self.refreshedAt = None
+        self.partialsInRow = 0
+
+        self.submitted = 0      # texts handed to dispRawText
+        self.superseded = 0     # replaced by a newer text before they were drawn
+        self.unchanged = 0      # drawn, but identical to what was on the panel
+        self.refreshes = 0      # full panel refreshes
+        self.partials = 0       # partial panel refreshes
+        self.lastError = None
+
+        self._pending = None
+        self._busy = False
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._work, name="displayz", daemon=True)
+        self._thread.start()
+
+        metricz.watch("display_pending", lambda: self._pending is not None, "1 while text waits for the panel")
+
+    def _openPanel(self, partialRefresh):
+        import digitalio
+        import busio
+        import board
 
         spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
         ecs = digitalio.DigitalInOut(board.CE0)
@@ -17,26 +107,123 @@ class Displayz:
         rst = digitalio.DigitalInOut(board.D27)
         busy = digitalio.DigitalInOut(board.D17)
         srcs = None
-        self.display = Adafruit_SSD1680(122, 250, spi, cs_pin=ecs, dc_pin=dc, sramcs_pin=srcs,
-                          rst_pin=rst, busy_pin=busy)
-        self.display.fill(Adafruit_EPD.WHITE)
+        panel = PartialSSD1680 if partialRefresh else Adafruit_SSD1680
+        return panel(122, 250, spi, cs_pin=ecs, dc_pin=dc, sramcs_pin=srcs,
+                     rst_pin=rst, busy_pin=busy)
 
-        self.display.rotation = 1
+    @timed("display_submit")
+    def dispRawText(self, text):
+        """
+        Queues text for the panel and returns straight away.
+        """
+        with self._cond:
+            self.submitted += 1
+            if self._pending is not None:
+                self.superseded += 1
+                metricz.inc("display_superseded_total", help="Texts replaced before they were drawn")
+            self._pending = text
+            self._cond.notify_all()
 
-        self.fontsize = 14
-        self.font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", self.fontsize) 
+    def flush(self, timeout=None):
+        """
+        Blocks until the latest text has been drawn, returns False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending is None and not self._busy, timeout)
 
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
 
-    def dispRawText(self, text):
-        image = Image.new("RGB", (self.display.width, self.display.height), "white")
-        draw = ImageDraw.Draw(image)
-
-        draw.multiline_text(
+    def render(self, text):
+        """
+        Draws text onto the reused canvas, returns the bitmap's bytes.
+        """
+        self.draw.rectangle((0, 0, self.image.width, self.image.height), fill=1)
+        self.draw.multiline_text(
             (0, 5),
             text,
             font=self.font,
-            fill=BLACK,
+            fill=0,
         )
-        self.display.image(image)
-        self.display.display()
+        return self.image.tobytes()
+
+    def _blit(self):
+        """
+        Copies the canvas into the panel's frame buffer. adafruit_epd's image()
+        goes pixel by pixel in Python, but with the panel on its side a 1-bit
+        image rotated back upright is already the buffer's layout.
+        """
+        buffer = getattr(self.display, "_buffer1", None)
+        if self.display.rotation != 1 or getattr(self.display, "sram", None) or buffer is None:
+            self.display.image(self.image.convert("L"))
+            return
+
+        upright = self.image.transpose(Image.ROTATE_270)
+        stride = -(-upright.width // 8) * 8
+        padded = Image.new("1", (stride, upright.height), 1)
+        padded.paste(upright, (0, 0))
+        buffer[:] = padded.tobytes()
+
+    @timed("display_refresh")
+    def refresh(self, frame):
+        partial = (self.partialRefresh and self.shown is not None
+                   and self.partialsInRow < self.fullRefreshEvery)
+        previous = bytes(self.shownBuffer) if partial else None
+
+        self._blit()
+        if partial:
+            self.display.displayPartial(previous)
+            self.partials += 1
+            self.partialsInRow += 1
+        else:
+            self.display.display()
+            self.refreshes += 1
+            self.partialsInRow = 0
+
+        self.shown = frame
+        if self.partialRefresh:
+            self.shownBuffer = bytes(self.display._buffer1)
+        self.refreshedAt = time.monotonic()
+
+    def _nextText(self):
+        """
+        Waits for text and for the panel to have rested, then takes the latest.
+        Returns None when stopping.
+        """
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None
+                if self._pending is not None:
+                    rest = 0 if self.refreshedAt is None else (
+                        self.refreshedAt + self.minInterval - time.monotonic())
+                    if rest <= 0:
+                        text, self._pending = self._pending, None
+                        self._busy = True
+                        return text
+                    self._cond.wait(rest)
+                else:
+                    self._cond.wait()
 
+    def _work(self):
+        while True:
+            text = self._nextText()
+            if text is None:
+                return
+            try:
+                frame = self.render(text)
+                if frame == self.shown:
+                    self.unchanged += 1
+                    metricz.inc("display_unchanged_total", help="Texts that drew what was already shown")
+                else:
+                    self.refresh(frame)
+            except Exception as e:
+                self.lastError = str(e)
+                print(f"Display refresh failed: {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
@@ -0,0 +1,583 @@
+import asyncio
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import threading
+import time
+import types
+import paramiko
+from centralz import Radio, Link
+from ble_json_service import SensorService, SampleHistory, HISTORY_CAPACITY, packSamples, packedCapacity
+
+
+GATT_READ_LATENCY = 0.005 # [s] a GATT read round trip, roughly
+
+SENSOR_UNITS = {
+    "soil1_temp": "F",
+    "soil2_temp": "F",
+    "moist": "%",
+    "uva": "%",
+}
+
+def fakeUnits(count=len(SENSOR_UNITS)):
+    """
+    The usual four sensors, padded out with extra ones for bigger payloads.
+    """
+    units = dict(list(SENSOR_UNITS.items())[:count])
+    for i in range(len(units), count):
+        units[f"extra{i}"] = "%"
+    return units
+
+def fakeReading(units=SENSOR_UNITS):
+    return {
+        "sensor_data": {
+            sensor: round(random.uniform(40, 90) if unit == "F" else random.uniform(0, 100), 2)
+            for sensor, unit in units.items()
+        },
+        "sensor_units": dict(units),
+    }
+
+class FakePeripheral:
+    """
+    Stand-in for a SensorService peripheral. Latency is how long a read takes,
+    dropRate is the chance the link drops on any read and failRate the chance a
+    connect attempt fails.
+    """
+
+    def __init__(self, address, latency=0.0, dropRate=0.0, failRate=0.0):
+        self.address = address
+        self.latency = latency
+        self.dropRate = dropRate
+        self.failRate = failRate
+        self.reads = 0
+        self.connects = 0
+
+    def reading(self):
+        self.reads += 1
+        return fakeReading()
+
+class FakeLink(Link):
+    def __init__(self, peripheral):
+        self.peripheral = peripheral
+        self.address = peripheral.address
+        self._connected = True
+
+    @property
+    def connected(self):
+        return self._connected
+
+    async def readSensors(self):
+        if self.peripheral.latency:
+            await asyncio.sleep(self.peripheral.latency)
+        if random.random() < self.peripheral.dropRate:
+            self._connected = False
+            raise ConnectionError("link dropped")
+        return self.peripheral.reading()
+
+    async def disconnect(self):
+        self._connected = False
+
+class FakeRadio(Radio):
+    """
+    In-process fleet of FakePeripherals, all of them always in range.
+    """
+
+    def __init__(self, peripherals, connectLatency=0.0):
+        self.peripherals = list(peripherals)
+        self.connectLatency = connectLatency
+
+    @classmethod
+    def fleet(cls, count, slow=0, flapping=0, latency=0.5, dropRate=0.2):
+        peripherals = []
+        for i in range(count):
+            address = "FA:KE:00:00:%02X:%02X" % (i // 256, i % 256)
+            if i < slow:
+                peripherals.append(FakePeripheral(address, latency=latency))
+            elif i < slow + flapping:
+                peripherals.append(FakePeripheral(address, dropRate=dropRate, failRate=dropRate))
+            else:
+                peripherals.append(FakePeripheral(address))
+        return cls(peripherals)
+
+    async def scan(self, timeout=0):
+        return list(self.peripherals)
+
+    async def connect(self, peripheral):
+        if self.connectLatency:
+            await asyncio.sleep(self.connectLatency)
+        peripheral.connects += 1
+        if random.random() < peripheral.failRate:
+            raise ConnectionError("connect failed")
+        return FakeLink(peripheral)
+
+
+class FakeCharacteristic:
+    """
+    Just enough of a remote _bleio.Characteristic for SensorSubscription.
+    """
+
+    def __init__(self):
+        self.callbacks = set()
+        self.notifying = False
+
+    def _add_notify_callback(self, callback):
+        self.callbacks.add(callback)
+
+    def _remove_notify_callback(self, callback):
+        self.callbacks.discard(callback)
+
+    def set_cccd(self, *, notify=False, indicate=False):
+        self.notifying = notify
+
+    def notify(self, data):
+        if self.notifying:
+            for callback in list(self.callbacks):
+                callback(data)
+
+class FakeSensorService:
+    """
+    Stand-in for a connected SensorService. A background thread publishes a new
+    reading every `period` seconds through the real SensorService.publish(), so
+    readings too long for one notification are pushed as markers, as they are
+    by the peripheral. Reading `sensors` costs `readLatency` seconds, like a
+    GATT read.
+    """
+
+    def __init__(self, period=0.1, readLatency=GATT_READ_LATENCY, units=SENSOR_UNITS):
+        self.period = period
+        self.readLatency = readLatency
+        self.units = units
+        self.connected = True
+        self.published = 0
+        self._sensors = None
+        self._notified = None
+        self.bleio_characteristics = {"sensorsNotify": FakeCharacteristic()}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def sensors(self):
+        if self.readLatency:
+            time.sleep(self.readLatency)
+        return self._sensors
+
+    @sensors.setter
+    def sensors(self, reading):
+        self._sensors = reading
+
+    @property
+    def sensorsNotify(self):
+        return self._notified
+
+    @sensorsNotify.setter
+    def sensorsNotify(self, value):
+        # JSONCharacteristic's encoding, pushed to subscribers
+        self._notified = value
+        self.bleio_characteristics["sensorsNotify"].notify(json.dumps(value).encode("utf-8"))
+
+    def publish(self, reading):
+        SensorService.publish(self, reading, self.published)
+        self.published += 1
+
+    def _run(self):
+        while self.connected:
+            time.sleep(self.period)
+            reading = fakeReading(self.units)
+            reading["sent_at"] = time.perf_counter()
+            self.publish(reading)
+
+    def disconnect(self):
+        self.connected = False
+
+class FakeHistoryService:
+    """
+    Stand-in for a connected SensorService in packed mode that keeps a
+    SampleHistory like the peripheral does. A background thread takes a sample
+    every `period` seconds, publishes the latest ones to sensorsPacked and
+    answers sensorsHistory requests with the real serveHistory(). Every sample
+    is also kept in `log`, oldest first, to check against what a central got.
+    """
+
+    def __init__(self, period=0.1, units=SENSOR_UNITS, capacity=HISTORY_CAPACITY, boot=None):
+        self.period = period
+        self.sensorsSchema = {
+            "version": 1,
+            "fields": [[name, "f"] for name in units],
+            "units": dict(units),
+            "boot": boot if boot is not None else random.randrange(1 << 16),
+        }
+        self.history = SampleHistory(capacity)
+        self.sensorsPacked = b""
+        self.sensorsHistory = None
+        self.log = []
+        self.connected = True
+        self._recent = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def sample(self):
+        now = time.monotonic()
+        values = fakeReading(self.sensorsSchema["units"])["sensor_data"]
+        sequence = self.history.append(now, values)
+        self.log.append((sequence, time.time(), values))
+
+        self._recent = (self._recent + [(now, values)])[-packedCapacity(self.sensorsSchema):]
+        first = (sequence - len(self._recent) + 1) & 0xFFFF
+        self.sensorsPacked = packSamples(self.sensorsSchema, self._recent, first, now)
+
+    def _run(self):
+        while self.connected:
+            time.sleep(self.period)
+            self.sample()
+            SensorService.serveHistory(self, self.history, time.monotonic())
+
+    def disconnect(self):
+        self.connected = False
+
+
+class FakeBleConnection:
+    def __init__(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+class FakeBleRadio:
+    """
+    Blocking stand-in for adafruit_ble.BLERadio with one SensorService
+    peripheral, on a simulated clock so long outages cost no real time (pass
+    its sleep and clock to ConnectionManager). While in range the peripheral
+    advertises every advInterval seconds. A scan takes scanStart to get going,
+    and a connect, directed or from an advertisement, waits for the next
+    advertisement and then connectLatency. dropOut(seconds) takes the
+    peripheral out of range and drops the link.
+    """
+
+    def __init__(self, address="FA:KE:00:00:00:01", advInterval=1.0, scanStart=1.0, connectLatency=0.3):
+        self.address = address
+        self.advInterval = advInterval
+        self.scanStart = scanStart
+        self.connectLatency = connectLatency
+        self.now = 0.0
+        self.outUntil = 0.0
+        self.scanning = 0.0     # [s] of simulated time spent scanning
+        self.connection = None
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def clock(self):
+        return self.now
+
+    def dropOut(self, seconds):
+        self.outUntil = self.now + seconds
+        if self.connection is not None:
+            self.connection.disconnect()
+
+    def _nextAdvertisement(self):
+        return max(self.now, self.outUntil) + random.uniform(0, self.advInterval)
+
+    def start_scan(self, *advertisementTypes, timeout=None, **kwargs):
+        started = self.now
+        self.now += self.scanStart
+        end = started + timeout if timeout is not None else float("inf")
+        try:
+            while True:
+                seen = self._nextAdvertisement()
+                if seen >= end:
+                    self.now = end
+                    return
+                self.now = seen
+                yield types.SimpleNamespace(address=self.address, services=[SensorService])
+        finally:
+            self.scanning += self.now - started
+
+    def stop_scan(self):
+        pass
+
+    def connect(self, peer, *, timeout=10.0):
+        address = getattr(peer, "address", peer)
+        seen = self._nextAdvertisement() if address == self.address else float("inf")
+        if seen - self.now > timeout:
+            self.now += timeout
+            raise ConnectionError("timed out")
+        self.now = seen + self.connectLatency
+        self.connection = FakeBleConnection()
+        return self.connection
+
+
+class FakePanel:
+    """
+    In-memory stand-in for the SSD1680 e-paper panel, for Displayz(display=...).
+    A refresh just sleeps for refreshLatency seconds.
+    """
+
+    def __init__(self, width=122, height=250, refreshLatency=0.0):
+        self._width = width
+        self._height = height
+        self.refreshLatency = refreshLatency
+        self.rotation = 0
+        self.sram = None
+        stride = -(-width // 8) * 8
+        self._buffer1 = bytearray(stride * height // 8)
+        self.refreshes = 0
+
+    @property
+    def width(self):
+        return self._height if self.rotation in (1, 3) else self._width
+
+    @property
+    def height(self):
+        return self._width if self.rotation in (1, 3) else self._height
+
+    def fill(self, color):
+        self._buffer1[:] = b"\xff" * len(self._buffer1)
+
+    def image(self, image):
+        pass
+
+    def display(self):
+        if self.refreshLatency:
+            time.sleep(self.refreshLatency)
+        self.refreshes += 1
+
+class SlowLink:
+    """
+    Puts a Wi-Fi sized bottleneck in front of the stand-in server: bytes written
+    share `kbps` between every session, and each open, stat, rename or mkdir
+    costs a `latency` round trip.
+    """
+
+    def __init__(self, kbps, latency=0.0):
+        self.kbps = kbps
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    def roundTrip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def transfer(self, size):
+        with self._lock:
+            time.sleep(size * 8 / (self.kbps * 1000))
+
+class _StandInServer(paramiko.ServerInterface):
+    # Anyone may log in, it only ever listens on localhost
+
+    def __init__(self, root, link=None):
+        self.root = root
+        self.link = link
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        # Only tar, for ArchiveFetcher's single stream mode
+        args = shlex.split(command.decode())
+        if not args or args[0] != "tar":
+            return False
+        for i, arg in enumerate(args[:-1]):
+            if arg == "-C":
+                args[i + 1] = os.path.join(self.root, args[i + 1].lstrip("/"))
+        threading.Thread(target=self._exec, args=(channel, args), daemon=True).start()
+        return True
+
+    def _exec(self, channel, args):
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+
+        def feed():
+            while True:
+                data = channel.recv(1 << 16)
+                if not data:
+                    break
+                proc.stdin.write(data)
+            proc.stdin.close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        for chunk in iter(lambda: proc.stdout.read(1 << 16), b""):
+            channel.sendall(chunk)
+        proc.wait()
+        feeder.join()
+        channel.send_exit_status(proc.returncode)
+        channel.close()
+
+class _StandInHandle(paramiko.SFTPHandle):
+    link = None
+
+    def write(self, offset, data):
+        if self.link is not None:
+            self.link.transfer(len(data))
+        return super().write(offset, data)
+
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+class _StandInSftp(paramiko.SFTPServerInterface):
+    """
+    Serves the stand-in server's root directory as if it were "/".
+    """
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = server.root
+        self.link = server.link
+
+    def _roundTrip(self):
+        if self.link is not None:
+            self.link.roundTrip()
+
+    def _local(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def _attempt(self, func, *args):
+        try:
+            func(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def list_folder(self, path):
+        local = self._local(path)
+        try:
+            entries = []
+            for name in os.listdir(local):
+                attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local, name)))
+                attr.filename = name
+                entries.append(attr)
+            return entries
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        self._roundTrip()
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        self._roundTrip()
+        local = self._local(path)
+        try:
+            fd = os.open(local, flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+
+        handle = _StandInHandle(flags)
+        handle.link = self.link
+        handle.filename = local
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        return self._attempt(os.remove, self._local(path))
+
+    def rename(self, oldpath, newpath):
+        if os.path.exists(self._local(newpath)):
+            return paramiko.SFTP_FAILURE
+        return self._attempt(os.rename, self._local(oldpath), self._local(newpath))
+
+    def posix_rename(self, oldpath, newpath):
+        self._roundTrip()
+        return self._attempt(os.replace, self._local(oldpath), self._local(newpath))
+
+    def mkdir(self, path, attr):
+        self._roundTrip()
+        return self._attempt(os.mkdir, self._local(path))
+
+    def rmdir(self, path):
+        return self._attempt(os.rmdir, self._local(path))
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+class LocalSftpServer:
+    """
+    Stand-in for RangerLab: an SSH server on localhost that only speaks SFTP and
+    serves `root`. Remote paths like REMOTE_DIR land under root. Accepts any
+    login, so SftpPool(host="127.0.0.1", port=server.port, password="x",
+    look_for_keys=False, allow_agent=False) can talk to it. With a SlowLink,
+    uploads go at its speed instead of loopback's.
+    """
+
+    def __init__(self, root, port=0, link=None):
+        self.root = root
+        self.link = link
+        self.hostKey = paramiko.RSAKey.generate(2048)
+        self.transports = []
+        self.logins = 0
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", port))
+        self.sock.listen(64)
+        self.port = self.sock.getsockname()[1]
+
+        self._running = True
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def connectKwargs(self):
+        return {"port": self.port, "password": "stand-in", "look_for_keys": False, "allow_agent": False}
+
+    def _accept(self):
+        while self._running:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client):
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.hostKey)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _StandInSftp)
+        self.transports.append(transport)
+        try:
+            self.serverInterface(transport)
+        except (paramiko.SSHException, EOFError):
+            # Port probes connect and hang up without logging in
+            transport.close()
+            return
+        self.logins += 1
+
+    def serverInterface(self, transport):
+        transport.start_server(server=_StandInServer(self.root, self.link))
+
+    def close(self):
+        self._running = False
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
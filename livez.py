@@ -0,0 +1,276 @@
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import socket
+import struct
+import threading
+import metricz
+
+
+# Live readings for anything on the network that wants them, without SSH or
+# polling record files: every sample a LiveRecord takes in is pushed as one
+# WebSocket text frame, {"sensor_data": {...}, "sensor_units": {...}, "source": ...},
+# to every client of ws://host:port/live. A client's first frame is
+# {"snapshot": [message, ...]}, the most recent samples, oldest first. The same
+# snapshot is plain JSON at http://host:port/ for curl. Only the bits of
+# RFC 6455 a server sending text needs are here, no extra package on the Pi.
+LIVE_PORT = 8765 # [port]
+LIVE_HOST = "127.0.0.1" # "0.0.0.0" to serve the rest of the LAN too
+LIVE_PATH = "/live"
+CLIENT_QUEUE = 64 # [messages] waiting for a slow client, oldest dropped first
+WRITE_BUFFER = 16384 # [bytes] waiting in a client's transport before it counts as slow
+SEND_BUFFER = 65536 # [bytes] kernel send buffer per client, left alone it grows to megabytes
+SNAPSHOT_SIZE = 120 # [samples] a new client starts with
+MAX_CLIENTS = 512
+MAX_FRAME = 4096 # [bytes] largest frame taken from a client, they only send pings and closes
+REQUEST_TIMEOUT = 5 # [s] for a client to send its request headers
+CLOSE_TIMEOUT = 2 # [s] for stop() to close every connection
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_OP_TEXT = 0x1
+_OP_CLOSE = 0x8
+_OP_PING = 0x9
+_OP_PONG = 0xA
+
+def _frame(opcode, payload: bytes):
+    # Server frames are unmasked and never fragmented
+    length = len(payload)
+    if length < 126:
+        head = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        head = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return head + payload
+
+def acceptKey(key):
+    return base64.b64encode(hashlib.sha1((key + _WS_GUID).encode("ascii")).digest()).decode("ascii")
+
+class _Client:
+    """
+    One subscriber: the frames it hasn't been sent yet, at most queueSize of
+    them, and the event its sender waits on.
+    """
+
+    def __init__(self, writer, queueSize):
+        self.writer = writer
+        self.frames = collections.deque(maxlen=queueSize)
+        self.ready = asyncio.Event()
+        self.dropped = 0
+
+    def send(self, frame):
+        if len(self.frames) == self.frames.maxlen:
+            # Latest readings matter most, the deque makes room by dropping the oldest
+            self.dropped += 1
+            metricz.inc("live_dropped_total", help="Live messages dropped for slow clients")
+        self.frames.append(frame)
+        self.ready.set()
+
+class LiveServer:
+    """
+    Fans samples out to WebSocket clients from its own event loop on a
+    background thread. publish() is all the ingestion side ever calls, it
+    hands the sample to that loop and returns, so neither encoding, nor many
+    clients, nor a stalled one can hold up BLE reads. Every client has a
+    bounded queue of its own and a slow one only loses its own oldest messages.
+    """
+
+    def __init__(self, port=LIVE_PORT, host=LIVE_HOST, queueSize=CLIENT_QUEUE,
+                 snapshotSize=SNAPSHOT_SIZE, maxClients=MAX_CLIENTS):
+        self.port = port
+        self.host = host
+        self.queueSize = queueSize
+        self.maxClients = maxClients
+        self.recent = collections.deque(maxlen=snapshotSize)    # JSON of the latest messages
+        self.clients = set()
+        self.published = 0
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+        metricz.watch("live_clients", lambda: len(self.clients), "Clients subscribed to live readings")
+
+    def start(self):
+        """
+        Starts listening, port 0 picks a free one and sets self.port. Returns
+        self, only listening if the port could be bound.
+        """
+        if self._thread is None:
+            listening = threading.Event()
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run, args=(listening,), name="live-server", daemon=True)
+            self._thread.start()
+            listening.wait()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        loop, self._loop = self._loop, None
+        if self._server is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._close(), loop).result(CLOSE_TIMEOUT)
+            except Exception as e:
+                print(f"Live server did not close cleanly: {e}")
+            loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, listening):
+        loop = self._loop
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(asyncio.start_server(self._serve, self.host, self.port))
+        except OSError as e:
+            print(f"Live readings unavailable, could not listen on {self.host}:{self.port}: {e}")
+            listening.set()
+            loop.close()
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        listening.set()
+        try:
+            loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    async def _close(self):
+        self._server.close()
+        for client in list(self.clients):
+            client.writer.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    def publish(self, sample: dict, units: dict, source=None):
+        """
+        Queues a sample for every client. Safe from any thread and never
+        blocks, a sample published while the server is down is just dropped.
+        """
+        loop = self._loop
+        if loop is None or self._server is None:
+            return
+        message = {"sensor_data": dict(sample), "sensor_units": units}
+        if source is not None:
+            message["source"] = source
+        try:
+            loop.call_soon_threadsafe(self._fanOut, message)
+        except RuntimeError:
+            # Stopped in the meantime
+            pass
+
+    def _fanOut(self, message):
+        # On the server's loop. Encoded once, whatever the number of clients.
+        text = json.dumps(message, separators=(",", ":"))
+        self.recent.append(text)
+        self.published += 1
+        metricz.inc("live_messages_total", help="Samples published to live clients")
+        frame = _frame(_OP_TEXT, text.encode("utf-8"))
+        for client in self.clients:
+            client.send(frame)
+
+    def snapshotJson(self):
+        return '{"snapshot":[' + ",".join(self.recent) + "]}"
+
+    async def _serve(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        lines = request.decode("latin-1").split("\r\n")
+        parts = lines[0].split()
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        path = parts[1].split("?")[0] if len(parts) > 1 else ""
+
+        if parts[:1] != ["GET"]:
+            await self._respond(writer, "405 Method Not Allowed")
+        elif path == LIVE_PATH and headers.get("upgrade", "").lower() == "websocket":
+            if "sec-websocket-key" not in headers:
+                await self._respond(writer, "400 Bad Request")
+            elif len(self.clients) >= self.maxClients:
+                metricz.inc("live_rejected_total", help="Live clients turned away at MAX_CLIENTS")
+                await self._respond(writer, "503 Service Unavailable")
+            else:
+                await self._subscribe(reader, writer, headers["sec-websocket-key"])
+        elif path == "/":
+            await self._respond(writer, "200 OK", self.snapshotJson().encode("utf-8"), "application/json")
+        else:
+            await self._respond(writer, "404 Not Found")
+
+    async def _respond(self, writer, status, body=b"", contentType="text/plain"):
+        try:
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {contentType}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _subscribe(self, reader, writer, key):
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {acceptKey(key)}\r\n\r\n").encode("ascii"))
+        # A stalled client holds at most these plus its queue, not whatever the socket would take
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER)
+        writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        client = _Client(writer, self.queueSize)
+        # Snapshot and subscription in the same step of the loop, so nothing
+        # published in between is missed or sent twice
+        client.send(_frame(_OP_TEXT, self.snapshotJson().encode("utf-8")))
+        self.clients.add(client)
+        sender = asyncio.create_task(self._send(client))
+        try:
+            await self._receive(reader, client)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(client)
+            sender.cancel()
+            try:
+                if not writer.is_closing():
+                    writer.write(_frame(_OP_CLOSE, struct.pack("!H", 1000)))
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def _send(self, client):
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+                while client.frames:
+                    client.writer.write(client.frames.popleft())
+                    # Waits while the socket's buffer is full, frames pile up
+                    # in the client's queue meanwhile and the oldest drop out
+                    await client.writer.drain()
+        except ConnectionError:
+            client.writer.close()
+
+    async def _receive(self, reader, client):
+        # Client frames are masked. Text a client sends is ignored.
+        while True:
+            head = await reader.readexactly(2)
+            opcode = head[0] & 0x0F
+            length = head[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await reader.readexactly(8))[0]
+            if length > MAX_FRAME:
+                return
+            mask = await reader.readexactly(4) if head[1] & 0x80 else None
+            payload = await reader.readexactly(length)
+            if mask is not None:
+                payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+            if opcode == _OP_CLOSE:
+                return
+            if opcode == _OP_PING:
+                client.send(_frame(_OP_PONG, payload))
@@ -0,0 +1,268 @@
+import os
+import re
+import stat
+import zlib
+import posixpath
+import threading
+from codecz import BUNDLE_PATTERN, recordSpan, parsePayloads
+
+
+# Each record directory can keep an index of its record and bundle files in
+# manifest/, one shard per month, YYYYmm.idx. A shard is fixed width lines,
+# "first last name size mtime crc32", sorted by first, so finding a range is a
+# binary search with one seek per probe however many files the directory
+# holds. A record file gets one entry, first being the timestamp in its name,
+# a bundle one per record it carries, each with the bundle's own last. The
+# uploader adds them once a file has landed, usually as an append. A directory
+# with a manifest/ is trusted to be fully indexed by it, one without is listed
+# instead. build-manifest.py makes one from a directory scan.
+MANIFEST_DIR = "manifest"
+SHARD_PATTERN = re.compile(r"^([0-9]{6})\.idx$")
+NAME_WIDTH = 48 # [chars] the longest name, bundle.<first>.<last>.json.zst, is 45
+PARTIAL_SUFFIX = ".part"
+CHECKSUM_CHUNK = 1 << 16 # [bytes]
+
+def formatEntry(entry):
+    first, last, name, size, mtime, checksum = entry
+    return f"{first:014d} {last:014d} {name:<{NAME_WIDTH}} {size:12d} {mtime:11d} {checksum:08x}\n".encode()
+
+def parseEntry(line):
+    first, last, name, size, mtime, checksum = line.split()
+    return int(first), int(last), name.decode(), int(size), int(mtime), int(checksum, 16)
+
+LINE_BYTES = len(formatEntry((0, 0, "", 0, 0, 0)))
+
+def checksum(f):
+    crc = 0
+    for chunk in iter(lambda: f.read(CHECKSUM_CHUNK), b""):
+        crc = zlib.crc32(chunk, crc)
+    return crc
+
+def makeEntries(name, size, mtime, crc, records=None):
+    """
+    [(first, last, name, size, mtime, crc32), ...] for a record file, or for a
+    bundle of the record files named in records. Empty for anything else.
+    """
+    span = recordSpan(name)
+    if span is None:
+        return []
+    firsts = [recordSpan(record)[0] for record in records] if records else [span[0]]
+    return sorted((first, span[1], name, int(size), int(mtime), crc) for first in set(firsts))
+
+def bundledRecords(data: bytes):
+    # Names of the records packed into a bundle, see codecz.writeBundle
+    return [payload["name"] for payload in parsePayloads(data) if "name" in payload]
+
+def months(first, last):
+    """
+    YYYYmm of every month from first's to last's, both YYYYmmddHHMMSS.
+    """
+    month, end = first // 10**8, last // 10**8
+    while month <= end:
+        yield month
+        month = month + 1 if month % 100 < 12 else (month // 100 + 1) * 100 + 1
+
+class LocalFs:
+    """
+    The few SFTPClient calls a Manifest makes, on the local filesystem, for
+    building one on RangerLab itself.
+    """
+
+    def open(self, path, mode="rb"):
+        return open(path, mode)
+
+    def stat(self, path):
+        import paramiko
+        return paramiko.SFTPAttributes.from_stat(os.stat(path))
+
+    def listdir_attr(self, path):
+        import paramiko
+        attrs = []
+        for name in os.listdir(path):
+            attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name)
+            attrs.append(attr)
+        return attrs
+
+    def mkdir(self, path):
+        os.mkdir(path)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def posix_rename(self, oldpath, newpath):
+        os.replace(oldpath, newpath)
+
+class Manifest:
+    """
+    The manifest of one record directory, read and written through an
+    SFTPClient or a LocalFs. Entries are (first, last, name, size, mtime, crc32)
+    with first and last as YYYYmmddHHMMSS ints, the way recordSpan gives them.
+    One process writes a directory's manifest, add() is safe across its threads.
+    """
+
+    def __init__(self, recordDir):
+        self.recordDir = recordDir
+        self.directory = posixpath.join(recordDir, MANIFEST_DIR)
+        self._lock = threading.Lock()
+        self._tails = {}    # shard path -> its last entry, or None when empty
+        self.exists = False
+
+    def shardPath(self, month):
+        return posixpath.join(self.directory, f"{month}.idx")
+
+    def present(self, fs):
+        # Only ever cached once seen, a manifest built while we run is picked up
+        if not self.exists:
+            try:
+                self.exists = stat.S_ISDIR(fs.stat(self.directory).st_mode)
+            except IOError:
+                pass
+        return self.exists
+
+    def create(self, fs):
+        """
+        Starts an empty manifest, for a record directory that was just made.
+        """
+        try:
+            fs.mkdir(self.directory)
+        except IOError:
+            pass
+        self.exists = True
+
+    def _readShard(self, fs, path):
+        try:
+            with fs.open(path, "rb") as f:
+                data = f.read()
+        except IOError:
+            return []
+        # A torn last line from a crash mid-append is left out
+        whole = len(data) - len(data) % LINE_BYTES
+        return [parseEntry(data[i:i + LINE_BYTES]) for i in range(0, whole, LINE_BYTES)]
+
+    def _writeShard(self, fs, path, entries):
+        with fs.open(path + PARTIAL_SUFFIX, "wb") as f:
+            f.write(b"".join(formatEntry(entry) for entry in entries))
+        fs.posix_rename(path + PARTIAL_SUFFIX, path)
+
+    def _tail(self, fs, path):
+        # Last entry of the shard, None when there is none yet, False when a
+        # torn line means it has to be rewritten
+        if path in self._tails:
+            return self._tails[path]
+        try:
+            size = fs.stat(path).st_size
+        except IOError:
+            return None
+        if size % LINE_BYTES:
+            return False
+        if size == 0:
+            return None
+        with fs.open(path, "rb") as f:
+            f.seek(size - LINE_BYTES)
+            return parseEntry(f.read(LINE_BYTES))
+
+    def add(self, fs, entries):
+        """
+        Indexes a file that has landed, from its makeEntries(). Adding the same
+        name again replaces its entries, so a retried upload can add them
+        twice. Does nothing without a manifest to add to.
+        """
+        if not self.present(fs):
+            return
+        shards = {}
+        for entry in sorted(entries):
+            shards.setdefault(self.shardPath(entry[0] // 10**8), []).append(entry)
+
+        with self._lock:
+            for path, new in shards.items():
+                tail = self._tail(fs, path)
+                if tail == new[-1]:
+                    continue
+                if tail is None or (tail and new[0][0] > tail[0]):
+                    # The usual case, newer than anything indexed so far
+                    with fs.open(path, "ab") as f:
+                        f.write(b"".join(formatEntry(entry) for entry in new))
+                    self._tails[path] = new[-1]
+                    continue
+
+                names = {entry[2] for entry in new}
+                kept = [entry for entry in self._readShard(fs, path) if entry[2] not in names]
+                kept = sorted(kept + new)
+                self._writeShard(fs, path, kept)
+                self._tails[path] = kept[-1]
+
+    def _search(self, f, count, first):
+        # Index of the first line whose first timestamp is at least `first`
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(mid * LINE_BYTES)
+            if int(f.read(14)) < first:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, fs, start, end):
+        """
+        Entries of the files holding a record that starts within [start, end],
+        both YYYYmmddHHMMSS, one per file, sorted by name. None when the directory has no manifest and has to be
+        listed instead.
+        """
+        if not self.present(fs):
+            return None
+
+        start, end = int(start), int(end)
+        found = {}
+        for month in months(start, end):
+            path = self.shardPath(month)
+            try:
+                size = fs.stat(path).st_size
+            except IOError:
+                continue
+            count = size // LINE_BYTES
+            with fs.open(path, "rb") as f:
+                lo = self._search(f, count, start)
+                hi = self._search(f, count, end + 1)
+                f.seek(lo * LINE_BYTES)
+                data = f.read((hi - lo) * LINE_BYTES)
+            for i in range(0, len(data), LINE_BYTES):
+                entry = parseEntry(data[i:i + LINE_BYTES])
+                found[entry[2]] = entry
+        return [found[name] for name in sorted(found)]
+
+    def rebuild(self, fs, checksums=True):
+        """
+        Indexes every record and bundle file in the directory from scratch.
+        Bundles are read for the records they carry, and record files for their
+        checksum unless checksums is False (0 then). Returns the number of
+        files indexed.
+        """
+        shards = {}
+        count = 0
+        for attr in fs.listdir_attr(self.recordDir):
+            if not stat.S_ISREG(attr.st_mode or 0) or recordSpan(attr.filename) is None:
+                continue
+            crc = 0
+            records = None
+            bundle = BUNDLE_PATTERN.match(attr.filename) is not None
+            if checksums or bundle:
+                with fs.open(posixpath.join(self.recordDir, attr.filename), "rb") as f:
+                    data = f.read()
+                crc = zlib.crc32(data)
+                if bundle:
+                    records = bundledRecords(data)
+            for entry in makeEntries(attr.filename, attr.st_size, attr.st_mtime, crc, records):
+                shards.setdefault(entry[0] // 10**8, []).append(entry)
+            count += 1
+
+        with self._lock:
+            self.create(fs)
+            for month, entries in shards.items():
+                self._writeShard(fs, self.shardPath(month), sorted(entries))
+            for attr in fs.listdir_attr(self.directory):
+                match = SHARD_PATTERN.match(attr.filename)
+                if match and int(match.group(1)) not in shards:
+                    fs.remove(posixpath.join(self.directory, attr.filename))
+            self._tails = {}
+        return count
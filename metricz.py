@@ -0,0 +1,294 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+
+# Upper bounds of the stage latency buckets, from a buffer append to an SFTP upload
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60) # [s]
+METRICS_PORT = 9464 # [port] on localhost, the usual Prometheus exporter range
+TEXTFILE_INTERVAL = 15 # [s] between rewrites of the Prometheus text file
+PREFIX = "ble_central_"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labelText(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+class Gauge:
+    """
+    Either set() directly, or given a function that's read at scrape time.
+    """
+
+    def __init__(self, read=None):
+        self.value = 0
+        self.read = read
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        value = self.value
+        if self.read is not None:
+            try:
+                value = self.read()
+            except Exception:
+                return
+        if value is not None:
+            yield name, labels, float(value)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{name}_bucket", labels + (("le", repr(float(bound))),), cumulative
+        yield f"{name}_bucket", labels + (("le", "+Inf"),), self.count
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, self.count
+
+class Registry:
+    """
+    Every metric the central keeps, rendered in the Prometheus text format.
+    Disabled by default, when every hook short circuits on one attribute check.
+    """
+
+    KINDS = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.metrics = {}   # name -> (kind, help, {labels: metric})
+        self.lastErrors = {}    # stage -> (time.time(), message)
+        self._stages = {}       # stage -> its stage_seconds histogram, skips the label lookup
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        labels = tuple(sorted(labels.items()))
+        family = self.metrics.get(name)
+        if family is None or labels not in family[2]:
+            with self._lock:
+                family = self.metrics.setdefault(name, (cls, help, {}))
+                family[2].setdefault(labels, cls(**kwargs))
+        return family[2][labels]
+
+    def counter(self, name, help="", **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help="", read=None, **labels):
+        gauge = self._get(Gauge, name, help, labels)
+        if read is not None:
+            gauge.read = read
+        return gauge
+
+    def histogram(self, name, help="", **labels):
+        return self._get(Histogram, name, help, labels)
+
+    def remove(self, name, **labels):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self.metrics.get(name)
+            if family is None:
+                return
+            family[2].pop(labels, None)
+            if not family[2]:
+                del self.metrics[name]
+
+    def observeStage(self, stage, seconds, error=None):
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._stages[stage] = self.histogram("stage_seconds", "Time spent per pipeline stage",
+                                                             stage=stage)
+        histogram.observe(seconds)
+        if error is not None:
+            self.counter("stage_errors_total", "Failures per pipeline stage", stage=stage).inc()
+            self.lastErrors[stage] = (time.time(), f"{type(error).__name__}: {error}")
+
+    def render(self):
+        lines = []
+        with self._lock:
+            families = [(name, cls, help, list(members.items()))
+                        for name, (cls, help, members) in sorted(self.metrics.items())]
+        for name, cls, help, members in families:
+            full_name = PREFIX + name
+            if help:
+                lines.append(f"# HELP {full_name} {help}")
+            lines.append(f"# TYPE {full_name} {self.KINDS[cls]}")
+            for labels, metric in members:
+                for sample_name, sample_labels, value in metric.samples(full_name, labels):
+                    lines.append(f"{sample_name}{_labelText(sample_labels)} {value}")
+
+        if self.lastErrors:
+            full_name = PREFIX + "stage_last_error_timestamp_seconds"
+            lines.append(f"# HELP {full_name} When each stage last failed, the error is in the label")
+            lines.append(f"# TYPE {full_name} gauge")
+            for stage, (when, message) in sorted(self.lastErrors.items()):
+                labels = (("error", message[:200]), ("stage", stage))
+                lines.append(f"{full_name}{_labelText(labels)} {when}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def enable():
+    REGISTRY.enabled = True
+    return REGISTRY
+
+def enabled():
+    return REGISTRY.enabled
+
+def inc(name, amount=1, help="", **labels):
+    if REGISTRY.enabled:
+        REGISTRY.counter(name, help, **labels).inc(amount)
+
+def setGauge(name, value, help="", **labels):
+    if REGISTRY.enabled:
+        REGISTRY.gauge(name, help, **labels).set(value)
+
+def observe(stage, seconds, error=None):
+    """
+    Records a stage that wasn't timed by a with block, e.g. one spanning loop iterations.
+    """
+    if REGISTRY.enabled:
+        REGISTRY.observeStage(stage, seconds, error)
+
+def watch(name, read, help="", **labels):
+    """
+    Gauge read from read() at scrape time, e.g. a queue depth.
+    """
+    REGISTRY.gauge(name, help, read=read, **labels)
+
+def unwatch(name, **labels):
+    """
+    Drops a watch() gauge, so whatever its read() holds on to can go.
+    """
+    REGISTRY.remove(name, **labels)
+
+class _StageTimer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, error, trace):
+        REGISTRY.observeStage(self.stage, time.perf_counter() - self.start, error)
+        return False
+
+_NOT_TIMED = nullcontext()
+
+def timer(stage):
+    """
+    with timer("ble_read"): ... records how long the block took, and its error if it raised.
+    """
+    if not REGISTRY.enabled:
+        return _NOT_TIMED
+    return _StageTimer(stage)
+
+def timed(stage):
+    """
+    Decorator form of timer().
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return func(*args, **kwargs)
+            with _StageTimer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def writeTextFile(path):
+    """
+    Writes the metrics for node_exporter's textfile collector, atomically.
+    """
+    partial_path = path + ".part"
+    with open(partial_path, "w") as f:
+        f.write(REGISTRY.render())
+    os.replace(partial_path, path)
+
+class TextFileWriter:
+    """
+    Rewrites the Prometheus text file every `interval` seconds from a background thread.
+    """
+
+    def __init__(self, path, interval=TEXTFILE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="metrics-textfile", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        writeTextFile(self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                writeTextFile(self.path)
+            except OSError as e:
+                print(f"Failed to write metrics to {self.path}: {e}")
+
+def serve(port=METRICS_PORT, host="127.0.0.1"):
+    """
+    Serves the metrics at http://host:port/metrics from a background thread.
+    Returns the server, shutdown() stops it.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
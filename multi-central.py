@@ -0,0 +1,32 @@
+# Read sensor readings from every peripheral BLE device advertising our sensor
+# service at once, one LiveRecord stream per device.
+
+import os
+import asyncio
+from recordz import Record
+from centralz import AdafruitRadio, MultiCentral, LOG_CADENCE, RECORD_LIFESPAN
+from remotez import SftpPool, LinkMonitor, UploadWorker
+from livez import LiveServer, LIVE_PORT
+
+def printSample(address, record):
+    print(f"[{address}]\n" + record.latestDataFrameToText())
+
+async def main():
+    # Every device's readings, tagged with its address, at ws://127.0.0.1:8765/live
+    live_server = LiveServer(LIVE_PORT).start()
+
+    # One SSH connection to RangerLab and one uploader for every device's records,
+    # each device's go to its own subdirectory, made and indexed as they land
+    sftp_pool = SftpPool()
+    link_monitor = LinkMonitor(pool=sftp_pool).start()
+    uploader = UploadWorker(sftp_pool, linkMonitor=link_monitor).start()
+
+    # Every device logs its samples to disk as they arrive, whatever a crash or
+    # power cut left unsaved becomes a record again before anything new is logged
+    central = MultiCentral(AdafruitRadio(), cadence=LOG_CADENCE, lifespan=RECORD_LIFESPAN,
+                           onSample=printSample, broadcaster=live_server, uploader=uploader,
+                           linkMonitor=link_monitor, walDir=os.path.join(Record().scriptDir, "wal"))
+    central.recover()
+    await central.run()
+
+asyncio.run(main())
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+
+def _buckets(count, buckets):
+    # Start/stop row of each bucket, equal counts of rows per bucket
+    edges = np.linspace(0, count, buckets + 1).astype(int)
+    return zip(edges[:-1], edges[1:])
+
+def minMaxIndices(y, buckets):
+    """
+    Rows to keep so that every bucket still shows its highest and lowest value.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    keep = []
+    for lo, hi in _buckets(len(y), buckets):
+        window = y[lo:hi]
+        if hi <= lo or np.isnan(window).all():
+            continue
+        keep.append(lo + int(np.nanargmin(window)))
+        keep.append(lo + int(np.nanargmax(window)))
+    return np.unique(keep)
+
+def lttbIndices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: keeps the first and last rows, then from each
+    bucket the row forming the largest triangle with the previous pick and the
+    next bucket's average, which preserves the visual shape of the line.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+
+    valid = ~np.isnan(y)
+    keep = [0]
+    edges = np.linspace(1, count - 1, threshold - 1).astype(int)
+    previous = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else count
+        next_valid = valid[next_lo:next_hi]
+        if next_valid.any():
+            avg_x = x[next_lo:next_hi][next_valid].mean()
+            avg_y = y[next_lo:next_hi][next_valid].mean()
+        else:
+            avg_x, avg_y = x[next_lo:next_hi].mean(), y[previous]
+
+        window = np.arange(lo, hi)[valid[lo:hi]]
+        if len(window) == 0:
+            continue
+        areas = np.abs((x[previous] - avg_x) * (y[window] - y[previous])
+                       - (x[previous] - x[window]) * (avg_y - y[previous]))
+        previous = int(window[np.argmax(areas)])
+        keep.append(previous)
+
+    keep.append(count - 1)
+    return np.unique(keep)
+
+def downsample(dataFrame, x, ys, width, method="minmax"):
+    """
+    Cuts dataFrame down to roughly what `width` columns can show, keeping the
+    rows each of the `ys` series needs to hold its shape. Cost depends on the
+    number of rows only through numpy, not through the plotting library.
+    """
+    if dataFrame is None or len(dataFrame) <= 2 * width:
+        return dataFrame
+    if not pd.api.types.is_numeric_dtype(dataFrame[x]):
+        return dataFrame
+
+    keep = []
+    for y in ys:
+        if y not in dataFrame:
+            continue
+        if method == "lttb":
+            keep.append(lttbIndices(dataFrame[x].to_numpy(), dataFrame[y].to_numpy(), width))
+        else:
+            keep.append(minMaxIndices(dataFrame[y].to_numpy(), width))
+
+    if not keep:
+        return dataFrame
+    return dataFrame.iloc[np.unique(np.concatenate(keep))]
+
+def formatTimeAxis(ax, timeFmt, tz):
+    """
+    Leaves the x data as epoch seconds and formats only the tick labels.
+    """
+    from matplotlib.ticker import FuncFormatter
+
+    def label(value, _):
+        return pd.Timestamp(value, unit="s", tz="UTC").tz_convert(tz).strftime(timeFmt)
+
+    ax.xaxis.set_major_formatter(FuncFormatter(label))
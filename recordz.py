@@ -1,20 +1,35 @@
-import paramiko
 import subprocess
 import time
 import threading
-import pandas as pd
+import copy
+import heapq
+import itertools
+import queue
 import json
 import os
 import calendar
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import mpl_ascii
+from bufferz import SampleBuffer
+from codecz import encodeColumns, isRecordFile, payloadsToFrame, readPayloads, readRows, recordFileName, rowsInRange
+from metricz import timed
+
+# Logging readings, saving and uploading them must not wait on pandas,
+# matplotlib or paramiko, so they are only imported by the plotting and
+# archive methods that use them.
 
 
 REMOTE_HOST="192.168.0.100"
 REMOTE_UN="ranger"
 REMOTE_DIR="/mnt/nosferatu/ranger-storage/records/garden"
 DATE_FMT = "%Y%m%d%H%M%S"
+TIME_FMT = "%m/%d/%Y %H:%M:%S"
+LOCAL_TZ = "America/New_York"
+RECORD_LOOKBACK = 60*10 # [s] a record file holds up to this much data after the time in its name
+CHUNK_ROWS = 50000 # [samples] per chunk when streaming an archive
+RECORD_COMPRESSION = None # None, "gzip" or "zstd" for new record files, see codecz
+RECORD_COLUMNAR = False # columns instead of rows in new record files
+LOAD_WORKERS = os.cpu_count() or 1 # [processes] parsing archive record files at once, 1 parses them in this one
+PARALLEL_MIN_FILES = 64 # [files] fewer than this aren't worth handing to the load workers
+LOAD_BATCHES = 4 # [batches] of files per load worker, so one slow batch doesn't hold up the rest
 
 def toDateStr(timeStmp):
     return time.strftime(DATE_FMT, time.localtime(timeStmp))
@@ -34,82 +49,106 @@ def daysAgo(dayz: int):
 
 class Record:
  
-    dataFrame = None
-    latestDataFrame = None
     unitsDict = None
 
     def __init__(self):
-        self.dataFrame = None
+        self.buffer = None
+        self._frame = None
         self.scriptDir = os.path.dirname(os.path.abspath(__file__))
         self.outRecordsDir = os.path.join(self.scriptDir, "outRecords")
         self.inRecordsDir = os.path.join(self.scriptDir, "inRecords")
+        self.remoteDir = REMOTE_DIR
+        self.timeFmt = TIME_FMT
+        self.plotMethod = "minmax"  # or "lttb", see plotz.downsample
+
+    @property
+    def dataFrame(self):
+        # Samples live in the columnar buffer, only build a DataFrame when asked for one
+        if self._frame is None and self.buffer is not None:
+            self._frame = self.buffer.toDataFrame()
+        return self._frame
+
+    @dataFrame.setter
+    def dataFrame(self, dataFrame):
+        self._frame = dataFrame
+        self.buffer = None
 
     def setupPlots(self, width=250, height=50):
+        import matplotlib as mpl
+        import mpl_ascii
         mpl.use("module://mpl_ascii")
 
         mpl_ascii.AXES_WIDTH=width
         mpl_ascii.AXES_HEIGHT=height
 
 
-    def plotTemps(self, width=250, height=50):
+    @timed("plot")
+    def plotColumns(self, columns, title, ylabel, ylim, width=250, height=50):
         if self.dataFrame is None:
             return
 
         self.setupPlots(width, height)
 
-        self.dataFrame.plot(kind='line', 
-            title="Temp Plots",
-            ylabel="Temp F",
+        # The plot is only `width` characters wide, hand it no more points than that
+        import pandas as pd
+        import matplotlib.pyplot as plt
+        from plotz import downsample, formatTimeAxis
+        dataFrame = downsample(self.dataFrame, "timestamp", columns, width, self.plotMethod)
+
+        ax = dataFrame.plot(kind='line', 
+            title=title,
+            ylabel=ylabel,
             xlabel="Day/Month/Year Hour:Min:Sec",
             x='timestamp', 
-            ylim=(-20,110), 
-            y=['soil2_temp', 'soil1_temp'])
+            ylim=ylim, 
+            y=columns)
 
-        plt.show()
-
-    def plotPercents(self, width=250, height=50):
-        if self.dataFrame is None:
-            return
+        if pd.api.types.is_numeric_dtype(dataFrame['timestamp']):
+            formatTimeAxis(ax, self.timeFmt, LOCAL_TZ)
 
-        self.setupPlots(width, height)
+        plt.show()
+        # show() redraws every open figure, don't let old plots pile up
+        plt.close(ax.figure)
 
-        self.dataFrame.plot(kind='line', 
-            title="Moisture and Light Percentage",
-            xlabel="Day/Month/Year Hour:Min:Sec",
-            ylabel="Percentage %",
-            x='timestamp', 
-            ylim=(0,100), 
-            y=['moist', 'uva'])
+    def plotTemps(self, width=250, height=50):
+        self.plotColumns(['soil2_temp', 'soil1_temp'], "Temp Plots", "Temp F", (-20,110), width, height)
 
-        plt.show()
+    def plotPercents(self, width=250, height=50):
+        self.plotColumns(['moist', 'uva'], "Moisture and Light Percentage", "Percentage %", (0,100),
+                         width, height)
 
     def addMessageToDataFrame(self, dataMessage: dict, unitsMessage: dict):
+        if self.buffer is None:
+            self.buffer = SampleBuffer.fromDataFrame(self._frame)
 
-        df = pd.DataFrame([{
-            **dataMessage
-        }])
-
-        if self.dataFrame is None:
-            self.dataFrame = df
-        else:
-            self.dataFrame = pd.concat([self.dataFrame, df], ignore_index=True)
+        self.buffer.append(dataMessage)
+        self._frame = None
 
         if self.unitsDict is None:
             self.unitsDict = unitsMessage
 
+    def sampleColumns(self):
+        # Straight from the buffer while the samples are still in it, no DataFrame needed
+        if self.buffer is not None and len(self.buffer):
+            return self.buffer.toColumns()
+        if self._frame is not None:
+            return {column: self._frame[column].tolist() for column in self._frame.columns}
+        return None
+
+    @timed("to_json")
     def dataFrameToJson(self):
-        if self.dataFrame is None or self.unitsDict is None:
+        columns = self.sampleColumns()
+        if columns is None or self.unitsDict is None:
             return json.dumps({"error": "No data available"})
 
-        json_data = {
-            "sensor_data": self.dataFrame.to_dict(orient="records"),
-            "sensor_units": self.unitsDict
-        }
+        return encodeColumns(columns, self.unitsDict).decode("utf-8")
 
-        return json.dumps(json_data, indent=4)
 
+    @timed("upload")
+    def uploadOutRecords(self, remoteDir=None, un=REMOTE_UN, host=REMOTE_HOST):
+        if remoteDir is None:
+            remoteDir = self.remoteDir
 
-    def uploadOutRecords(self, remoteDir=REMOTE_DIR, un=REMOTE_UN, host=REMOTE_HOST):
         # Ensure the local directory exists
         if not os.path.isdir(self.outRecordsDir):
             print("Local directory, ", self.outRecordsDir, " does not exist.")
@@ -141,7 +180,9 @@ class Record:
             print(f"Error: {e}")
             return False
 
+    @timed("reachability")
     def isRangerLabReachable(self, host="192.168.0.100", username="ranger", port=22, timeout=5):
+        import paramiko
         ssh = paramiko.SSHClient()
         ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # Auto-accept unknown keys
 
@@ -159,30 +200,307 @@ class Record:
             return False  # Connection failed
 
 
+def sourceDirName(source: str):
+    # Peripheral addresses look like "AA:BB:CC:DD:EE:FF", keep them path friendly
+    return "".join(c if c.isalnum() else "-" for c in str(source))
+
+def sourceRemoteDir(source=None, remoteDir=REMOTE_DIR):
+    # Where a source's records are uploaded to and archived in, remoteDir itself for no source
+    if source is None:
+        return remoteDir
+    return remoteDir + "/" + sourceDirName(source)
+
+class RecordFlusher:
+    """
+    Saves sealed records and hands them to the uploader on a background
+    thread, in the order they were sealed, so rotation never waits on disk.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.flushed = 0
+        self._thread = threading.Thread(target=self._work, name="record-flusher", daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        self.queue.put(record)
+
+    def join(self):
+        self.queue.join()
+
+    def _work(self):
+        while True:
+            record = self.queue.get()
+            try:
+                record.flush()
+                self.flushed += 1
+            except Exception as e:
+                print(f"Failed to flush record: {e}")
+            finally:
+                self.queue.task_done()
+
+class RotationScheduler:
+    """
+    Rotates LiveRecords that have gone quiet when their lifespan runs out. A
+    record taking in samples rotates itself on the first one past the boundary,
+    this only covers the ones that stopped.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._count = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="record-rotation", daemon=True)
+        self._thread.start()
+
+    def schedule(self, record):
+        with self._cond:
+            heapq.heappush(self._heap, (record.rotateAt, next(self._count), record))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._cond.wait(self._heap[0][0] - time.time() if self._heap else None)
+                _, _, record = heapq.heappop(self._heap)
+            try:
+                if record.rotateIfDue() is not None:
+                    self.schedule(record)
+            except Exception as e:
+                print(f"Failed to rotate record: {e}")
+
+_flusher = None
+_scheduler = None
+_defaultsLock = threading.Lock()
+
+_loadPool = None
+_loadPoolWorkers = None
+_loadPoolLock = threading.Lock()
+
+def loadPool(workers=LOAD_WORKERS):
+    """
+    The process pool ArchiveRecords parse record files on, made on first use
+    and kept, so only the first large load pays for starting it.
+    """
+    global _loadPool, _loadPoolWorkers
+    with _loadPoolLock:
+        if _loadPool is None or _loadPoolWorkers != workers:
+            if _loadPool is not None:
+                _loadPool.shutdown(wait=False)
+            from concurrent.futures import ProcessPoolExecutor
+            _loadPool = ProcessPoolExecutor(max_workers=workers)
+            _loadPoolWorkers = workers
+        return _loadPool
+
+def _loadFrame(file_paths, start, end):
+    # Runs on a load worker, a batch of files comes back as one DataFrame.
+    # Errors come back as text, one bad file shouldn't sink the load.
+    payloads = []
+    errors = []
+    for file_path in file_paths:
+        try:
+            payloads.extend(readPayloads(file_path))
+        except Exception as e:
+            errors.append(f"Error reading {file_path}: {e}")
+    frame, units = payloadsToFrame(payloads, start, end)
+    return frame, units, errors
+
+def recordFlusher():
+    # One flusher thread for every LiveRecord, started with the first one
+    global _flusher
+    with _defaultsLock:
+        if _flusher is None:
+            _flusher = RecordFlusher()
+        return _flusher
+
+def rotationScheduler():
+    global _scheduler
+    with _defaultsLock:
+        if _scheduler is None:
+            _scheduler = RotationScheduler()
+        return _scheduler
+
 class LiveRecord(Record):
     
-    def __init__(self, lifespan: float):
+    def __init__(self, lifespan: float, source=None, uploader=None, linkMonitor=None,
+                 segmentStore=None, wal=None, flusher=None, broadcaster=None):
         super().__init__()
-        
-        self._timer = threading.Timer(lifespan, self._self_destruct)
-        self._timer.daemon = True
-        self._timer.start()
 
+        # A walz.WriteAheadLog, when given, every sample is logged to disk as it
+        # arrives and the log is dropped once the record has been uploaded
+        self.wal = wal
+        self.walSegment = None
+        self._finished = False
+        # Guards the buffer between ingestion and rotation, never held over I/O
+        self._lock = threading.RLock()
+
+        # A segmentz.SegmentStore, when given, also gets every saved record
+        self.segmentStore = segmentStore
+
+        # A remotez.UploadWorker, when given, takes finished records instead of scp
+        self.uploader = uploader
+        # A remotez.LinkMonitor, when given, answers reachability from its cache
+        self.linkMonitor = linkMonitor
+        # A livez.LiveServer, when given, pushes every sample to its clients
+        self.broadcaster = broadcaster
+        # Latest sample of the last sealed record, shown until the next one arrives
+        self.lastSample = None
+
+        # Format of the saved files, the archive reads every one of them
+        self.compression = RECORD_COMPRESSION
+        self.columnar = RECORD_COLUMNAR
+
+        # Records from more than one peripheral are kept apart by source
+        self.source = source
+        if source is not None:
+            self.outRecordsDir = os.path.join(self.outRecordsDir, sourceDirName(source))
+            self.remoteDir = sourceRemoteDir(source, self.remoteDir)
+        
+        # Every lifespan seconds the samples so far are sealed off into their own
+        # record for the flusher, and a fresh buffer takes over. No lifespan for
+        # records that are finished by hand, e.g. recovered ones.
+        self.lifespan = lifespan
+        self.flusher = flusher
+        self.rotations = 0
+        self.rotateAt = None
         self.isLive = True
+        if lifespan is not None:
+            self.rotateAt = time.time() + lifespan
+            rotationScheduler().schedule(self)
+
+    def _seal(self):
+        # Call with _lock held. The sealed copy takes the samples and their log
+        # segment, this record carries on with an empty buffer and its last
+        # sample for the display.
+        self.lastSample = self.latestSample()
+        sealed = copy.copy(self)
+        sealed._lock = threading.RLock()
+        sealed.isLive = False
+        sealed.rotateAt = None
+        sealed._finished = True
+
+        self.buffer = None
+        self._frame = None
+        self.walSegment = None
+        return sealed
+
+    def _rotateDue(self, timestamp):
+        # Call with _lock held
+        if self.rotateAt is None or timestamp < self.rotateAt:
+            return
+        # Boundaries stay on the lifespan grid, skipping any the record sat idle through
+        while self.rotateAt <= timestamp:
+            self.rotateAt += self.lifespan
+        if self.buffer is None or len(self.buffer) == 0:
+            return
+        self.rotations += 1
+        (self.flusher or recordFlusher()).submit(self._seal())
+
+    def rotateIfDue(self, now=None):
+        """
+        Rotates if the lifespan boundary has passed. Returns when the next one
+        is due, or None once the record is finished.
+        """
+        with self._lock:
+            if not self.isLive:
+                return None
+            self._rotateDue(time.time() if now is None else now)
+            return self.rotateAt
+
+    def finish(self):
+        """
+        Ends the record: whatever it holds is saved and handed to the uploader
+        on the calling thread. Returns the saved file's path, None if nothing
+        was saved. Later calls do nothing.
+        """
+        with self._lock:
+            if self._finished:
+                return None
+            self._finished = True
+            self.isLive = False
+            self.rotateAt = None
+            sealed = self._seal()
+        return sealed.flush()
+
+    def flush(self):
+        """
+        Saves the record and hands it to the uploader. Returns the saved file's path.
+        """
+        file_path = self.saveJsonToFile()
+        self.handOff(file_path)
+        return file_path
+
+    def handOff(self, file_path):
+        segment = self.walSegment
+        if self.uploader is not None:
+            if file_path is not None:
+                self.uploader.submit(file_path, self.remoteDir,
+                                     done=segment.discard if segment is not None else None)
+        elif self.isReachable():
+            if self.uploadOutRecords() and segment is not None:
+                segment.discard()
+
+    @classmethod
+    def recover(cls, wal, uploader=None, linkMonitor=None, segmentStore=None):
+        """
+        Turns what an earlier run left in the write-ahead log back into records
+        and hands them on like finished ones. Call before any new LiveRecord
+        logs to wal. Returns the paths of the record files handed on, which
+        the uploader already has and mustn't be given again by submitDir().
+        """
+        recovered = 0
+        handed_off = []
+        for path, logged in wal.leftovers():
+            record = cls(None, source=logged["source"], uploader=uploader, linkMonitor=linkMonitor,
+                         segmentStore=segmentStore)
+            segment = wal.resume(path, logged["source"], logged["intact"])
+
+            if logged["record"] is not None:
+                # Saved but maybe not uploaded, the local file only goes once it has been
+                record_path = os.path.join(record.outRecordsDir, logged["record"])
+                if os.path.isfile(record_path):
+                    record.walSegment = segment
+                    record.handOff(record_path)
+                    handed_off.append(record_path)
+                else:
+                    segment.discard()
+                continue
+
+            if not logged["samples"]:
+                segment.discard()
+                continue
+
+            # Replayed with no segment attached, so the samples aren't logged twice
+            record.processSamples(logged["samples"], logged["units"])
+            record.walSegment = segment
+            record_path = record.finish()
+            if record_path is not None:
+                handed_off.append(record_path)
+            recovered += len(logged["samples"])
+            print(f"Recovered {len(logged['samples'])} samples from {path}")
+        return handed_off
+
+    def logSample(self, dataMessage: dict, unitsMessage: dict):
+        if self.wal is None:
+            return
+        if self.walSegment is None:
+            self.walSegment = self.wal.open(self.source)
+        self.walSegment.append(dataMessage, unitsMessage)
 
-    def _self_destruct(self):
-        self.isLive = False
-        self.saveJsonToFile()
-        if self.isRangerLabReachable():
-            self.uploadOutRecords()
+    def isReachable(self):
+        if self.linkMonitor is not None:
+            return bool(self.linkMonitor.reachable)
+        return self.isRangerLabReachable()
 
+    @timed("save")
     def saveJsonToFile(self):
-        if self.dataFrame is None or self.dataFrame.empty:
+        if self.buffer is None or len(self.buffer) == 0:
             print("No data available to save.")
             return
 
         # Get the timestamp of the first entry
-        first_timestamp = self.dataFrame.iloc[0].get("timestamp", None)
+        first_timestamp = self.buffer.first("timestamp")
         if first_timestamp is None:
             print("No valid timestamp in the data.")
             return
@@ -194,36 +512,83 @@ class LiveRecord(Record):
         os.makedirs(self.outRecordsDir, exist_ok=True)
 
         # Define file path
-        file_path = os.path.join(self.outRecordsDir, f"record.{formatted_time}.json")
+        file_path = os.path.join(self.outRecordsDir, recordFileName(formatted_time, self.compression))
 
         # Get JSON data
-        json_data = self.dataFrameToJson()
+        json_data = encodeColumns(self.buffer.toColumns(), self.unitsDict, self.columnar, self.compression)
 
         # Write JSON to file
-        with open(file_path, "w") as json_file:
+        with open(file_path, "wb") as json_file:
             json_file.write(json_data)
+            if self.walSegment is not None:
+                # The log is only sealed once the record itself can't be lost
+                json_file.flush()
+                os.fsync(json_file.fileno())
+
+        if self.walSegment is not None:
+            self.walSegment.seal(file_path)
 
         print(f"Record saved to {file_path}")
 
+        if self.segmentStore is not None:
+            self.segmentStore.append(self.dataFrame, self.unitsDict)
+
+        return file_path
+
+    @timed("process")
     def processMessage(self, message: dict):
         dataMessage = message["sensor_data"]
         dataMessage["timestamp"] = time.time()
         unitsMessage = message["sensor_units"]
         self.addMessageToDataFrame(dataMessage, unitsMessage)
 
-    def addMessageToDataFrame(self, dataMessage: dict, unitsMessage: dict):
-        # Call the superclass method to reuse existing logic
-        super().addMessageToDataFrame(dataMessage, unitsMessage)
+    @timed("process")
+    def processSamples(self, samples: list, unitsMessage: dict):
+        # Already decoded and timestamped samples, e.g. from the packed binary mode
+        for dataMessage in samples:
+            self.addMessageToDataFrame(dataMessage, unitsMessage)
+
+    def _anchor(self, timestamp):
+        # Call with _lock held. Samples from before this record's window, e.g.
+        # backfilled from a peripheral's history, start a lifespan grid of
+        # their own, so an outage still comes out as records of at most one
+        # lifespan each, as RECORD_LOOKBACK expects.
+        if self.rotateAt is None or (self.buffer is not None and len(self.buffer)):
+            return
+        if timestamp < self.rotateAt - self.lifespan:
+            self.rotateAt = timestamp + self.lifespan
 
-        # Store only the latest entry if data exists
-        if self.dataFrame is not None and not self.dataFrame.empty:
-            self.latestDataFrame = self.dataFrame.iloc[[-1]]  # Keep only the last row
+    def addMessageToDataFrame(self, dataMessage: dict, unitsMessage: dict):
+        with self._lock:
+            timestamp = dataMessage.get("timestamp", time.time())
+            self._anchor(timestamp)
+            # A sample past the boundary goes into the next record, not this one
+            self._rotateDue(timestamp)
+            super().addMessageToDataFrame(dataMessage, unitsMessage)
+            self.logSample(dataMessage, unitsMessage)
+        if self.broadcaster is not None:
+            self.broadcaster.publish(dataMessage, unitsMessage, self.source)
+
+    def latestSample(self):
+        buffer = self.buffer
+        if buffer is None or len(buffer) == 0:
+            return self.lastSample
+        return buffer.latest()
+
+    @property
+    def latestDataFrame(self):
+        latest_entry = self.latestSample()
+        if latest_entry is None:
+            return None
+        import pandas as pd
+        return pd.DataFrame([latest_entry])
 
+    @timed("format")
     def latestDataFrameToText(self) -> str:
-        if self.latestDataFrame is None or self.latestDataFrame.empty:
+        latest_entry = self.latestSample()
+        if latest_entry is None:
             return "No data available"
 
-        latest_entry = self.latestDataFrame.iloc[-1].to_dict()  # Get the last row as a Series
         timestampDate = time.asctime(time.localtime(latest_entry.get("timestamp", "???")))
         timestamp = timestampDate
         formatted_text = f"{timestamp}\n"
@@ -237,71 +602,193 @@ class LiveRecord(Record):
         return formatted_text.strip()  # Remove trailing newline 
 
 class ArchiveRecord(Record):
-    def __init__(self, start, end, timeFmt="%m/%d/%Y %H:%M:%S"):
+    def __init__(self, start, end, timeFmt=TIME_FMT, fetcher=None, singleStream=False,
+                 cache=None, segmentStore=None, load=True, resolution=None, workers=LOAD_WORKERS,
+                 source=None):
         super().__init__()
+        # The records of one peripheral, as a MultiCentral's LiveRecords upload
+        # them, cached apart from other sources' since their names can clash.
+        # A fetcher or cache passed in has to be for the same source.
+        self.source = source
+        if source is not None:
+            self.remoteDir = sourceRemoteDir(source, self.remoteDir)
+            self.inRecordsDir = os.path.join(self.inRecordsDir, sourceDirName(source))
+        # A segmentz.SegmentStore, when given, fetched records are folded into it
+        # and the range is mapped from its columns instead of parsing JSON
+        self.segmentStore = segmentStore
         self.start = start
         self.end = end
-        self.fetchArchive()
-        self.archiveFilesToDataFrame()
-        
-        local_tz = "America/New_York"
-
-        if self.dataFrame is not None:
-            self.dataFrame['timestamp'] = (
-                pd.to_datetime(self.dataFrame['timestamp'], unit='s')
-                .dt.tz_localize('UTC')
-                .dt.tz_convert(local_tz)
-                .dt.strftime(timeFmt)
-            )
+        # A remotez.ArchiveFetcher, one SSH connection for listing and every download.
+        # One made here is closed once the range is fetched, one passed in is the caller's.
+        self.fetcher = fetcher
+        self._ownFetcher = False
+        self.singleStream = singleStream
+        # A cachez.ArchiveCache over inRecords, kept between queries
+        self.cache = cache
+        self.recordFiles = None
+        # Seconds per point the caller needs, coarse enough resolutions are served
+        # from the hourly/daily rollups instead of raw samples
+        self.resolution = resolution
+        self.tier = None
+        # Timestamps stay epoch seconds, plots only format their tick labels
+        self.timeFmt = timeFmt
+        # Processes parsing record files when loading, see loadPool
+        self.workers = workers
+
+        try:
+            rolledUp = bool(resolution) and self.rollupToDataFrame()
+            if not rolledUp:
+                self.fetchArchive()
+        finally:
+            self.closeFetcher()
+        # Without load, the records are left on disk for iterChunks/streamStats
+        if not rolledUp and load:
+            self.archiveFilesToDataFrame()
+
+    def formattedDataFrame(self):
+        """
+        Copy of the data with timestamps as local time strings in timeFmt.
+        """
+        if self.dataFrame is None:
+            return None
 
-    def matchRemoteRecords(self, un=REMOTE_UN, host=REMOTE_HOST):
-        # SSH command to filter files by timestamp range using grep
-        ssh_command = (
-            f'ssh {un}@{host} "ls {REMOTE_DIR}/record.*.json | '
-            f'grep -E \'record\\.([0-9]{{14}})\\.json\' | '
-            f'awk -F. \'\\$2 >= {self.start} && \\$2 <= {self.end}\' "'
+        import pandas as pd
+        dataFrame = self.dataFrame.copy()
+        dataFrame['timestamp'] = (
+            pd.to_datetime(dataFrame['timestamp'], unit='s')
+            .dt.tz_localize('UTC')
+            .dt.tz_convert(LOCAL_TZ)
+            .dt.strftime(self.timeFmt)
         )
+        return dataFrame
+
+    def getFetcher(self):
+        if self.fetcher is None:
+            from remotez import ArchiveFetcher
+            self.fetcher = ArchiveFetcher(remoteDir=self.remoteDir)
+            self._ownFetcher = True
+        return self.fetcher
+
+    def closeFetcher(self):
+        # Closes the SSH connection of a fetcher made by getFetcher, a later
+        # call makes a new one
+        if self._ownFetcher:
+            self.fetcher.close()
+            self.fetcher = None
+            self._ownFetcher = False
+
+    def getCache(self):
+        if self.cache is None:
+            from cachez import ArchiveCache
+            self.cache = ArchiveCache(self.inRecordsDir)
+        return self.cache
+
+    @timed("archive_rollup")
+    def rollupToDataFrame(self):
+        from rollupz import TIERS, pickTier, tierFileName, loadTier, newestBucket
+
+        tier = pickTier(self.resolution)
+        if tier is None:
+            return False
 
+        cache = self.getCache()
         try:
-            # Run SSH command
-            result = subprocess.run(ssh_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            self.getFetcher().fetchIfChanged(tierFileName(tier), cache.directory)
+        except Exception as e:
+            print(f"Failed to fetch {tier} rollups, using raw records: {e}")
+            return False
 
-            if result.returncode != 0:
-                print(f"Failed to list remote files: {result.stderr}")
-                return []
+        path = cache.path(tierFileName(tier))
+        newest = newestBucket(path)
+        if newest is None:
+            return False
+        start, end = toEpochInt(self.start), toEpochInt(self.end)
+        self.dataFrame, self.unitsDict = loadTier(path, start, end, TIERS[tier])
+        self.tier = tier
+
+        # build-rollups.py runs now and then, so the newest bucket may have been
+        # filling and the samples after it aren't rolled up yet
+        if end >= newest:
+            self.mergeRawTail(max(newest, start // TIERS[tier] * TIERS[tier]), end, TIERS[tier])
+        return True
+
+    def mergeRawTail(self, start, end, width):
+        """
+        Rolls up the raw records from start to end into buckets of width
+        seconds, in place of any the rollup tier already had for them.
+        """
+        from rollupz import rollUpFrame
+        import pandas as pd
+
+        print(f"{self.tier} rollups may be incomplete from {toDateStr(start)}, rolling up raw records from there")
+        tail = ArchiveRecord(toDateStr(start), self.end, fetcher=self.getFetcher(), singleStream=self.singleStream,
+                             cache=self.getCache(), segmentStore=self.segmentStore, workers=self.workers,
+                             source=self.source)
+        if tail.dataFrame is None or tail.dataFrame.empty:
+            return
+        rolled = rollUpFrame(tail.dataFrame[tail.dataFrame["timestamp"] >= start], width)
+        kept = self.dataFrame[~self.dataFrame["timestamp"].isin(rolled["timestamp"])]
+        self.dataFrame = pd.concat([kept, rolled], ignore_index=True)
+        self.unitsDict = {**(tail.unitsDict or {}), **(self.unitsDict or {})}
 
-            # Process output and return matching file paths
-            remote_files = result.stdout.strip().split("\n")
-            return [f"{file}" for file in remote_files if file]
+    def lookbackStart(self):
+        # The record that started just before self.start may still hold samples after it
+        return toDateStr(toEpochInt(self.start) - RECORD_LOOKBACK)
 
+    def matchRemoteEntries(self):
+        try:
+            return self.getFetcher().listRecordAttrs(self.lookbackStart(), self.end)
         except Exception as e:
-            print(f"Error: {e}")
-            return []
+            print(f"Failed to list remote files: {e}")
+            return None
 
-    def fetchArchive(self, un=REMOTE_UN, host=REMOTE_HOST):
+    def matchRemoteRecords(self):
+        entries = self.matchRemoteEntries() or []
 
-        # Get the list of matching files
-        matching_files = self.matchRemoteRecords()
+        # Matching file paths, same as the ls on RangerLab would print them
+        return [f"{self.remoteDir}/{name}" for name, _, _ in entries]
 
-        if not matching_files:
-            print("No matching files found for the given time range.")
-            return
+    @timed("archive_fetch")
+    def fetchArchive(self):
+        cache = self.getCache()
 
-        # Ensure local directory exists
-        os.makedirs(self.inRecordsDir, exist_ok=True)
+        # Get the list of matching files
+        entries = self.matchRemoteEntries()
 
-        self.clearInRecords()
+        if entries is None:
+            # RangerLab is out of reach, make do with what is cached
+            names = cache.namesInRange(self.lookbackStart(), self.end)
+            print(f"Using {len(names)} cached records for the given time range.")
+            self.recordFiles = [cache.path(name) for name in names]
+            return
 
-        # Iterate through the list and copy each file using SCP
-        for file in matching_files:
-            remote_path = f"{file}"
+        if not entries:
+            print("No matching files found for the given time range.")
+            self.recordFiles = []
+            return
 
-            scp_command = f"scp {un}@{host}:{remote_path} {self.inRecordsDir}"
+        # Records are immutable once uploaded, so only fetch what isn't cached yet
+        missing = cache.missing(entries)
+        if missing:
+            fetcher = self.getFetcher()
+            fetcher.resetStats()
             try:
-                subprocess.run(scp_command, shell=True, check=True)
-                print(f"Copied {file} to {self.inRecordsDir}")
-            except subprocess.CalledProcessError as e:
-                print(f"Error copying {file}: {e}")
+                fetcher.fetch(missing, cache.directory, singleStream=self.singleStream)
+            except Exception as e:
+                print(f"Error fetching archive: {e}")
+
+            stats = fetcher.stats()
+            print(f"Copied {stats['files']} of {len(missing)} records to {cache.directory} "
+                  f"({stats['files_per_s']:.1f} files/s, {stats['mb_per_s']:.2f} MB/s)")
+            missing_names = set(missing)
+            cache.landed([entry for entry in entries if entry[0] in missing_names])
+
+        names = [name for name, _, _ in entries]
+        print(f"{len(names) - len(missing)} of {len(names)} records were already cached.")
+        cache.touch(names)
+        cache.evict(keep=names)
+        cache.save()
+        self.recordFiles = [cache.path(name) for name in names if os.path.isfile(cache.path(name))]
 
     def clearInRecords(self):
         """
@@ -323,36 +810,152 @@ class ArchiveRecord(Record):
                 except Exception as e:
                     print(f"Error deleting {file_path}: {e}")
 
-    def archiveFilesToDataFrame(self):
-        all_data = []
-        units_dict = None  # Store units from the first file
+    def recordFilePaths(self):
+        # Only the records matched by fetchArchive, or every record file in the directory
+        if self.recordFiles is not None:
+            file_paths = self.recordFiles
+        else:
+            # Ensure the directory exists
+            if not os.path.exists(self.inRecordsDir):
+                print(f"Directory {self.inRecordsDir} does not exist.")
+                return []
 
-        # Ensure the directory exists
-        if not os.path.exists(self.inRecordsDir):
-            print(f"Directory {self.inRecordsDir} does not exist.")
-            return None
+            file_paths = [os.path.join(self.inRecordsDir, file) for file in os.listdir(self.inRecordsDir)]
 
-        # Loop through all JSON files in the directory
-        for file in sorted(os.listdir(self.inRecordsDir)):  # Sorted to maintain chronological order
-            file_path = os.path.join(self.inRecordsDir, file)
+        return [file_path for file_path in sorted(file_paths)  # Sorted to maintain chronological order
+                if isRecordFile(os.path.basename(file_path)) and os.path.isfile(file_path)]
 
-            if file.startswith("record.") and file.endswith(".json") and os.path.isfile(file_path):
-                try:
-                    with open(file_path, "r") as f:
-                        data = json.load(f)
+    @timed("archive_segments")
+    def ingestSegments(self):
+        store = self.segmentStore
+        new_files = [path for path in self.recordFilePaths() if os.path.basename(path) not in store.ingested]
+        if new_files:
+            store.markIngested(store.appendRecordFiles(new_files))
 
-                    # Extract sensor data and append to list
-                    all_data.extend(data["sensor_data"])
+    def iterChunks(self, chunkRows=None):
+        """
+        Yields (DataFrame, units) covering exactly start..end, one record file at
+        a time or in chunks of chunkRows, so a long range never has to fit in
+        memory at once.
+        """
+        import pandas as pd
+        start, end = toEpochInt(self.start), toEpochInt(self.end)
 
-                    # Capture units from the first file
-                    if units_dict is None:
-                        units_dict = data.get("sensor_units", {})
+        if self.segmentStore is not None:
+            self.ingestSegments()
+            yield from self.segmentStore.iterChunks(start, end, chunkRows)
+            return
 
-                except Exception as e:
-                    print(f"Error reading {file_path}: {e}")
+        rows = []
+        units_dict = None
+        for file_path in self.recordFilePaths():
+            try:
+                records = readRows(file_path)
+            except Exception as e:
+                print(f"Error reading {file_path}: {e}")
+                continue
+
+            for record_rows, units in records:
+                # Capture units from the first file
+                if units_dict is None:
+                    units_dict = units
+
+                # File names only say when a record starts, trim to the exact range
+                file_rows = rowsInRange(record_rows, start, end)
+
+                if chunkRows is None:
+                    if file_rows:
+                        yield pd.DataFrame(file_rows), units_dict
+                    continue
+
+                rows.extend(file_rows)
+                while len(rows) >= chunkRows:
+                    yield pd.DataFrame(rows[:chunkRows]), units_dict
+                    rows = rows[chunkRows:]
+
+        if rows:
+            yield pd.DataFrame(rows), units_dict
+
+    def streamStats(self, columns=None, chunkRows=CHUNK_ROWS):
+        """
+        Count, min, max and mean per sensor over the whole range, computed chunk
+        by chunk without loading the range into a DataFrame.
+        """
+        totals = {}
+        for chunk, _ in self.iterChunks(chunkRows):
+            numeric = chunk.select_dtypes("number")
+            for column in (columns or numeric.columns):
+                if column == "timestamp" or column not in numeric:
+                    continue
+                values = numeric[column]
+                count = int(values.count())
+                if count == 0:
+                    continue
+                total = totals.setdefault(column, {"count": 0, "min": values.min(), "max": values.max(), "sum": 0.0})
+                total["count"] += count
+                total["min"] = min(total["min"], values.min())
+                total["max"] = max(total["max"], values.max())
+                total["sum"] += float(values.sum())
+
+        if not totals:
+            return None
+
+        import pandas as pd
+        for total in totals.values():
+            total["mean"] = total.pop("sum") / total["count"]
+        return pd.DataFrame.from_dict(totals, orient="index")[["count", "min", "max", "mean"]]
+
+    def parallelLoad(self, file_paths):
+        """
+        (DataFrame, units) of file_paths parsed on the load workers, in
+        contiguous batches that each come back as a DataFrame, put together in
+        file order.
+        """
+        start, end = toEpochInt(self.start), toEpochInt(self.end)
+        batch_size = -(-len(file_paths) // (self.workers * LOAD_BATCHES))
+        batches = [file_paths[i:i + batch_size] for i in range(0, len(file_paths), batch_size)]
+        results = loadPool(self.workers).map(_loadFrame, batches, itertools.repeat(start), itertools.repeat(end))
+
+        parts = []
+        units_dict = None
+        for frame, units, errors in results:
+            for error in errors:
+                print(error)
+            units_dict = units_dict or units
+            if frame is not None:
+                parts.append(frame)
+
+        if not parts:
+            return None, units_dict
+        if len(parts) == 1:
+            return parts[0], units_dict
+        import pandas as pd
+        return pd.concat(parts, ignore_index=True), units_dict
+
+    @timed("archive_load")
+    def archiveFilesToDataFrame(self):
+        file_paths = self.recordFilePaths() if self.segmentStore is None and self.workers > 1 else ()
+        if len(file_paths) >= PARALLEL_MIN_FILES:
+            df, units_dict = self.parallelLoad(file_paths)
+        else:
+            chunks = []
+            units_dict = None
+            for chunk, units in self.iterChunks(CHUNK_ROWS):
+                chunks.append(chunk)
+                units_dict = units_dict or units
+
+            if not chunks:
+                df = None
+            elif len(chunks) == 1:
+                df = chunks[0]
+            else:
+                import pandas as pd
+                df = pd.concat(chunks, ignore_index=True)
 
-        # Convert the list of sensor data to a DataFrame
-        df = pd.DataFrame(all_data) if all_data else None
+        # Files are read in name order, and bundles sort ahead of records by
+        # name while overlapping them in time
+        if df is not None and "timestamp" in df and not df["timestamp"].is_monotonic_increasing:
+            df = df.sort_values("timestamp", kind="stable", ignore_index=True)
 
         self.dataFrame = df
         self.unitsDict = units_dict
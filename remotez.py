@@ -0,0 +1,651 @@
+import os
+import queue
+import socket
+import tarfile
+import threading
+import time
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import metricz
+from metricz import timed
+from recordz import REMOTE_HOST, REMOTE_UN, REMOTE_DIR, sourceRemoteDir
+from codecz import RECORD_PATTERN, recordSpan, writeBundle
+from manifestz import Manifest, checksum, makeEntries
+
+
+UPLOAD_CONCURRENCY = 2 # [transfers] in flight at once
+RETRY_DELAY = 1 # [s] first retry after a failed upload, doubles up to MAX_RETRY_DELAY
+MAX_RETRY_DELAY = 300 # [s]
+PARTIAL_SUFFIX = ".part"
+PROBE_INTERVAL = 30 # [s] between probes while RangerLab answers
+MAX_PROBE_INTERVAL = 300 # [s] probes back off up to this while it doesn't
+PROBE_TIMEOUT = 3 # [s]
+FETCH_PARALLEL = 4 # [transfers] in flight at once when fetching the archive
+BUNDLE_MAX = 1 # [records] per upload, more packs whatever is queued into one bundle
+BUNDLE_COMPRESSION = "gzip"
+
+class SftpPool:
+    """
+    One SSH connection to RangerLab, shared by up to `size` SFTP sessions that
+    are handed out and returned instead of logging in for every transfer. A
+    session that fails is thrown away, and the connection is reopened the next
+    time one is needed.
+    """
+
+    def __init__(self, host=REMOTE_HOST, username=REMOTE_UN, port=22, size=UPLOAD_CONCURRENCY,
+                 timeout=5, **connectKwargs):
+        self.host = host
+        self.username = username
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.connectKwargs = connectKwargs
+
+        self._ssh = None
+        self._idle = queue.LifoQueue()
+        self._slots = threading.Semaphore(size)
+        self._lock = threading.Lock()
+        self.connects = 0
+
+    def _client(self):
+        with self._lock:
+            transport = self._ssh.get_transport() if self._ssh is not None else None
+            if transport is None or not transport.is_active():
+                self._reset()
+                # Imported on first connect, on the LinkMonitor's or an uploader's
+                # thread, so the central doesn't wait on it to start reading
+                import paramiko
+                ssh = paramiko.SSHClient()
+                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # Auto-accept unknown keys
+                ssh.connect(
+                    hostname=self.host,
+                    port=self.port,
+                    username=self.username,
+                    timeout=self.timeout,
+                    **self.connectKwargs,
+                )
+                transport = ssh.get_transport()
+                transport.set_keepalive(30)
+                # SFTP is request/response, don't let Nagle hold back the small requests
+                transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self._ssh = ssh
+                self.connects += 1
+                metricz.inc("sftp_connects_total", help="SSH logins to RangerLab")
+            return self._ssh
+
+    def _reset(self):
+        # Sessions from a dead connection are useless, drop them all
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+            except Exception:
+                pass
+        if self._ssh is not None:
+            self._ssh.close()
+            self._ssh = None
+
+    def isConnected(self):
+        transport = self._ssh.get_transport() if self._ssh is not None else None
+        return transport is not None and transport.is_active()
+
+    @contextmanager
+    def session(self):
+        self._slots.acquire()
+        sftp = None
+        try:
+            try:
+                sftp = self._idle.get_nowait()
+                if sftp.get_channel().closed:
+                    sftp = None
+            except queue.Empty:
+                pass
+
+            if sftp is None:
+                sftp = self._client().open_sftp()
+
+            yield sftp
+
+            self._idle.put(sftp)
+        except Exception:
+            if sftp is not None:
+                try:
+                    sftp.close()
+                except Exception:
+                    pass
+            raise
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            self._reset()
+
+class LinkMonitor:
+    """
+    Watches whether RangerLab is reachable from a background thread, so callers
+    read a cached answer instead of logging in over SSH every time they ask.
+    A probe is a TCP connect that waits for the SSH banner, skipped entirely
+    while the SftpPool already holds a live, keepalive'd connection. Probes
+    back off while the server is down.
+    """
+
+    def __init__(self, host=REMOTE_HOST, port=22, pool=None, interval=PROBE_INTERVAL,
+                 maxInterval=MAX_PROBE_INTERVAL, timeout=PROBE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.pool = pool
+        self.interval = interval
+        self.maxInterval = maxInterval
+        self.timeout = timeout
+
+        self.reachable = None   # None until the first probe finishes
+        self.checkedAt = None   # time.time() of the last probe
+        self.changedAt = None   # time.time() reachable last flipped
+        self.failures = 0       # consecutive failed probes
+        self.lastError = None
+
+        self._up = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        metricz.watch("rangerlab_reachable", lambda: self.reachable, "1 while RangerLab answers")
+        metricz.watch("rangerlab_probe_failures", lambda: self.failures, "Failed probes in a row")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="link-monitor", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def state(self):
+        """
+        Returns (reachable, checkedAt) from the last probe.
+        """
+        return bool(self.reachable), self.checkedAt
+
+    def wait(self, timeout=None):
+        """
+        Blocks until RangerLab is reachable, returns False on timeout.
+        """
+        return self._up.wait(timeout)
+
+    @timed("link_probe")
+    def probe(self):
+        if self.pool is not None and self.pool.isConnected():
+            return True
+
+        try:
+            with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+                banner = sock.recv(64)
+        except OSError as e:
+            self.lastError = str(e)
+            return False
+
+        if not banner.startswith(b"SSH-"):
+            self.lastError = f"Unexpected banner {banner!r}"
+            return False
+        return True
+
+    def _update(self, reachable):
+        now = time.time()
+        if reachable != self.reachable:
+            self.changedAt = now
+            print(f"Ranger Lab Reachable: {reachable}")
+        self.reachable = reachable
+        self.checkedAt = now
+
+        if reachable:
+            self.failures = 0
+            self.lastError = None
+            self._up.set()
+        else:
+            self.failures += 1
+            self._up.clear()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._update(self.probe())
+            if self.reachable:
+                delay = self.interval
+            else:
+                delay = min(self.interval * 2 ** (self.failures - 1), self.maxInterval)
+            self._stop.wait(delay)
+
+class UploadWorker:
+    """
+    Long lived uploader for finished record files. Files are queued with
+    submit(), and `concurrency` threads push them through the shared SftpPool.
+    Each file is written under a temporary name and renamed into place, so
+    RangerLab never sees half a record. Failed uploads back off and retry,
+    and the local file is only removed once it has landed. With a LinkMonitor,
+    uploads wait for RangerLab to come back instead of failing against it.
+
+    With bundleMax above 1, records that are already queued together, like the
+    backlog after the link comes back, go up as one compressed bundle of up to
+    bundleMax records instead of a transfer each. Nothing waits to fill one.
+
+    With manifest set, every file that lands is added to its directory's
+    manifestz.Manifest, if the directory has one, and directories the worker
+    makes itself start with an empty one.
+    """
+
+    def __init__(self, pool=None, remoteDir=REMOTE_DIR, concurrency=UPLOAD_CONCURRENCY,
+                 deleteAfterUpload=True, linkMonitor=None, bundleMax=BUNDLE_MAX,
+                 bundleCompression=BUNDLE_COMPRESSION, manifest=True):
+        self.pool = pool if pool is not None else SftpPool(size=concurrency)
+        self.linkMonitor = linkMonitor
+        self.remoteDir = remoteDir
+        self.concurrency = concurrency
+        self.deleteAfterUpload = deleteAfterUpload
+        self.bundleMax = bundleMax
+        self.bundleCompression = bundleCompression
+        self.manifest = manifest
+
+        self.queue = queue.Queue()
+        self._threads = []
+        self._running = False
+        self._remoteDirs = set()
+        self._manifests = {}    # remoteDir -> Manifest
+        self._failures = 0
+        self._lock = threading.Lock()
+
+        self.files = 0
+        self.bytes = 0
+        self.bundled = 0    # records that went up inside a bundle
+        self.busySeconds = 0.0
+        self._active = 0
+        self._busySince = None
+        self.failed = 0
+
+        metricz.watch("upload_queue_depth", self.pending, "Records waiting to be uploaded",
+                      remote_dir=self.remoteDir)
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._work, name=f"upload-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, localPath, remoteDir=None, done=None):
+        """
+        Queues localPath for upload. done(localPath) is called once it has landed.
+        """
+        self.queue.put((localPath, remoteDir or self.remoteDir, done))
+
+    def submitDir(self, localDir, remoteDir=None, skip=()):
+        """
+        Queues every file left in localDir, e.g. records an earlier run failed
+        to upload, except the paths in skip, which are queued already.
+        """
+        if not os.path.isdir(localDir):
+            return 0
+        skip = {os.path.abspath(path) for path in skip}
+        files = sorted(f for f in os.listdir(localDir)
+                       if os.path.isfile(os.path.join(localDir, f)) and not f.endswith(PARTIAL_SUFFIX)
+                       and os.path.abspath(os.path.join(localDir, f)) not in skip)
+        for f in files:
+            self.submit(os.path.join(localDir, f), remoteDir)
+        return len(files)
+
+    def pending(self):
+        return self.queue.unfinished_tasks
+
+    def join(self):
+        self.queue.join()
+
+    def stop(self, timeout=None):
+        # Give queued uploads up to `timeout` seconds to land, whatever is left
+        # stays in outRecords for submitDir() on the next start
+        deadline = None if timeout is None else time.time() + timeout
+        while self.pending() and (deadline is None or time.time() < deadline):
+            time.sleep(0.1)
+        self._running = False
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.pool.close()
+        metricz.unwatch("upload_queue_depth", remote_dir=self.remoteDir)
+
+    def throughput(self):
+        """
+        Returns (files/s, MB/s) measured over the wall time with transfers in flight.
+        """
+        if self.busySeconds == 0:
+            return 0.0, 0.0
+        return self.files / self.busySeconds, self.bytes / 1e6 / self.busySeconds
+
+    def manifestFor(self, remoteDir):
+        with self._lock:
+            manifest = self._manifests.get(remoteDir)
+            if manifest is None:
+                manifest = self._manifests[remoteDir] = Manifest(remoteDir)
+            return manifest
+
+    def _ensureRemoteDir(self, sftp, remoteDir):
+        if remoteDir in self._remoteDirs:
+            return
+        try:
+            sftp.stat(remoteDir)
+        except IOError:
+            sftp.mkdir(remoteDir)
+            if self.manifest:
+                # Nothing in it yet, so an empty manifest already indexes all of it
+                self.manifestFor(remoteDir).create(sftp)
+        self._remoteDirs.add(remoteDir)
+
+    def _transferStarted(self):
+        with self._lock:
+            if self._active == 0:
+                self._busySince = time.perf_counter()
+            self._active += 1
+
+    def _transferEnded(self):
+        with self._lock:
+            self._active -= 1
+            if self._active == 0:
+                self.busySeconds += time.perf_counter() - self._busySince
+
+    @timed("upload")
+    def _upload(self, localPath, remoteDir, name=None, records=None):
+        name = name or os.path.basename(localPath)
+        final_path = posixpath.join(remoteDir, name)
+        partial_path = final_path + PARTIAL_SUFFIX
+        crc = None
+        if self.manifest:
+            with open(localPath, "rb") as f:
+                crc = checksum(f)
+
+        self._transferStarted()
+        try:
+            with self.pool.session() as sftp:
+                self._ensureRemoteDir(sftp, remoteDir)
+                attr = sftp.put(localPath, partial_path)
+                sftp.posix_rename(partial_path, final_path)
+                if crc is not None:
+                    # A failure here retries the upload, which adds it again
+                    entries = makeEntries(name, attr.st_size, attr.st_mtime, crc, records)
+                    self.manifestFor(remoteDir).add(sftp, entries)
+        finally:
+            self._transferEnded()
+
+        size = os.path.getsize(localPath)
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+        metricz.inc("uploaded_files_total", help="Records landed on RangerLab")
+        metricz.inc("uploaded_bytes_total", size, help="Bytes of records landed on RangerLab")
+
+    def _takeBundle(self, first):
+        """
+        Takes up to bundleMax - 1 more queued records to go up with first.
+        """
+        localPath, remoteDir, _ = first
+        if self.bundleMax <= 1 or not RECORD_PATTERN.match(os.path.basename(localPath)):
+            return []
+        items = []
+        while len(items) < self.bundleMax - 1:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if (item is None or item[1] != remoteDir
+                    or not RECORD_PATTERN.match(os.path.basename(item[0]))):
+                # Not for this bundle, back in line
+                self.queue.put(item)
+                self.queue.task_done()
+                break
+            items.append(item)
+        return items
+
+    def _uploadBundle(self, items, remoteDir):
+        paths = [localPath for localPath, _, _ in items if os.path.isfile(localPath)]
+        if not paths:
+            return
+        # .part so submitDir never picks up a bundle left by a crash
+        bundle_path = os.path.join(os.path.dirname(paths[0]), f"bundle-{threading.get_ident()}{PARTIAL_SUFFIX}")
+        try:
+            name = writeBundle(paths, bundle_path, self.bundleCompression)
+            self._upload(bundle_path, remoteDir, name, [os.path.basename(path) for path in paths])
+        finally:
+            if os.path.exists(bundle_path):
+                os.remove(bundle_path)
+        with self._lock:
+            self.bundled += len(paths)
+        metricz.inc("bundled_records_total", len(paths), help="Records uploaded inside a bundle")
+
+    def _done(self, done, localPath):
+        try:
+            done(localPath)
+        except Exception as e:
+            print(f"Upload callback for {localPath} failed: {e}")
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+
+            localPath, remoteDir, done = item
+            if self.linkMonitor is not None and self.linkMonitor.reachable is False:
+                self.linkMonitor.wait(MAX_RETRY_DELAY)
+            items = [item] + self._takeBundle(item)
+
+            try:
+                if len(items) > 1:
+                    self._uploadBundle(items, remoteDir)
+                elif os.path.isfile(localPath):
+                    self._upload(localPath, remoteDir)
+                for localPath, _, done in items:
+                    if self.deleteAfterUpload and os.path.isfile(localPath):
+                        os.remove(localPath)
+                    if done is not None:
+                        self._done(done, localPath)
+                with self._lock:
+                    self._failures = 0
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                    self._failures += 1
+                    delay = min(RETRY_DELAY * 2 ** (self._failures - 1), MAX_RETRY_DELAY)
+                metricz.inc("upload_failures_total", help="Upload attempts that failed and were retried")
+                what = localPath if len(items) == 1 else f"a bundle of {len(items)} records"
+                print(f"Upload of {what} failed ({e}), retrying in {delay:.0f} s")
+                if self._running:
+                    time.sleep(delay)
+                    for each in items:
+                        self.queue.put(each)
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+class ArchiveFetcher:
+    """
+    Lists and downloads archived records over a single SSH connection. Files
+    come down over `parallel` SFTP sessions at once, or with singleStream as
+    one tar stream, which is far quicker for thousands of small records.
+    Ranges are looked up in the directory's manifest when it has one, so they
+    cost the same however many records it holds, and listed otherwise. With a
+    source, the records are those one peripheral's LiveRecords uploaded, in
+    its subdirectory of remoteDir.
+    """
+
+    def __init__(self, pool=None, remoteDir=REMOTE_DIR, parallel=FETCH_PARALLEL, progress=None,
+                 useManifest=True, source=None):
+        self.pool = pool if pool is not None else SftpPool(size=parallel)
+        self._ownPool = pool is None
+        self.remoteDir = sourceRemoteDir(source, remoteDir)
+        self.manifest = Manifest(self.remoteDir) if useManifest else None
+        self.parallel = parallel
+        # progress(done, total, bytes) is called after each file lands
+        self.progress = progress
+        self._lock = threading.Lock()
+        self.resetStats()
+
+    def close(self):
+        """
+        Closes the SSH connection if the fetcher opened it, a pool passed in
+        is left to its owner.
+        """
+        if self._ownPool:
+            self.pool.close()
+
+    def resetStats(self):
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.errors = 0
+
+    def stats(self):
+        """
+        Returns a dict with counts and throughput of everything fetched since resetStats().
+        """
+        seconds = self.seconds or float("nan")
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "seconds": self.seconds,
+            "files_per_s": self.files / seconds,
+            "mb_per_s": self.bytes / 1e6 / seconds,
+        }
+
+    def listRecordAttrs(self, start, end):
+        """
+        (name, size, mtime) of remote records whose first timestamp falls within
+        [start, end], both given as YYYYmmddHHMMSS, and of bundles carrying one.
+        Without a manifest, any bundle that overlaps the range.
+        """
+        with self.pool.session() as sftp:
+            entries = self.manifest.lookup(sftp, start, end) if self.manifest is not None else None
+            if entries is not None:
+                return [(name, size, mtime) for _, _, name, size, mtime, _ in entries]
+            attrs = sftp.listdir_attr(self.remoteDir)
+
+        start, end = int(start), int(end)
+        matches = []
+        for attr in attrs:
+            span = recordSpan(attr.filename)
+            if span and span[0] <= end and span[1] >= start:
+                matches.append((attr.filename, attr.st_size, attr.st_mtime))
+        return sorted(matches)
+
+    def listRecords(self, start, end):
+        return [name for name, _, _ in self.listRecordAttrs(start, end)]
+
+    def fetchIfChanged(self, name, localDir):
+        """
+        Downloads one file unless the local copy already matches its remote size
+        and mtime. Returns the local path.
+        """
+        local_path = os.path.join(localDir, name)
+        with self.pool.session() as sftp:
+            attr = sftp.stat(posixpath.join(self.remoteDir, name))
+            try:
+                st = os.stat(local_path)
+                if st.st_size == attr.st_size and int(st.st_mtime) == int(attr.st_mtime):
+                    return local_path
+            except OSError:
+                pass
+
+            os.makedirs(localDir, exist_ok=True)
+            sftp.get(posixpath.join(self.remoteDir, name), local_path + PARTIAL_SUFFIX)
+        os.replace(local_path + PARTIAL_SUFFIX, local_path)
+        os.utime(local_path, (attr.st_mtime, attr.st_mtime))
+        return local_path
+
+    def _landed(self, total, size):
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            done = self.files
+        if self.progress is not None:
+            self.progress(done, total, size)
+
+    @timed("fetch_file")
+    def _fetchOne(self, name, localDir, total):
+        local_path = os.path.join(localDir, name)
+        partial_path = local_path + PARTIAL_SUFFIX
+        try:
+            with self.pool.session() as sftp:
+                sftp.get(posixpath.join(self.remoteDir, name), partial_path)
+            os.replace(partial_path, local_path)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            metricz.inc("fetch_errors_total", help="Archive files that failed to download")
+            print(f"Error copying {name}: {e}")
+            return
+        self._landed(total, os.path.getsize(local_path))
+
+    def fetch(self, names, localDir, singleStream=False):
+        os.makedirs(localDir, exist_ok=True)
+        start = time.perf_counter()
+
+        if singleStream:
+            self._fetchTar(names, localDir)
+        elif self.parallel <= 1:
+            for name in names:
+                self._fetchOne(name, localDir, len(names))
+        else:
+            with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+                for name in names:
+                    executor.submit(self._fetchOne, name, localDir, len(names))
+
+        self.seconds += time.perf_counter() - start
+
+    def _fetchTar(self, names, localDir):
+        # Remote tar reads the file list from stdin, so the command line stays
+        # short no matter how many records are asked for
+        wanted = set(names)
+        extracted = set()
+        channel = self.pool._client().get_transport().open_session()
+        try:
+            channel.exec_command(f"tar -C '{self.remoteDir}' -cf - -T -")
+            channel.sendall("".join(name + "\n" for name in names).encode())
+            channel.shutdown_write()
+
+            with tarfile.open(fileobj=channel.makefile("rb"), mode="r|") as tar:
+                for member in tar:
+                    name = os.path.basename(member.name)
+                    if not member.isfile() or name not in wanted:
+                        continue
+                    source = tar.extractfile(member)
+                    local_path = os.path.join(localDir, name)
+                    with open(local_path + PARTIAL_SUFFIX, "wb") as f:
+                        while True:
+                            chunk = source.read(1 << 16)
+                            if not chunk:
+                                break
+                            f.write(chunk)
+                    os.replace(local_path + PARTIAL_SUFFIX, local_path)
+                    extracted.add(name)
+                    self._landed(len(names), member.size)
+
+            status = channel.recv_exit_status()
+            if status != 0:
+                self.errors += 1
+                print(f"Remote tar exited with status {status}")
+            # tar skips files it can't read, only the names that came out count
+            missing = wanted - extracted
+            if missing:
+                self.errors += len(missing)
+                metricz.inc("fetch_errors_total", len(missing), help="Archive files that failed to download")
+                print(f"Tar stream is missing {len(missing)} of {len(wanted)} records, e.g. {min(missing)}")
+        finally:
+            channel.close()
@@ -0,0 +1,189 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from segmentz import writeSegment, mapSegment
+from codecz import isRecordFile, readRows
+
+
+# Bucket width per rollup tier, coarsest last. Buckets are aligned to UTC.
+TIERS = {
+    "hour": 60*60,
+    "day": 60*60*24,
+}
+STATS = ("min", "max", "sum", "count")
+INGESTED_NAME = ".rollup-ingested.json"
+
+def tierFileName(tier):
+    return f"rollup.{tier}.seg"
+
+def pickTier(resolution):
+    """
+    Coarsest tier whose buckets are no wider than resolution seconds, or None
+    when only raw samples will do.
+    """
+    best = None
+    for tier, width in TIERS.items():
+        if width <= resolution and (best is None or width > TIERS[best]):
+            best = tier
+    return best
+
+def rollUp(dataFrame, width):
+    """
+    min/max/sum/count per sensor per bucket, one row per bucket keyed by the
+    bucket's start time.
+    """
+    numeric = dataFrame.select_dtypes("number")
+    sensors = [column for column in numeric.columns if column != "timestamp"]
+    buckets = (dataFrame["timestamp"].to_numpy() // width * width).astype(np.float64)
+
+    grouped = numeric[sensors].groupby(buckets).agg(list(STATS))
+    grouped.columns = [f"{sensor}_{stat}" for sensor, stat in grouped.columns]
+    grouped.index.name = "timestamp"
+    return grouped
+
+def mergeRollups(old, new):
+    """
+    Folds one rollup into another, bucket by bucket.
+    """
+    if old is None or old.empty:
+        return new
+    both = pd.concat([old, new])
+    merged = {}
+    for column in both.columns:
+        stat = column.rsplit("_", 1)[1]
+        grouped = both[column].groupby(level=0)
+        if stat == "min":
+            merged[column] = grouped.min()
+        elif stat == "max":
+            merged[column] = grouped.max()
+        else:
+            merged[column] = grouped.sum(min_count=1)
+    return pd.DataFrame(merged).sort_index()
+
+class RollupStore:
+    """
+    Hourly and daily min/max/mean/count per sensor, kept in the same directory
+    as the raw records they summarize. New record files are folded in as they
+    arrive, so a year of history is a few thousand rows to read.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.ingestedPath = os.path.join(directory, INGESTED_NAME)
+        self.ingested = set(self._loadIngested())
+
+    def _loadIngested(self):
+        try:
+            with open(self.ingestedPath, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _saveIngested(self):
+        partial_path = self.ingestedPath + ".part"
+        with open(partial_path, "w") as f:
+            json.dump(sorted(self.ingested), f)
+        os.replace(partial_path, self.ingestedPath)
+
+    def tierPath(self, tier):
+        return os.path.join(self.directory, tierFileName(tier))
+
+    def readTier(self, tier):
+        path = self.tierPath(tier)
+        if not os.path.exists(path):
+            return None, {}
+        header, columns = mapSegment(path)
+        frame = pd.DataFrame({name: np.array(values) for name, values in columns.items()})
+        return frame.set_index("timestamp"), header["units"]
+
+    def update(self, dataFrame, units=None):
+        if dataFrame is None or dataFrame.empty:
+            return
+        for tier, width in TIERS.items():
+            old, old_units = self.readTier(tier)
+            merged = mergeRollups(old, rollUp(dataFrame, width))
+            writeSegment(self.tierPath(tier), merged.reset_index(), {**old_units, **(units or {})})
+
+    def updateRecordFiles(self, file_paths=None):
+        """
+        Folds in record files that haven't been rolled up yet, by default every
+        record in the directory. Returns how many were added.
+        """
+        if file_paths is None:
+            file_paths = [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                          if isRecordFile(name)]
+
+        rows = []
+        units = {}
+        names = []
+        for file_path in file_paths:
+            name = os.path.basename(file_path)
+            if name in self.ingested:
+                continue
+            try:
+                records = readRows(file_path)
+            except Exception as e:
+                print(f"Error reading {file_path}: {e}")
+                continue
+            for record_rows, record_units in records:
+                rows.extend(record_rows)
+                units.update(record_units)
+            names.append(name)
+
+        if rows:
+            self.update(pd.DataFrame(rows), units)
+        if names:
+            self.ingested.update(names)
+            self._saveIngested()
+        return len(names)
+
+def _tierFrame(timestamps, column, sensors):
+    # column(name) is that stat's values for the buckets in timestamps
+    frame = {"timestamp": np.array(timestamps)}
+    for sensor in sensors:
+        count = np.array(column(f"{sensor}_count"))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frame[sensor] = np.array(column(f"{sensor}_sum")) / count
+        frame[f"{sensor}_min"] = np.array(column(f"{sensor}_min"))
+        frame[f"{sensor}_max"] = np.array(column(f"{sensor}_max"))
+        frame[f"{sensor}_count"] = count
+    return pd.DataFrame(frame)
+
+def loadTier(path, start=None, end=None, width=None):
+    """
+    Reads a rollup tier file into a DataFrame with one row per bucket: the
+    bucket start as timestamp, each sensor's mean under its own name (so the
+    plots work unchanged), plus <sensor>_min, <sensor>_max and <sensor>_count.
+    Buckets overlapping start..end are kept, width being the tier's bucket
+    width; without one, only buckets that start within it.
+    """
+    header, columns = mapSegment(path)
+    timestamps = columns["timestamp"]
+    if start is not None and width:
+        # The bucket holding start begins at its floor, before start itself
+        start = start // width * width
+    lo = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+    hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side="right"))
+
+    sensors = [column["name"][:-len("_count")] for column in header["columns"]
+               if column["name"].endswith("_count")]
+    return _tierFrame(timestamps[lo:hi], lambda name: columns[name][lo:hi], sensors), header["units"]
+
+def newestBucket(path):
+    """
+    Start of the last bucket in a rollup tier file, None if it has none. That
+    bucket may still have been filling when the file was built, and samples
+    after it haven't been rolled up at all.
+    """
+    _, columns = mapSegment(path)
+    timestamps = columns["timestamp"]
+    return float(timestamps[-1]) if len(timestamps) else None
+
+def rollUpFrame(dataFrame, width):
+    """
+    Raw samples rolled up into buckets width seconds wide, in loadTier's shape.
+    """
+    grouped = rollUp(dataFrame, width)
+    sensors = [name[:-len("_count")] for name in grouped.columns if name.endswith("_count")]
+    return _tierFrame(grouped.index.to_numpy(), lambda name: grouped[name].to_numpy(), sensors)
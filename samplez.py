@@ -0,0 +1,171 @@
+import math
+import time
+import metricz
+
+
+MIN_INTERVAL = 15 # [s] between reads while values are moving, e.g. during watering
+MAX_INTERVAL = 300 # [s] between reads once they have been flat for a while, also how late a change can be noticed
+BACKOFF = 1.5 # interval grows by this much after every read that didn't move
+HEARTBEAT = 900 # [s] longest a sensor goes without a kept sample, however flat
+UNIT_DEADBANDS = { # change that counts as movement, by unit, for sensors without their own
+    "F": 0.5,
+    "C": 0.3,
+    "%": 1.0,
+}
+
+class AdaptiveSampler:
+    """
+    Decides how long the central waits before its next read, and which samples
+    are worth keeping. A sample is kept when any sensor has moved more than its
+    deadband since the last kept one, otherwise it's coalesced into that one
+    (dropped and counted), except once every heartbeat seconds. When something
+    does move, the last coalesced sample is kept too, so the record shows where
+    the flat stretch ended instead of a slope across it. A read where
+    something moved sets the interval to about how long it took to move one
+    deadband, so slow drift is read slowly and watering quickly, down to
+    minInterval. Every read where nothing moved stretches it by backoff, up to
+    maxInterval. Sensors without a deadband of their own fall
+    back to their unit's, and any change at all counts for ones with neither.
+
+    The same settings can be written to SensorService.settings["sampling"] as
+    {"min": s, "max": s, "backoff": x, "heartbeat": s, "deadband": {sensor or unit: band}},
+    see configure(). address labels its interval gauge when one central samples
+    several peripherals.
+    """
+
+    def __init__(self, minInterval=MIN_INTERVAL, maxInterval=MAX_INTERVAL, backoff=BACKOFF,
+                 heartbeat=HEARTBEAT, deadband=None, unitDeadbands=UNIT_DEADBANDS, address=None):
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.backoff = backoff
+        self.heartbeat = heartbeat
+        self.deadband = dict(deadband or {})
+        self.unitDeadbands = dict(unitDeadbands)
+        self.interval = minInterval
+
+        self.kept = None        # last kept sample
+        self.keptAt = None
+        self.held = None        # last coalesced sample since then
+        self.offered = 0
+        self.coalesced = 0
+
+        labels = {} if address is None else {"address": address}
+        metricz.watch("sample_interval_seconds", lambda: self.interval, "Current wait between sensor reads", **labels)
+
+    def configure(self, settings):
+        """
+        Applies SensorService.settings["sampling"], or the settings dict that
+        holds it. Keys that are missing keep their current value.
+        """
+        if not settings:
+            return
+        settings = settings.get("sampling", settings)
+        self.minInterval = float(settings.get("min", self.minInterval))
+        self.maxInterval = max(float(settings.get("max", self.maxInterval)), self.minInterval)
+        self.backoff = max(float(settings.get("backoff", self.backoff)), 1.0)
+        self.heartbeat = float(settings.get("heartbeat", self.heartbeat))
+        for name, band in settings.get("deadband", {}).items():
+            if name in self.unitDeadbands:
+                self.unitDeadbands[name] = float(band)
+            else:
+                self.deadband[name] = float(band)
+        self.interval = min(max(self.interval, self.minInterval), self.maxInterval)
+
+    def band(self, sensor, units=None):
+        band = self.deadband.get(sensor)
+        if band is None and units:
+            band = self.unitDeadbands.get(units.get(sensor))
+        return band or 0.0
+
+    def movement(self, sample, units=None):
+        """
+        How far the sample is from the last kept one, in deadbands: 1 or more
+        means some sensor left its band.
+        """
+        if self.kept is None:
+            return math.inf
+        moved = 0.0
+        for sensor, value in sample.items():
+            if sensor == "timestamp" or not isinstance(value, (int, float)):
+                continue
+            last = self.kept.get(sensor)
+            if last is None:
+                return math.inf
+            change = abs(value - last)
+            band = self.band(sensor, units)
+            if band > 0:
+                moved = max(moved, change / band)
+            elif change > 0:
+                return math.inf
+        return moved
+
+    def _take(self, sample, units):
+        # Returns (samples to keep, deadbands per second it moved at, 0 if it didn't)
+        now = sample.get("timestamp", time.time())
+        self.offered += 1
+        movement = self.movement(sample, units)
+
+        rate = 0.0
+        if movement >= 1:
+            elapsed = now - self.keptAt if self.keptAt is not None else 0
+            rate = movement / elapsed if elapsed > 0 else math.inf
+
+        if rate or now - self.keptAt >= self.heartbeat:
+            keep = [sample]
+            if rate and self.held is not None:
+                keep.insert(0, self.held)
+            elif self.held is not None:
+                self._drop()
+            self.kept = dict(sample)
+            self.keptAt = now
+            self.held = None
+            return keep, rate
+
+        if self.held is not None:
+            self._drop()
+        self.held = sample
+        return [], rate
+
+    def _drop(self):
+        self.coalesced += 1
+        metricz.inc("coalesced_samples_total", help="Samples within their deadband, dropped")
+
+    def _adapt(self, rate):
+        if rate:
+            self.interval = min(max(1 / rate, self.minInterval), self.maxInterval)
+        else:
+            self.interval = min(self.interval * self.backoff, self.maxInterval)
+
+    def offer(self, sample, units=None):
+        """
+        Returns the samples to keep now, oldest first: none, this one, or the
+        last coalesced one and this one. Sets the interval until the next read.
+        """
+        keep, rate = self._take(sample, units)
+        self._adapt(rate)
+        return keep
+
+    def filter(self, samples, units=None):
+        """
+        offer() for a batch from one read, e.g. from PackedSensorReader. The
+        interval moves once for the whole batch.
+        """
+        kept = []
+        fastest = 0.0
+        for sample in samples:
+            keep, rate = self._take(sample, units)
+            fastest = max(fastest, rate)
+            kept.extend(keep)
+        if samples:
+            self._adapt(fastest)
+        return kept
+
+def readSettings(service):
+    """
+    The peripheral's settings, or None when it has none or the read fails.
+    """
+    try:
+        return service.settings
+    except Exception as e:
+        print(f"Could not read peripheral settings: {e}")
+        return None
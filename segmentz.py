@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import struct
+import time
+import numpy as np
+import pandas as pd
+from codecz import readRows
+
+
+# Segment file layout, one file per UTC day:
+#   prefix: magic (4s), version (H), header length (I)
+#   header: JSON with the row count, min/max timestamp, units and one entry per
+#           column giving its name, numpy dtype and offset from the data start
+#   data:   each column as a contiguous fixed width array, aligned to ALIGN bytes
+MAGIC = b"RSEG"
+VERSION = 1
+PREFIX = "<4sHI"
+ALIGN = 64
+SEGMENT_PATTERN = re.compile(r"^segment\.([0-9]{8})\.seg$")
+INGESTED_NAME = ".ingested.json"
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+def _fixedWidth(values):
+    values = np.asarray(values)
+    if values.dtype.kind in "biuf":
+        return values
+    # Strings and mixed columns become fixed width unicode so they can be mapped too
+    return values.astype(str)
+
+def writeSegment(path, dataFrame, units=None):
+    columns = []
+    arrays = []
+    offset = 0
+    for name in dataFrame.columns:
+        array = np.ascontiguousarray(_fixedWidth(dataFrame[name].to_numpy()))
+        columns.append({"name": name, "dtype": array.dtype.str, "offset": offset})
+        arrays.append(array)
+        offset = _aligned(offset + array.nbytes)
+
+    timestamps = dataFrame["timestamp"].to_numpy()
+    header = json.dumps({
+        "rows": len(dataFrame),
+        "min_ts": float(timestamps.min()),
+        "max_ts": float(timestamps.max()),
+        "units": units or {},
+        "columns": columns,
+    }).encode("utf-8")
+
+    data_start = _aligned(struct.calcsize(PREFIX) + len(header))
+
+    partial_path = path + ".part"
+    with open(partial_path, "wb") as f:
+        f.write(struct.pack(PREFIX, MAGIC, VERSION, len(header)))
+        f.write(header)
+        for column, array in zip(columns, arrays):
+            f.seek(data_start + column["offset"])
+            f.write(array.tobytes())
+    os.replace(partial_path, path)
+
+def readHeader(path):
+    with open(path, "rb") as f:
+        magic, version, header_len = struct.unpack(PREFIX, f.read(struct.calcsize(PREFIX)))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} segment")
+        header = json.loads(f.read(header_len))
+    header["data_start"] = _aligned(struct.calcsize(PREFIX) + header_len)
+    return header
+
+def mapSegment(path):
+    """
+    Returns (header, {column: read-only memmap}). Nothing is read until a column is touched.
+    """
+    header = readHeader(path)
+    columns = {}
+    for column in header["columns"]:
+        if header["rows"] == 0:
+            columns[column["name"]] = np.empty(0, dtype=column["dtype"])
+            continue
+        columns[column["name"]] = np.memmap(path, dtype=np.dtype(column["dtype"]), mode="r",
+                                            offset=header["data_start"] + column["offset"],
+                                            shape=(header["rows"],))
+    return header, columns
+
+class SegmentStore:
+    """
+    Records kept as per-day columnar segments instead of pretty printed JSON.
+    Loading maps the columns straight from disk, and a time range only touches
+    the days and rows it covers.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.ingestedPath = os.path.join(directory, INGESTED_NAME)
+        self.ingested = set(self._loadIngested())
+
+    def _loadIngested(self):
+        try:
+            with open(self.ingestedPath, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def markIngested(self, names):
+        self.ingested.update(names)
+        partial_path = self.ingestedPath + ".part"
+        with open(partial_path, "w") as f:
+            json.dump(sorted(self.ingested), f)
+        os.replace(partial_path, self.ingestedPath)
+
+    def segmentPath(self, day):
+        return os.path.join(self.directory, f"segment.{day}.seg")
+
+    def days(self):
+        days = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                days.append(match.group(1))
+        return sorted(days)
+
+    def append(self, dataFrame, units=None):
+        """
+        Merges samples into their day segments, replacing any with the same timestamp.
+        """
+        if dataFrame is None or dataFrame.empty:
+            return
+
+        days = pd.to_datetime(dataFrame["timestamp"], unit="s", utc=True).dt.strftime("%Y%m%d")
+        for day, rows in dataFrame.groupby(days.to_numpy(), sort=False):
+            path = self.segmentPath(day)
+            day_units = dict(units or {})
+            if os.path.exists(path):
+                header, columns = mapSegment(path)
+                existing = pd.DataFrame({name: np.array(values) for name, values in columns.items()})
+                rows = pd.concat([existing, rows], ignore_index=True)
+                day_units = {**header["units"], **day_units}
+
+            rows = (rows.drop_duplicates(subset="timestamp", keep="last")
+                        .sort_values("timestamp", kind="stable")
+                        .reset_index(drop=True))
+            writeSegment(path, rows, day_units)
+
+    def appendRecordFiles(self, file_paths):
+        """
+        Folds record or bundle files in, rewriting each day they touch once. Returns
+        the names that were read.
+        """
+        rows = []
+        units = {}
+        names = []
+        for file_path in file_paths:
+            try:
+                records = readRows(file_path)
+            except Exception as e:
+                print(f"Error reading {file_path}: {e}")
+                continue
+            for record_rows, record_units in records:
+                rows.extend(record_rows)
+                units.update(record_units)
+            names.append(os.path.basename(file_path))
+
+        if rows:
+            self.append(pd.DataFrame(rows), units)
+        return names
+
+    def iterChunks(self, start=None, end=None, chunkRows=None):
+        """
+        Yields (DataFrame, units) of the samples with start <= timestamp <= end,
+        epoch seconds, either bound optional. One chunk per day, or pieces of
+        chunkRows rows, each a view of the mapped file.
+        """
+        first_day = time.strftime("%Y%m%d", time.gmtime(start)) if start is not None else None
+        last_day = time.strftime("%Y%m%d", time.gmtime(end)) if end is not None else None
+
+        for day in self.days():
+            if (first_day and day < first_day) or (last_day and day > last_day):
+                continue
+
+            header, columns = mapSegment(self.segmentPath(day))
+            timestamps = columns["timestamp"]
+            lo = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+            hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side="right"))
+            step = chunkRows or max(hi - lo, 1)
+
+            for chunk_lo in range(lo, hi, step):
+                chunk_hi = min(chunk_lo + step, hi)
+                yield (pd.DataFrame({name: values[chunk_lo:chunk_hi] for name, values in columns.items()},
+                                    copy=False), header["units"])
+
+    def load(self, start=None, end=None):
+        """
+        Returns (DataFrame, units) of the samples with start <= timestamp <= end.
+        A single day comes back as views of the mapped file, no copy.
+        """
+        frames = []
+        units = {}
+        for frame, day_units in self.iterChunks(start, end):
+            frames.append(frame)
+            units.update(day_units)
+
+        if not frames:
+            return None, units
+        if len(frames) == 1:
+            return frames[0], units
+        return pd.concat(frames, ignore_index=True), units
@@ -6,60 +6,155 @@
 
 from ble_json_service import SensorService
 from adafruit_ble import BLERadio
-from adafruit_ble.advertising.standard import ProvideServicesAdvertisement
+import os
 import time
-from recordz import LiveRecord
+from recordz import Record, LiveRecord
 from displayz import Displayz
+from centralz import ConnectionManager, SensorSubscription, PackedSensorReader, HistoryReader, pollSensors
+from remotez import SftpPool, LinkMonitor, UploadWorker
+from walz import WriteAheadLog
+from samplez import AdaptiveSampler, readSettings
+from livez import LiveServer
+import livez
+import metricz
+from metricz import timer
 
 ble = BLERadio()
 connection = None
 
-LOG_CADENCE = 60*1.5 # [s]
+LOG_CADENCE = 60*1.5 # [s] first read interval, the sampler adapts it from there. Unused with notify.
 RECORD_LIFESPAN = 60*10 # [s]
+NOTIFY_TIMEOUT = 1 # [s] between connection checks while waiting on a pushed reading
+METRICS_PORT = metricz.METRICS_PORT # [port] Prometheus text at http://127.0.0.1:9464/metrics, None for no metrics
+LIVE_PORT = livez.LIVE_PORT # [port] every sample at ws://127.0.0.1:8765/live as it's taken in, None for no live server
 live_record = None
+# Reads faster while values move and backs off while they're flat, dropping
+# samples that stay within their deadband. Tuned from the peripheral's settings.
+sampler = AdaptiveSampler()
+sampler.interval = LOG_CADENCE
+# Last sample taken in from the peripheral and the boot it came from, so a
+# reconnect can backfill exactly what was missed from the peripheral's history
+last_boot = None
+last_sequence = None
 
-rpi_display = Displayz()
+if METRICS_PORT is not None:
+    metricz.enable()
+    metricz.serve(METRICS_PORT)
 
-while True:
-    if not connection:
-        print("Scanning for BLE device advertising our sensor service...")
-        for adv in ble.start_scan(ProvideServicesAdvertisement):
-            if SensorService in adv.services:
-                connection = ble.connect(adv)
-                print("Connected")
-                break
-        ble.stop_scan()
+# Pushes samples to any number of WebSocket clients from its own thread
+live_server = LiveServer(LIVE_PORT).start() if LIVE_PORT is not None else None
+
+# Black and white panel, so text changes can use the quick partial waveform
+rpi_display = Displayz(partialRefresh=True)
+
+# Reconnects straight to the last peripheral, and only scans when that fails
+connections = ConnectionManager(ble, onScan=lambda: rpi_display.dispRawText("Connected: False"))
+
+# One SSH connection to RangerLab, watched in the background so the loop never waits on it
+sftp_pool = SftpPool()
+link_monitor = LinkMonitor(pool=sftp_pool).start()
 
+# One long lived SFTP uploader for every record, starting with any a previous run left behind
+uploader = UploadWorker(sftp_pool, linkMonitor=link_monitor).start()
+
+# Every sample is logged to disk as it arrives, whatever a crash or power cut
+# left unsaved becomes a record again before anything new is logged
+wal = WriteAheadLog(os.path.join(Record().scriptDir, "wal")).start()
+recovered = LiveRecord.recover(wal, uploader=uploader, linkMonitor=link_monitor)
+uploader.submitDir(Record().outRecordsDir, skip=recovered)
+
+while True:
     if connection and not connection.connected:
+        metricz.inc("reconnects_total", help="Links that dropped and were reopened")
         if live_record is not None:
-            live_record.saveJsonToFile()
-            live_record.isLive = False
-        print("Scanning for BLE device advertising our sensor service...")
-        rpi_display.dispRawText("Connected: False")
-        for adv in ble.start_scan(ProvideServicesAdvertisement):
-            if SensorService in adv.services:
-                connection = ble.connect(adv)
-                print("Connected")
-                break
-        ble.stop_scan()
+            live_record.finish()
+            live_record = None
+
+    connection = connections.connect()
 
     if connection and connection.connected:
         service = connection[SensorService]
+        sampler.configure(readSettings(service))
+
+        history = HistoryReader.open(service)
+        if history is not None:
+            # Sequence numbers start over with every boot. If the peripheral
+            # restarted while away, all of its history is new to us.
+            pull_all = history.boot != last_boot and last_boot is not None
+            if history.boot != last_boot:
+                last_boot = history.boot
+                last_sequence = None
+            if last_sequence is not None or pull_all:
+                try:
+                    backfill = history.pull(last_sequence)
+                except Exception as e:
+                    print(f"Backfill failed: {e}")
+                    backfill = []
+                # Coalesced like live samples, or the deadband would be undone
+                # for everything sampled while away
+                kept = sampler.filter(backfill, history.units)
+                if kept:
+                    live_record = LiveRecord(RECORD_LIFESPAN, uploader=uploader, linkMonitor=link_monitor, wal=wal,
+                                             broadcaster=live_server)
+                    live_record.processSamples(kept, history.units)
+                if backfill:
+                    print(f"Backfilled {len(kept)} of {len(backfill)} samples missed while disconnected")
+                if history.lastSequence is not None:
+                    last_sequence = history.lastSequence
+
+        # Prefer the compact binary mode, then pushed JSON, then polled JSON
+        packed = PackedSensorReader.open(service, lastSequence=last_sequence)
+        subscription = None if packed is not None else SensorSubscription.open(service, lastSequence=last_sequence)
         while connection and connection.connected:
 
-            while connection.connected and service.sensors is None:
-                pass
-
-            if live_record is None:
-                live_record = LiveRecord(RECORD_LIFESPAN) 
-            
-            if live_record.isLive:
-                print("Ranger Lab Reachable: " + str(live_record.isRangerLabReachable("192.168.0.100")))
-                live_record.processMessage(service.sensors)
-                text_to_disp = "Connected: " + str(connection.connected) + "\n" + live_record.latestDataFrameToText()
-                print(text_to_disp)
-                rpi_display.dispRawText(text_to_disp)
+            if packed is not None:
+                # Everything the peripheral batched up since the last read
+                message = packed.read() or None
+                units = packed.units
+                if message is not None:
+                    message = sampler.filter(message, units) or None
+                if message is None:
+                    time.sleep(sampler.interval)
+            elif subscription is not None:
+                # Readings are pushed by the peripheral, no need to poll or sleep.
+                # They come at the peripheral's publish rate, not LOG_CADENCE, and
+                # every one is offered to the sampler, which keeps those that move.
+                with timer("notify_wait"):
+                    message = subscription.get(timeout=NOTIFY_TIMEOUT)
             else:
-                live_record = LiveRecord(RECORD_LIFESPAN)
+                message = pollSensors(connection, service)
+
+            if message is not None and packed is None:
+                # Stamped on arrival, like processMessage does, then kept or
+                # coalesced as samples the same way the packed ones are
+                units = message["sensor_units"]
+                message = sampler.offer(dict(message["sensor_data"], timestamp=time.time()), units) or None
+                if message is None and subscription is None:
+                    time.sleep(sampler.interval)
+
+            # Everything read has been seen, whatever the sampler kept of it, so
+            # a backfill after a reconnect doesn't pull the coalesced samples back
+            source = packed if packed is not None else subscription
+            if source is not None and source.lastSequence is not None:
+                last_sequence = source.lastSequence
+
+            if message is None:
+                continue
+
+            # A record that was finished takes no more samples, these go into a new one
+            if live_record is None or not live_record.isLive:
+                live_record = LiveRecord(RECORD_LIFESPAN, uploader=uploader, linkMonitor=link_monitor, wal=wal,
+                                         broadcaster=live_server)
+
+            reachable = link_monitor.state()[0]
+            print("Ranger Lab Reachable: " + str(reachable))
+            live_record.processSamples(message, units)
+            text_to_disp = "Connected: " + str(connection.connected) + "\n" + live_record.latestDataFrameToText()
+            print(text_to_disp)
+            rpi_display.dispRawText(text_to_disp)
+
+            if subscription is None:
+                time.sleep(sampler.interval)
 
-            time.sleep(LOG_CADENCE)
+        if subscription is not None:
+            subscription.close()
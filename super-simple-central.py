@@ -7,6 +7,8 @@
 from ble_json_service import SensorService
 from adafruit_ble import BLERadio
 from adafruit_ble.advertising.standard import ProvideServicesAdvertisement
+from centralz import SensorSubscription, POLL_INTERVAL
+import time
 
 
 ble = BLERadio()
@@ -25,5 +27,12 @@ while True:
     if connection and connection.connected:
         service = connection[SensorService]
         service.settings = {"unit": "celsius"}  #  'fahrenheit'
+        subscription = SensorSubscription.open(service)
         while connection.connected:
-            print("Sensors: ", service.sensors)
+            if subscription is not None:
+                message = subscription.get(timeout=1)
+                if message is not None:
+                    print("Sensors: ", message)
+            else:
+                print("Sensors: ", service.sensors)
+                time.sleep(POLL_INTERVAL)
@@ -0,0 +1,76 @@
+# Run from the repo root: python -m unittest discover tests
+
+import time
+import types
+import struct
+import unittest
+from ble_json_service import HISTORY_REQUEST, SampleHistory, SensorService, packSamples
+from centralz import HistoryReader, PackedSensorReader
+
+SCHEMA = {"version": 1, "fields": [["temp", "f"]], "units": {"temp": "F"}, "boot": 1}
+
+class _HistoryPeripheral:
+    """
+    Answers each sensorsHistory request as soon as it is written, with the
+    real SensorService.serveHistory().
+    """
+
+    def __init__(self, history):
+        self.sensorsSchema = SCHEMA
+        self.history = history
+        self._history = None
+
+    @property
+    def sensorsHistory(self):
+        return self._history
+
+    @sensorsHistory.setter
+    def sensorsHistory(self, value):
+        self._history = value
+        if value is not None and len(value) == struct.calcsize(HISTORY_REQUEST):
+            SensorService.serveHistory(self, self.history, time.monotonic())
+
+def _history(capacity, first, count):
+    history = SampleHistory(capacity, sequence=first)
+    for i in range(count):
+        history.append(time.monotonic(), {"temp": float(i)})
+    return history
+
+class SequenceWrapTest(unittest.TestCase):
+
+    def testPackedReadsAcrossWrap(self):
+        reader = PackedSensorReader(types.SimpleNamespace(sensorsSchema=SCHEMA), lastSequence=0xFFFD)
+        now = time.monotonic()
+        samples = [(now - 3 + i, {"temp": float(i)}) for i in range(4)]
+
+        # 0xFFFE, 0xFFFF, 0, 1
+        new = reader.decode(packSamples(SCHEMA, samples, 0xFFFE, now))
+        self.assertEqual([sample["temp"] for sample in new], [0.0, 1.0, 2.0, 3.0])
+        self.assertEqual(reader.lastSequence, 1)
+
+        # 0xFFFF, 0, 1, 2: only the last is new
+        samples = samples[1:] + [(now + 1, {"temp": 4.0})]
+        new = reader.decode(packSamples(SCHEMA, samples, 0xFFFF, now + 1))
+        self.assertEqual([sample["temp"] for sample in new], [4.0])
+        self.assertEqual(reader.lastSequence, 2)
+        self.assertEqual(reader.duplicates, 3)
+
+    def testHistoryPullAcrossWrap(self):
+        # Sequences 0xFFF0 through 0x00B7, several pages' worth
+        reader = HistoryReader(_HistoryPeripheral(_history(256, 0xFFF0, 200)))
+        self.assertLess(reader.capacity, 200)
+        samples = reader.pull(since=0xFFF5)
+        self.assertEqual([sample["temp"] for sample in samples], [float(i) for i in range(6, 200)])
+        self.assertEqual(reader.lastSequence, 0x00B7)
+        self.assertEqual(reader.lost, 0)
+
+    def testHistoryCountsWhatWasDroppedAcrossWrap(self):
+        # Only the newest 20 kept, 0x0004 through 0x0017
+        reader = HistoryReader(_HistoryPeripheral(_history(20, 0xFFF0, 40)))
+        samples = reader.pull(since=0xFFF5)
+        self.assertEqual([sample["temp"] for sample in samples], [float(i) for i in range(20, 40)])
+        self.assertEqual(reader.lost, 14)
+        self.assertEqual(reader.lastSequence, 0x0017)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+# Run from the repo root: python -m unittest discover tests
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from codecz import recordSpan
+from manifestz import LINE_BYTES, LocalFs, Manifest, makeEntries
+
+# Records every 10 minutes from late January to early February, so ranges cross shards
+NAMES = ["record.2024%02d%02d%02d%02d00.json" % (month, day, hour, minute)
+         for month, days in ((1, range(30, 32)), (2, range(1, 3)))
+         for day in days for hour in range(24) for minute in range(0, 60, 10)]
+FIRSTS = [recordSpan(name)[0] for name in NAMES]
+
+class ManifestLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        for name in NAMES:
+            with open(os.path.join(self.work, name), "wb") as f:
+                f.write(b"{}")
+        self.fs = LocalFs()
+        self.manifest = Manifest(self.work)
+        self.manifest.rebuild(self.fs, checksums=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def listed(self, start, end):
+        # What listing the directory instead would find
+        return [name for name, first in zip(NAMES, FIRSTS) if start <= first <= end]
+
+    def lookup(self, start, end):
+        return [entry[2] for entry in self.manifest.lookup(self.fs, start, end)]
+
+    def testMatchesListing(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            start, end = sorted(rng.sample(FIRSTS, 2))
+            self.assertEqual(self.lookup(start, end), self.listed(start, end))
+
+    def testEdges(self):
+        self.assertEqual(self.lookup(20240130000000, 20240130000000), [NAMES[0]])
+        self.assertEqual(self.lookup(20240130000001, 20240130000959), [])
+        self.assertEqual(self.lookup(20240202235000, 20241231235959), [NAMES[-1]])
+        self.assertEqual(self.lookup(20231201000000, 20240129235959), [])
+        # Straddling the shard boundary
+        self.assertEqual(self.lookup(20240131235000, 20240201000000),
+                         ["record.20240131235000.json", "record.20240201000000.json"])
+
+    def testAddOutOfOrderAndTornLine(self):
+        late = "record.20240131120500.json"
+        self.manifest.add(self.fs, makeEntries(late, 2, 0, 0))
+        self.assertEqual(self.lookup(20240131120000, 20240131121000),
+                         ["record.20240131120000.json", late, "record.20240131121000.json"])
+
+        # A crash mid-append leaves part of a line, which lookups leave out
+        with open(os.path.join(self.work, "manifest", "202402.idx"), "ab") as f:
+            f.write(b"x" * (LINE_BYTES // 2))
+        self.assertEqual(self.lookup(20240202235000, 20240202235000), [NAMES[-1]])
+
+if __name__ == "__main__":
+    unittest.main()
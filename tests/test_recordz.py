@@ -0,0 +1,173 @@
+# Run from the repo root: python -m unittest discover tests
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+import recordz
+from recordz import ArchiveRecord, LiveRecord, toDateStr
+from cachez import ArchiveCache
+from remotez import SftpPool, UploadWorker
+from walz import WriteAheadLog
+from codecz import encodeColumns, readRows, recordFileName
+from rollupz import RollupStore
+
+START = 1_700_000_000 # [s]
+UNITS = {"temp": "F", "count": "", "door": "", "label": "", "extra": "%"}
+
+class _Unreachable:
+    # RangerLab out of reach, so the archive loads straight from the cache
+    def listRecordAttrs(self, start, end):
+        raise ConnectionError("offline")
+
+class _CachedRollups(_Unreachable):
+    # Rollup tiers are already in the cache, records can't be listed
+    def fetchIfChanged(self, name, localDir):
+        return os.path.join(localDir, name)
+
+def _rows(i):
+    first = START + i * 600
+    rows = []
+    for j in range(6):
+        row = {"timestamp": first + j * 100, "temp": 60.5 + j, "count": i * 10 + j,
+               "door": bool(j % 2), "label": f"r{i}"}
+        if i % 5 == 0:
+            # Only some records carry this sensor
+            row["extra"] = j
+        rows.append(row)
+    return rows
+
+class ParallelLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.cache = ArchiveCache(os.path.join(self.work, "cache"))
+        os.makedirs(self.cache.directory, exist_ok=True)
+        self.records = recordz.PARALLEL_MIN_FILES + 6
+        for i in range(self.records):
+            rows = _rows(i)
+            if i % 2:
+                columns = {name: [row.get(name) for row in rows] for name in rows[0]}
+                data = encodeColumns(columns, UNITS, columnar=True)
+            else:
+                data = json.dumps({"sensor_data": rows, "sensor_units": UNITS}).encode("utf-8")
+            with open(self.cache.path(recordFileName(toDateStr(START + i * 600))), "wb") as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def load(self, start, end, workers):
+        record = ArchiveRecord(toDateStr(start), toDateStr(end), fetcher=_Unreachable(),
+                               cache=self.cache, load=False, workers=workers)
+        record.archiveFilesToDataFrame()
+        return record.dataFrame
+
+    def assertSameLoad(self, start, end):
+        serial = self.load(start, end, workers=1)
+        parallel = self.load(start, end, workers=2)
+        self.assertIsNotNone(serial)
+        pd.testing.assert_frame_equal(serial, parallel, check_dtype=True)
+        return serial
+
+    def testWholeRange(self):
+        frame = self.assertSameLoad(START, START + self.records * 600)
+        self.assertEqual(len(frame), self.records * 6)
+        self.assertEqual(frame["count"].dtype.kind, "i")
+        self.assertEqual(frame["door"].dtype.kind, "b")
+        self.assertEqual(frame["extra"].dtype.kind, "f")
+
+    def testTrimmedRange(self):
+        # Starts and ends partway through a record
+        self.assertSameLoad(START + 250, START + (self.records - 1) * 600 + 250)
+
+class RollupFreshnessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.cache = ArchiveCache(os.path.join(self.work, "cache"))
+        os.makedirs(self.cache.directory, exist_ok=True)
+        self.records = 48    # 8 hours of 10 minute records
+        paths = []
+        for i in range(self.records):
+            path = self.cache.path(recordFileName(toDateStr(START + i * 600)))
+            with open(path, "wb") as f:
+                f.write(json.dumps({"sensor_data": _rows(i), "sensor_units": UNITS}).encode("utf-8"))
+            paths.append(path)
+        # The rollups were last built partway through the archive
+        self.rolledUp = self.records // 2 + 3
+        RollupStore(self.cache.directory).updateRecordFiles(paths[:self.rolledUp])
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def testRecordsAfterNewestBucketAreRolledUp(self):
+        record = ArchiveRecord(toDateStr(START), toDateStr(START + self.records * 600), fetcher=_CachedRollups(),
+                               cache=self.cache, resolution=3600, workers=1)
+        self.assertEqual(record.tier, "hour")
+        frame = record.dataFrame
+        self.assertEqual(int(frame["count_count"].sum()), self.records * 6)
+        self.assertTrue(frame["timestamp"].is_monotonic_increasing)
+        self.assertTrue(frame["timestamp"].is_unique)
+        last = START + (self.records - 1) * 600
+        self.assertEqual(frame["timestamp"].iloc[-1], last // 3600 * 3600)
+
+class _LocalRecord(LiveRecord):
+    # Saves into the test's directory instead of the repo's outRecords
+    outDir = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outRecordsDir = self.outDir
+
+def _uploader():
+    # Never started, so whatever is handed to it stays in its queue
+    return UploadWorker(SftpPool(host="127.0.0.1"), manifest=False)
+
+class RecoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        _LocalRecord.outDir = os.path.join(self.work, "out")
+        self.walDir = os.path.join(self.work, "wal")
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def crashedRun(self):
+        wal = WriteAheadLog(self.walDir, syncInterval=0)
+        # Saved and queued for upload, but never uploaded
+        saved = _LocalRecord(None, wal=wal, uploader=_uploader())
+        saved.processSamples([{"temp": i, "timestamp": START + i} for i in range(3)], UNITS)
+        savedPath = saved.finish()
+        # Never saved at all
+        unsaved = _LocalRecord(None, wal=wal, uploader=_uploader())
+        unsaved.processSamples([{"temp": i, "timestamp": START + 600 + i} for i in range(5)], UNITS)
+        wal.sync()
+        return savedPath
+
+    def testRecoveredRecordsAreQueuedOnce(self):
+        savedPath = self.crashedRun()
+
+        wal = WriteAheadLog(self.walDir, syncInterval=0)
+        uploader = _uploader()
+        recovered = _LocalRecord.recover(wal, uploader=uploader)
+        self.assertEqual(len(recovered), 2)
+        self.assertIn(savedPath, recovered)
+        # What simple-central does next, the recovered files mustn't go twice
+        uploader.submitDir(_LocalRecord.outDir, skip=recovered)
+        queued = [uploader.queue.get_nowait() for _ in range(uploader.queue.qsize())]
+        self.assertEqual(sorted(path for path, _, _ in queued), sorted(recovered))
+
+        # The record rebuilt from the log holds every sample logged
+        self.assertEqual(sorted(len(readRows(path)[0][0]) for path in recovered), [3, 5])
+
+        # Once uploaded, each record's segment goes
+        for path, _, done in queued:
+            done(path)
+        self.assertEqual(wal.leftovers(), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# Run from the repo root: python -m unittest discover tests
+
+import os
+import shutil
+import tempfile
+import unittest
+from walz import WriteAheadLog, readSegment
+
+UNITS = {"temp": "F"}
+
+class WriteAheadLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        # No background thread, only syncEvery decides when samples are fsynced
+        self.wal = WriteAheadLog(self.work, syncEvery=4, syncInterval=0).start()
+
+    def tearDown(self):
+        self.wal.stop()
+        shutil.rmtree(self.work)
+
+    def testGroupCommitAcrossSegments(self):
+        first = self.wal.open("AA:BB")
+        second = self.wal.open("CC:DD")
+        for i in range(3):
+            first.append({"temp": i, "timestamp": i}, UNITS)
+        # Written, but waiting in the file buffer for the group's fsync
+        self.assertEqual(self.wal.syncs, 0)
+        self.assertEqual(readSegment(first.path)["samples"], [])
+
+        second.append({"temp": 9, "timestamp": 9}, UNITS)
+        # The fourth sample, in another segment, commits both
+        self.assertEqual(self.wal.syncs, 1)
+        self.assertEqual(len(readSegment(first.path)["samples"]), 3)
+        self.assertEqual(readSegment(second.path)["source"], "CC:DD")
+        self.assertEqual(len(readSegment(second.path)["samples"]), 1)
+
+    def testTornEntryIsCutOffOnResume(self):
+        segment = self.wal.open("AA:BB")
+        for i in range(5):
+            segment.append({"temp": i, "timestamp": i}, UNITS)
+        segment.close()
+        # Power lost partway through writing a sixth entry
+        with open(segment.path, "ab") as f:
+            f.write(b"\x40\x00\x00\x00\x12\x34")
+
+        [(path, logged)] = self.wal.leftovers()
+        self.assertEqual([sample["temp"] for sample in logged["samples"]], list(range(5)))
+        self.assertEqual(logged["units"], UNITS)
+        self.assertIsNone(logged["record"])
+
+        resumed = self.wal.resume(path, logged["source"], logged["intact"])
+        resumed.seal(os.path.join(self.work, "record.20240101000000.json"))
+        resumed.close()
+        # Appended after the cut, the seal is read back instead of being lost behind the torn entry
+        self.assertEqual(readSegment(path)["record"], "record.20240101000000.json")
+        self.assertEqual(len(readSegment(path)["samples"]), 5)
+
+    def testDiscardRemovesSegment(self):
+        segment = self.wal.open()
+        segment.append({"temp": 1, "timestamp": 1}, UNITS)
+        segment.discard()
+        self.assertEqual(self.wal.leftovers(), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,224 @@
+import os
+import json
+import struct
+import threading
+import time
+import zlib
+
+
+# Each entry is its payload length and crc32, then the payload: compact JSON
+# holding one of {"source": ...} (first entry only), {"u": units} whenever the
+# units change, {"s": sample}, or {"r": record file name} once the samples are
+# safely in that record file. A torn entry at the end, from power loss
+# mid-write, fails its crc and ends the replay there.
+ENTRY_HEADER = "<II"
+WAL_SYNC_EVERY = 32 # [samples] across all segments per fsync, 1 makes every sample durable on return
+WAL_SYNC_INTERVAL = 1.0 # [s] longest an appended sample waits for its fsync
+SEGMENT_SUFFIX = ".log"
+
+def encodeEntry(payload: dict):
+    data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return struct.pack(ENTRY_HEADER, len(data), zlib.crc32(data)) + data
+
+def readEntries(path):
+    """
+    Yields (payload, offset just past the entry) for each intact entry,
+    stopping at the first torn or corrupt one.
+    """
+    header_size = struct.calcsize(ENTRY_HEADER)
+    offset = 0
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(header_size)
+            if len(header) < header_size:
+                return
+            length, crc = struct.unpack(ENTRY_HEADER, header)
+            data = f.read(length)
+            if len(data) < length or zlib.crc32(data) != crc:
+                return
+            try:
+                payload = json.loads(data)
+            except ValueError:
+                return
+            offset += header_size + length
+            yield payload, offset
+
+def readSegment(path):
+    """
+    Returns {"source", "units", "samples", "record", "intact"} from a segment,
+    "record" being the record file it was sealed with or None, and "intact"
+    how many bytes of it are whole entries.
+    """
+    segment = {"source": None, "units": {}, "samples": [], "record": None, "intact": 0}
+    for payload, segment["intact"] in readEntries(path):
+        if "s" in payload:
+            segment["samples"].append(payload["s"])
+        elif "u" in payload:
+            segment["units"].update(payload["u"])
+        elif "r" in payload:
+            segment["record"] = payload["r"]
+        elif "source" in payload:
+            segment["source"] = payload["source"]
+    return segment
+
+class WalSegment:
+    """
+    The log of one LiveRecord's samples. Appends go through the owning
+    WriteAheadLog, which batches their fsyncs.
+    """
+
+    def __init__(self, wal, path, source=None, resume=False):
+        self.wal = wal
+        self.path = path
+        self.source = source
+        self.units = None
+        self.samples = 0
+        self.file = open(path, "ab")
+        if not resume:
+            self.wal._write(self, encodeEntry({"source": source}))
+
+    def append(self, sample: dict, units: dict = None):
+        entry = b""
+        if units and units != self.units:
+            self.units = dict(units)
+            entry += encodeEntry({"u": self.units})
+        entry += encodeEntry({"s": sample})
+        self.samples += 1
+        self.wal._write(self, entry, samples=1)
+
+    def seal(self, recordPath):
+        """
+        Notes that every sample is now in recordPath, and makes that durable.
+        """
+        self.wal._write(self, encodeEntry({"r": os.path.basename(recordPath)}))
+        self.wal.sync()
+
+    def close(self):
+        self.wal._close(self)
+
+    def discard(self, *_):
+        """
+        Deletes the segment, once its record has landed on RangerLab.
+        """
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class WriteAheadLog:
+    """
+    Append-only local log of every sample a LiveRecord takes in, so a crash or
+    power cut loses at most the last syncEvery samples / syncInterval seconds
+    instead of a whole record. Samples from every open segment share one group
+    commit: they are written as they arrive and fsynced together once
+    syncEvery have piled up, or every syncInterval seconds from a background
+    thread, whichever comes first. A segment is deleted once the record it
+    turned into has been uploaded; recover() replays whatever a crash left.
+    """
+
+    def __init__(self, directory, syncEvery=WAL_SYNC_EVERY, syncInterval=WAL_SYNC_INTERVAL):
+        self.directory = directory
+        self.syncEvery = syncEvery
+        self.syncInterval = syncInterval
+        os.makedirs(directory, exist_ok=True)
+
+        self.appended = 0
+        self.syncs = 0
+        self._unsynced = 0
+        self._dirty = set()
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.syncInterval:
+            self._thread = threading.Thread(target=self._run, name="wal-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sync()
+
+    def open(self, source=None):
+        with self._lock:
+            self._sequence += 1
+            name = f"wal.{time.time_ns()}.{self._sequence}{SEGMENT_SUFFIX}"
+        segment = WalSegment(self, os.path.join(self.directory, name), source)
+        # The new file's entry in the directory has to survive a power cut too,
+        # fsyncing the file alone doesn't make it durable
+        self.syncDirectory()
+        return segment
+
+    def syncDirectory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def segmentPaths(self):
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.startswith("wal.") and name.endswith(SEGMENT_SUFFIX))
+
+    def _write(self, segment, entry, samples=0):
+        with self._lock:
+            segment.file.write(entry)
+            self._dirty.add(segment)
+            self.appended += samples
+            self._unsynced += samples
+            if self.syncEvery and self._unsynced >= self.syncEvery:
+                self._syncLocked()
+
+    def _syncLocked(self):
+        for segment in self._dirty:
+            if segment.file.closed:
+                continue
+            segment.file.flush()
+            os.fsync(segment.file.fileno())
+        if self._dirty:
+            self.syncs += 1
+        self._dirty.clear()
+        self._unsynced = 0
+
+    def sync(self):
+        with self._lock:
+            self._syncLocked()
+
+    def _close(self, segment):
+        with self._lock:
+            if segment.file.closed:
+                return
+            if segment in self._dirty:
+                segment.file.flush()
+                os.fsync(segment.file.fileno())
+                self._dirty.discard(segment)
+            segment.file.close()
+
+    def _run(self):
+        while not self._stop.wait(self.syncInterval):
+            try:
+                self.sync()
+            except OSError as e:
+                print(f"Write-ahead log sync failed: {e}")
+
+    def resume(self, path, source=None, intact=None):
+        """
+        Reopens a segment left by an earlier run, to seal or discard it. A torn
+        entry at the end is cut off first, or it would hide anything after it.
+        """
+        if intact is not None and os.path.getsize(path) > intact:
+            os.truncate(path, intact)
+        return WalSegment(self, path, source, resume=True)
+
+    def leftovers(self):
+        """
+        Segments an earlier run didn't finish, as (path, readSegment(path)).
+        Call before opening new segments.
+        """
+        return [(path, readSegment(path)) for path in self.segmentPaths()]